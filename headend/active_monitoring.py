@@ -1,67 +1,114 @@
 # active_monitoring.py
 
+import logging
 import threading
 import time
 import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from ping3 import ping
 import websockets
 
+from icmp_prober import BatchedIcmpProber
+from instrumentation import REGISTRY
+from ws_pool import get_pool, run_on_thread_loop
+
+logger = logging.getLogger(__name__)
+
+ACTIVE_CYCLE_SECONDS = REGISTRY.histogram('headend_active_cycle_seconds', 'Duration of an active monitoring cycle', ('engine',),
+                                          buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800))
+ACTIVE_PROBES = REGISTRY.counter('headend_active_probes_total', 'Active probes by resulting status', ('status',))
+
 class ActiveMonitoring:
-    """Maintains a set number of threads that perform active monitoring on assigned FDs."""
+    """
+    Performs active monitoring on the FDs.
 
-    def __init__(self, field_devices, fd_locks, num_threads):
+    Two engines are available:
+    - 'threads': a set number of threads, each monitoring a fixed subset of FDs one at a time.
+    - 'asyncio': one long-lived event loop probing all FDs concurrently, with at most
+      max_concurrency probes in flight.
+    """
+
+    def __init__(self, field_devices, fd_locks, num_threads, engine='threads', max_concurrency=500, ping_workers=64, icmp_backend='ping3',
+                 history=None, classifier=None, time_monitoring_cycle=10, fd_interval=1,
+                 ping_count=5, ping_timeout=2, throughput_probe_bytes=1024 * 100):
         self.field_devices = field_devices
         self.fd_locks = fd_locks
         self.num_threads = num_threads
+        self.engine = engine
+        self.max_concurrency = max_concurrency  # Max in-flight probes for the asyncio engine
+        self.ping_workers = ping_workers  # Threads available to the blocking ping calls of the asyncio engine
+        # 'ping3' sends one ping at a time, 'batched' pings many hosts at once from one ICMP socket
+        self.icmp_prober = BatchedIcmpProber() if icmp_backend == 'batched' else None
+        self.history = history  # Optional MetricsHistory, keeps every sample
+        self.classifier = classifier  # e.g. a ConnectionClassifier (EWMA + hysteresis); None classifies single samples
         self.active_threads = []
         self.stop_event = threading.Event()
         self.field_device_ids = list(self.field_devices.keys())
-        self.time_monitoring_cycle = 10 #Time in seconds between cycles
+        self.time_monitoring_cycle = time_monitoring_cycle #Time in seconds between cycles
+        self.fd_interval = fd_interval  # Seconds between FDs of a 'threads' engine thread
+        self.ping_count = ping_count  # Echo requests per FD and cycle
+        self.ping_timeout = ping_timeout  # Seconds to wait for an echo reply
+        self.throughput_probe_bytes = throughput_probe_bytes  # Payload of the WebSocket throughput test
 
     def start(self):
-        # Calculate the number of field devices per thread
-        fd_ids = self.field_device_ids
-        total_fds = len(fd_ids)
-        fd_range_general = total_fds // self.num_threads
-        fd_range_rest = total_fds % self.num_threads
-
-        # Create ranges for each thread
-        fd_ranges = []
-        start_index = 0
-        for i in range(self.num_threads):
-            if i == self.num_threads - 1:
-                # Last thread gets the rest
-                end_index = start_index + fd_range_general + fd_range_rest
-            else:
-                end_index = start_index + fd_range_general
-            fd_ranges.append((start_index, end_index))
-            start_index = end_index  # Update start_index without adding 1
+        if self.engine == 'asyncio':
+            t = threading.Thread(target=self.run_async_engine, daemon=True)
+            t.start()
+            self.active_threads.append(t)
+            logger.info("Async engine is monitoring %d field devices with up to %d concurrent probes", len(self.field_device_ids), self.max_concurrency)
+            return
 
         # Start threads with their assigned FDs
-        for i, (start, end) in enumerate(fd_ranges):
-            fd_ids_subset = fd_ids[start:end]
-            t = threading.Thread(target=self.monitor_fds_subset, args=(fd_ids_subset,), daemon=True)
+        for i in range(self.num_threads):
+            t = threading.Thread(target=self.monitor_fds_subset, args=(i,), daemon=True)
             t.start()
             self.active_threads.append(t)
-            print(f"Thread {i+1} is monitoring field devices {start} to {end - 1}\n")
+            start, end = self.fd_range(i)
+            logger.info("Thread %d is monitoring field devices %d to %d", i + 1, start, end - 1)
+
+    def fd_range(self, index):
+        """(start, end) of the slice of field_device_ids monitored by thread index."""
+        total_fds = len(self.field_device_ids)
+        fd_range_general = total_fds // self.num_threads
+        fd_range_rest = total_fds % self.num_threads
+        start_index = index * fd_range_general
+        end_index = start_index + fd_range_general
+        if index == self.num_threads - 1:
+            # Last thread gets the rest
+            end_index += fd_range_rest
+        return start_index, end_index
 
+    def set_fd_ids(self, fd_ids):
+        """
+        Change the FDs being monitored, e.g. when a shard's assignment changes. Takes effect
+        from the next cycle of each thread (or of the asyncio engine), probes in flight finish.
+        """
+        self.field_device_ids = list(fd_ids)
+        logger.info("Active monitoring now covers %d field devices", len(self.field_device_ids))
 
-    def monitor_fds_subset(self, fd_ids_subset):
-        print(f"Monitoring subset for {fd_ids_subset}")
+    def monitor_fds_subset(self, index):
         while not self.stop_event.is_set():
+            # Re-slice every cycle so set_fd_ids() reaches running threads
+            start, end = self.fd_range(index)
+            fd_ids_subset = self.field_device_ids[start:end]
+            logger.debug("Monitoring subset for %s", fd_ids_subset)
+            cycle_start = time.monotonic()
             for fd_id in fd_ids_subset:
+                if self.stop_event.is_set():
+                    break
                 self.active_monitoring_cycle(fd_id)
                 # Optionally sleep between FDs
-                time.sleep(1)
+                time.sleep(self.fd_interval)
+            ACTIVE_CYCLE_SECONDS.observe(time.monotonic() - cycle_start, engine='threads')
             # Sleep before starting the next monitoring cycle
-            time.sleep(self.time_monitoring_cycle)
+            self.stop_event.wait(self.time_monitoring_cycle)
 
     def active_monitoring_cycle(self, fd_id):
         #print(f"Started Monitoring on Field Device {fd_id}\n")
         fd_info = self.field_devices.get(fd_id)
         if not fd_info:
-            print(f"FD {fd_id} not found in field_devices.")
+            logger.warning("FD %s not found in field_devices", fd_id)
             return
 
         ip_address = fd_info['ip_address']
@@ -71,20 +118,111 @@ class ActiveMonitoring:
         latency, packet_loss = self.ping_icmp_test(ip_address)
 
         # Step 2: Throughput Testing using WebSockets
-        throughput = asyncio.run(self.throughput_test(ip_address, port))
+        throughput = run_on_thread_loop(self.throughput_test(ip_address, port))
         if throughput is None:
             # Set throughput to 0 if testing failed
             throughput = 0.0
 
+        if fd_id not in self.field_devices:
+            return  # Removed while it was probed
+
         # Step 3: Classify connection
-        status = self.classify_connection(latency, packet_loss, throughput)
+        status = self.classify_fd(fd_id, latency, packet_loss, throughput)
+
+        # Step 4: Analysis & Storage of Results (one atomic store update, no per-FD lock needed)
+        self.analyze_and_store_results(fd_info, fd_id, latency, packet_loss, throughput, status)
+
+    def run_async_engine(self):
+        """Run the asyncio engine on its own long-lived event loop."""
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            loop.run_until_complete(self.async_monitoring_loop())
+        finally:
+            loop.close()
+
+    async def async_monitoring_loop(self):
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        pool = get_pool()
+        with ThreadPoolExecutor(max_workers=self.ping_workers, thread_name_prefix='ping') as ping_executor:
+            while not self.stop_event.is_set():
+                await self.run_cycle(semaphore, ping_executor)
+
+                # Sleep before starting the next monitoring cycle
+                await self.wait_or_stop(self.time_monitoring_cycle)
+        await pool.close()
 
-        # Step 4: Analysis & Storage of Results
-        with self.fd_locks[fd_id]:
-            self.analyze_and_store_results(fd_info, fd_id, latency, packet_loss, throughput, status)
+    async def run_cycle(self, semaphore, ping_executor):
+        """Probe every FD once. Returns the cycle time in seconds."""
+        cycle_start = time.monotonic()
+        fd_ids = self.field_device_ids  # set_fd_ids() may swap the list mid-cycle
+        ping_results = None
+        if self.icmp_prober:
+            # Ping the whole fleet in one batch before the throughput tests
+            ip_addresses = [fd_info['ip_address'] for fd_info in map(self.field_devices.get, fd_ids) if fd_info]
+            loop = asyncio.get_running_loop()
+            ping_results = await loop.run_in_executor(ping_executor, self.icmp_prober.probe, ip_addresses,
+                                                      self.ping_count, self.ping_timeout)
 
-    def ping_icmp_test(self, ip_address, count=5, timeout=2):
+        await asyncio.gather(*(self.async_probe_fd(fd_id, semaphore, ping_executor, ping_results) for fd_id in fd_ids))
+        cycle_time = time.monotonic() - cycle_start
+        ACTIVE_CYCLE_SECONDS.observe(cycle_time, engine='asyncio')
+        logger.info("Active monitoring cycle over %d FDs took %.2f s | Connection reuse: %.0f%%",
+                    len(fd_ids), cycle_time, get_pool().reuse_rate * 100,
+                    extra={'event': 'active_cycle', 'duration_s': cycle_time})
+        return cycle_time
+
+    async def async_probe_fd(self, fd_id, semaphore, ping_executor, ping_results=None):
+        fd_info = self.field_devices.get(fd_id)
+        if not fd_info:
+            logger.warning("FD %s not found in field_devices", fd_id)
+            return
+
+        ip_address = fd_info['ip_address']
+        port = fd_info.get('port', 80)
+
+        async with semaphore:
+            if self.stop_event.is_set():
+                return
+
+            # Step 1: Ping & ICMP Testing (blocking, so it runs on the ping executor unless already batched)
+            if ping_results is not None:
+                latency, packet_loss = ping_results.get(ip_address, (None, 100.0))
+            else:
+                loop = asyncio.get_running_loop()
+                latency, packet_loss = await loop.run_in_executor(ping_executor, self.ping_icmp_test, ip_address)
+
+            # Step 2: Throughput Testing using WebSockets
+            throughput = await self.throughput_test(ip_address, port)
+            if throughput is None:
+                throughput = 0.0
+
+        if fd_id not in self.field_devices:
+            return  # Removed while it was probed
+
+        # Step 3: Classify connection
+        status = self.classify_fd(fd_id, latency, packet_loss, throughput)
+
+        # Step 4: Analysis & Storage of Results (one atomic store update, no per-FD lock needed)
+        self.analyze_and_store_results(fd_info, fd_id, latency, packet_loss, throughput, status)
+
+    async def wait_or_stop(self, seconds):
+        """Sleep for the given time, waking up early if the module is stopped."""
+        deadline = time.monotonic() + seconds
+        while not self.stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(min(remaining, 1))
+
+    def ping_icmp_test(self, ip_address, count=None, timeout=None):
         """Measure latency and packet loss using ICMP echo requests (ping)."""
+        count = self.ping_count if count is None else count
+        timeout = self.ping_timeout if timeout is None else timeout
+        if self.icmp_prober:
+            # All pings are in flight at once, so an unreachable FD costs one timeout, not count * timeout
+            return self.icmp_prober.probe([ip_address], count=count, timeout=timeout)[ip_address]
+
         latencies = []
         successful_pings = 0
 
@@ -95,7 +233,7 @@ class ActiveMonitoring:
                     latencies.append(latency)  # Latency is already in milliseconds
                     successful_pings += 1
             except Exception as e:
-                print(f"Ping to {ip_address} failed: {e}")
+                logger.warning("Ping to %s failed: %s", ip_address, e, extra={'event': 'ping_failed'})
 
         if successful_pings > 0:
             avg_latency = sum(latencies) / successful_pings
@@ -107,14 +245,14 @@ class ActiveMonitoring:
         return avg_latency, packet_loss
 
 
-    async def throughput_test(self, ip_address, port=80, data_size=1024 * 100):
-        """Estimate throughput by sending and receiving data over WebSocket."""
+    async def throughput_test(self, ip_address, port=80, data_size=None):
+        """Estimate throughput by sending and receiving data over a pooled WebSocket connection."""
         try:
-            uri = f"ws://{ip_address}:{port}"
-            start_time = time.time()
-            async with websockets.connect(uri, timeout=5) as websocket:
+            async with get_pool().connection(ip_address, port) as websocket:
+                # Time only the transfer, the handshake of a new connection is not part of the throughput
+                start_time = time.time()
                 # Send data to the FD
-                data_to_send = 'a' * data_size  # Sending 100 KB of data
+                data_to_send = 'a' * (data_size or self.throughput_probe_bytes)  # 100 KB of data by default
                 await websocket.send(data_to_send)
                 # Optionally receive data back
                 try:
@@ -132,9 +270,17 @@ class ActiveMonitoring:
                 throughput = None
             return throughput
         except Exception as e:
-            #print(f"Throughput test failed for FD {ip_address}:{port} - {e}")
+            logger.debug("Throughput test failed for FD %s:%s - %s", ip_address, port, e, extra={'event': 'throughput_failed'})
             return None
 
+    def classify_fd(self, fd_id, latency, packet_loss, throughput):
+        """Record the sample and classify on smoothed metrics (classifier), so one noisy sample does not flip the status."""
+        if self.history is not None:
+            self.history.record(fd_id, 'active', latency=latency, packet_loss=packet_loss, throughput=throughput)
+        if self.classifier is not None:
+            return self.classifier.classify(fd_id, 'active', latency, packet_loss, throughput)
+        return self.classify_connection(latency, packet_loss, throughput)
+
     def classify_connection(self, latency, packet_loss, throughput):
         """Classify the connection based on latency, packet loss, and throughput."""
         if latency is None or packet_loss == 100.0:
@@ -150,21 +296,27 @@ class ActiveMonitoring:
             return 'Unavailable'  # Default to 'Poor' if none of the above conditions match
 
     def analyze_and_store_results(self, fd_info, fd_id, latency, packet_loss, throughput, status):
-        """Store results in the fd_info."""
+        """Store results in the device store."""
         timestamp = datetime.now()
 
-        # Update the fd_info dictionary
-        active_metrics = fd_info.get('active_metrics', {})
-        active_metrics['latency'] = latency
-        active_metrics['packet_loss'] = packet_loss
-        active_metrics['throughput'] = throughput
-        active_metrics['status'] = status
-        active_metrics['last_active'] = timestamp
-        fd_info['active_metrics'] = active_metrics
+        # Update all active metrics at once, so readers never see a half-written record
+        self.field_devices.update_metrics(fd_id, 'active_metrics', {
+            'latency': latency,
+            'packet_loss': packet_loss,
+            'throughput': throughput,
+            'status': status,
+            'last_active': timestamp,
+        })
+
+        ACTIVE_PROBES.inc(status=status)
 
         # Logging for verification
         ip_address = fd_info['ip_address']
-        print(f"[{timestamp}] FD: {fd_id} (IP: {ip_address}) | Latency: {latency if latency is not None else 'N/A'} ms | Packet Loss: {packet_loss}% | Throughput: {throughput if throughput is not None else 'N/A'} kbps | Status: {status}\n")
+        logger.info("FD: %s (IP: %s) | Latency: %s ms | Packet Loss: %s%% | Throughput: %s kbps | Status: %s",
+                    fd_id, ip_address, latency if latency is not None else 'N/A', packet_loss,
+                    throughput if throughput is not None else 'N/A', status,
+                    extra={'event': 'probe_result', 'fd_id': fd_id, 'latency_ms': latency, 'packet_loss': packet_loss,
+                           'throughput_kbps': throughput, 'status': status})
 
     def stop(self):
         """Stops the active monitoring threads."""
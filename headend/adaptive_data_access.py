@@ -1,133 +1,383 @@
 # adaptive_data_access.py
 
+import asyncio
+import logging
+import math
 import threading
 import time
-from datetime import datetime, timedelta
-import asyncio
-import websockets
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:  # Only needed for the 'numpy' scoring path
+    np = None
+
+from classifier import combine_status_codes
+from device_store import STATUS_CODES
+from fetch_scheduler import FetchScheduler
+from focus_jobs import BACKGROUND_PRIORITY, FocusJob, FocusQueue
+from instrumentation import REGISTRY
+from rate_limit import RegionRateLimiter
+from ws_pool import get_pool, run_on_thread_loop
+
+logger = logging.getLogger(__name__)
+
+ADA_FETCH_SECONDS = REGISTRY.histogram('headend_ada_fetch_seconds', 'Duration of ADA fetches', ('result',))
+ADA_FETCHES_IN_FLIGHT = REGISTRY.gauge('headend_ada_fetches_in_flight', 'ADA fetches in progress')
+ADA_SCHEDULED_FDS = REGISTRY.gauge('headend_ada_scheduled_fds', 'FDs waiting in the ADA fetch schedule')
+ADA_PREEMPTIONS = REGISTRY.counter('headend_ada_preemptions_total', 'Fetches cancelled for a higher priority focus sample')
+FOCUS_JOBS = REGISTRY.gauge('headend_focus_jobs', 'Active backend focus jobs')
+FOCUS_SAMPLE_LATENCY = REGISTRY.histogram('headend_focus_sample_latency_seconds', 'Time from a focus sample being due to its delivery')
+
+# Job id of focus requests sent as a plain FD list; each one replaces the previous
+LEGACY_FOCUS_JOB_ID = 'legacy'
+
+AVAILABLE_STATUSES = ['Good', 'Acceptable', 'Poor']
+AVAILABLE_STATUS_CODES = frozenset(STATUS_CODES[status] for status in AVAILABLE_STATUSES)
+
+def column_array(column):
+    """Zero-copy NumPy view of a DeviceStore column (array.array or shared memory memoryview)."""
+    return np.frombuffer(column, dtype=getattr(column, 'typecode', None) or column.format)
+
 
 class AdaptiveDataAccess:
     """Adjusts data access strategies based on network metrics and backend requests."""
 
-    def __init__(self, field_devices, fd_locks):
+    def __init__(self, field_devices, fd_locks, max_concurrent_fetches=50, region_rate_limits=None, default_region_rate=None,
+                 passive_max_age=600, scoring='auto', ada_wait_time=5, idle_wait=10):
         self.field_devices = field_devices
         self.fd_locks = fd_locks
-        self.focused_fd_ids = None  # None means no specific focus
+        self.focus_queue = FocusQueue()  # Backend focus jobs, scheduled alongside the background fetches
         self.stop_event = threading.Event()
-        self.lock = threading.Lock()  # Lock to protect access to focused_fd_ids
-        self.ada_wait_time = 5 #Time to wait in seconds until a fd has generated a new data point
+        self.ada_wait_time = ada_wait_time #Time to wait in seconds until a fd has generated a new data point
+        self.idle_wait = idle_wait  # Seconds to sleep when no FD is scheduled at all (wakes early on a status change)
+        self.max_concurrent_fetches = max_concurrent_fetches  # Global cap on in-flight fetches
+        # Token bucket per region: {'A1': (fetches per second, burst)}. Regions not listed use default_region_rate (None = unlimited)
+        self.region_limiter = RegionRateLimiter(region_rate_limits, default_region_rate)
+        # Passive statuses older than this (seconds) are ignored when combining them with the active status
+        self.passive_max_age = passive_max_age
+        # available_fds scoring, used to (re)build the fetch heap in bulk: 'python' (column scan),
+        # 'numpy' (vectorized) or 'auto' (numpy when installed)
+        if scoring == 'numpy' and np is None:
+            raise ImportError("scoring='numpy' needs NumPy")
+        self.use_numpy = np is not None if scoring == 'auto' else scoring == 'numpy'
+        # Rows this headend fetches from in the background, one byte per row. None = the whole store (not sharded)
+        self.owned_rows = None
+        # Background fetches running. Off the heap until they end, last_data_received is not updated before that
+        self.in_flight = set()
+        self.deferred = {}  # fd_id -> not before this time (region out of tokens), kept across reschedules
+
+        # Heap of available FDs keyed on next due time, kept up to date by status changes and fetches
+        self.scheduler = FetchScheduler()
+        ADA_SCHEDULED_FDS.set_function(lambda: len(self.scheduler))
+        FOCUS_JOBS.set_function(lambda: len(self.focus_queue))
+        self.schedule_all()
+        self.field_devices.add_status_listener(self.on_status_change)
+        self.field_devices.add_device_listener(self.on_devices_changed)
 
     def run(self):
+        run_on_thread_loop(self.run_pipeline())
+
+    async def run_pipeline(self):
+        """
+        Dispatch due focus samples and due FDs to concurrent fetches, within the global cap.
+        Focus samples go first and, when every slot is taken, preempt the lowest priority
+        fetch below them (background fetches are always preemptible). Background FDs are
+        also held to the region rate limits.
+        """
+        running = {}  # task -> priority of the fetch
+
+        def start(coroutine, priority):
+            task = asyncio.ensure_future(coroutine)
+            running[task] = priority
+            task.add_done_callback(lambda _: (running.pop(task, None), self.scheduler.wake()))
+
         while not self.stop_event.is_set():
-            with self.lock:
-                current_focus = self.focused_fd_ids.copy() if self.focused_fd_ids else None
-
-            if current_focus:
-                # Focus on the requested FDs
-                for fd_id in current_focus:
-                    if self.stop_event.is_set():
-                        break
-                    self.process_fd(fd_id)
-            else:
-                # Process FDs based on twhe adaptive data access logic
-                fd_list = self.get_fds_to_fetch()
-                print(f"Field Device Sorted list: {fd_list}\n")
-                if fd_list:
-                    for fd_id in fd_list:
-                        if self.stop_event.is_set():
-                            break
-                        self.process_fd(fd_id)
-                else:
-                    # No FDs need fetching at this time
-                    print(f"No Current Field Devices that fit ADA Criteria\n")
-                    time.sleep(10)  # Wait before checking again
-            time.sleep(1)  # Adjust as needed
-
-    def get_fds_to_fetch(self):
-        """Identify FDs that are 'available' and need data fetching."""
-        available_fds = []
-        current_time = datetime.now()
+            for job in self.focus_queue.expire():
+                self.end_focus_job(job, 'expired')
+            now = time.time()
+
+            if len(running) >= self.max_concurrent_fetches:
+                priority = self.focus_queue.peek_priority(now)
+                if priority is None or not self.preempt(running, priority):
+                    await self.wait_for_schedule(slots_full=True)
+                    continue
+
+            sample = self.focus_queue.pop_due(now)
+            if sample is not None:
+                job, fd_id, due = sample
+                start(self.process_focus_sample(job, fd_id, due), job.priority)
+                continue
+
+            fd_id = self.scheduler.pop_due(now)
+            if fd_id is None:
+                await self.wait_for_schedule()
+                continue
+
+            if fd_id in self.in_flight:
+                continue  # Put back by a rebuild while it was being taken off, its fetch reschedules it
+            fd_info = self.field_devices.get(fd_id)
+            if fd_info is None:
+                continue  # Removed since it was scheduled
+            # A region out of tokens must not hold up the others, so its FD is put back until a token is due
+            region = fd_info['region']
+            token_wait = self.region_limiter.try_acquire(region)
+            if token_wait:
+                self.reschedule(fd_id, not_before=time.time() + token_wait)
+                continue
+
+            self.deferred.pop(fd_id, None)
+            self.in_flight.add(fd_id)
+            start(self.process_background_fd(fd_id), BACKGROUND_PRIORITY)
+
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    def preempt(self, running, priority):
+        """Cancel the lowest priority fetch below `priority` (the newest of equals). Returns True if one was cancelled."""
+        victim = min(reversed(running), key=running.get, default=None)
+        if victim is None or running[victim] >= priority:
+            return False
+        # The slot counts as free right away; the pool closes the cancelled fetch's connection
+        del running[victim]
+        victim.cancel()
+        ADA_PREEMPTIONS.inc()
+        return True
+
+    async def process_background_fd(self, fd_id):
+        try:
+            await self.process_fd_async(fd_id)
+        finally:
+            # Done, failed or preempted: back in the heap, due from the last_data_received it left
+            self.in_flight.discard(fd_id)
+            self.reschedule(fd_id)
+
+    async def process_focus_sample(self, job, fd_id, due):
+        try:
+            result = await self.process_fd_async(fd_id)
+        except asyncio.CancelledError:
+            self.focus_queue.requeue(job, fd_id, due)  # Preempted by a higher priority job
+            raise
+        except Exception as e:
+            # Counted as a failed sample, so the FD stays in the job and is sampled again next interval
+            logger.exception("Focus sample of FD %s for job %s failed: %s", fd_id, job.job_id, e,
+                             extra={'event': 'focus_sample_failed', 'fd_id': fd_id, 'job_id': job.job_id})
+            result = 'error'
+        if not self.focus_queue.is_active(job):
+            return  # Cancelled while the fetch was running
+        delivered_at = time.time()
+        FOCUS_SAMPLE_LATENCY.observe(delivered_at - due)
+        job.record_sample(fd_id, result, due, delivered_at)
+        self.focus_queue.sample_done(job, fd_id, due, delivered_at)
+
+    async def wait_for_schedule(self, slots_full=False):
+        """
+        Nothing can be dispatched. Sleep until the next FD or focus sample is due, a fetch slot
+        is freed or the schedule changes. With every slot taken only focus samples that are not
+        due yet matter (they may preempt once due).
+        """
+        changes = self.scheduler.changes  # Read before looking at the queues, so a wake from now on is not lost
+        now = time.time()
+        due_times = [self.focus_queue.next_due()]
+        if not slots_full:
+            due_times.append(self.scheduler.next_due())
+        due_times = [due for due in due_times if due is not None and (not slots_full or due > now)]
+        if due_times:
+            timeout = min(max(min(due_times) - now, 0), 1)
+        elif slots_full or len(self.focus_queue):
+            timeout = 1
+        else:
+            logger.debug("No Current Field Devices that fit ADA Criteria")
+            timeout = self.idle_wait  # Wait before checking again (wakes early on a status change)
+        if timeout > 0:
+            await asyncio.get_running_loop().run_in_executor(None, self.scheduler.wait, timeout, changes)
+
+    def set_owned(self, fd_ids):
+        """
+        Only fetch from these FDs in the background (a shard's part of the fleet), or from
+        every FD with None. Focus jobs are not filtered, the coordinator routes them here.
+        """
+        store = self.field_devices
+        if fd_ids is None:
+            self.owned_rows = None
+        else:
+            owned_rows = bytearray(store.rows)
+            for fd_id in fd_ids:
+                owned_rows[store.row_of(fd_id)] = 1
+            self.owned_rows = owned_rows
+        self.schedule_all()
+
+    def is_owned(self, row):
+        owned_rows = self.owned_rows
+        return owned_rows is None or (row < len(owned_rows) and owned_rows[row])
+
+    def schedule_all(self):
+        """Rebuild the fetch heap from the store in one pass over the columns."""
+        self.scheduler.rebuild(self.available_fds)
+
+    def reschedule(self, fd_id, not_before=None):
+        """
+        Put the FD in the fetch heap if it is owned and available, or take it out if not.
+        With not_before, it is not due before then, also after later reschedules.
+        """
+        if fd_id in self.in_flight:
+            return  # process_background_fd() puts it back once the fetch is over
+        row = self.field_devices.index.get(fd_id)
+        if row is None:
+            self.scheduler.remove(fd_id)  # Removed from the store
+            self.deferred.pop(fd_id, None)
+            return
+        status = self.status_code(row)
+        if status not in AVAILABLE_STATUS_CODES or not self.is_owned(row):
+            self.scheduler.remove(fd_id)
+            return
+        last_fetched = self.field_devices.column('last_data_received')[row]
+        if math.isnan(last_fetched):
+            due = float('-inf')  # Never fetched
+        else:
+            due = last_fetched + self.ada_wait_time
+        if not_before is not None:
+            self.deferred[fd_id] = not_before
+        not_before = self.deferred.get(fd_id)
+        if not_before is not None:
+            due = max(due, not_before)
+        self.scheduler.schedule(fd_id, due, status)
+
+    def status_code(self, row, now=None):
+        """Status code used for fetching: the active status combined with a recent passive status."""
+        store = self.field_devices
+        return combine_status_codes(store.column('active_status')[row], store.column('passive_status')[row],
+                                    store.column('passive_last_active')[row], time.time() if now is None else now,
+                                    self.passive_max_age)
 
-        for fd_id, fd_info in self.field_devices.items(): #Key is fd_id and fd_info is the value is manager.dict
-            with self.fd_locks[fd_id]:
-                # Determine overall availability
-                is_available = self.is_fd_available(fd_id, fd_info)
+    def on_status_change(self, fd_id, column, status):
+        if column in ('active_status', 'passive_status'):
+            self.reschedule(fd_id)
 
-                # Get 'last_fetched' timestamp
-                last_fetched_str = fd_info.get('last_data_received')
-                if last_fetched_str:
-                    last_fetched = datetime.fromisoformat(last_fetched_str)
-                else:
-                    last_fetched = datetime.min  # Treat as if never fetched
+    def on_devices_changed(self, added, updated, removed):
+        # FDs added while sharded are not owned (so not scheduled) until the next set_owned()
+        if added:
+            self.schedule_all()  # Registry changes come in batches, a rebuild beats rescheduling one by one
+        for fd_id in removed:
+            self.scheduler.remove(fd_id)
+            self.deferred.pop(fd_id, None)
 
-                time_since_last_fetched = current_time - last_fetched
-                #print(f"Time Since Field Device {fd_id} fetch: {time_since_last_fetched}\n")
+    def available_fds(self):
+        """
+        (due, status, fd_id) of every owned FD that is 'available', the entries reschedule() would
+        put in the fetch heap, in no particular order. FDs being fetched are left out, deferred
+        ones keep their deferral.
+        """
+        entries = self.available_fds_numpy() if self.use_numpy else self.available_fds_python()
+        in_flight = self.in_flight
+        deferred = self.deferred
+        if in_flight or deferred:
+            entries = [(max(due, deferred.get(fd_id, due)), status, fd_id)
+                       for due, status, fd_id in entries if fd_id not in in_flight]
+        return entries
 
-                if is_available and time_since_last_fetched >= timedelta(seconds=self.ada_wait_time):
-                    available_fds.append((fd_id, fd_info, is_available, last_fetched))
+    def available_fds_python(self):
+        """available_fds scoring by a scan over the columns."""
+        current_time = time.time()
 
-        if not available_fds:
-            return []
+        # Scan the device table columns directly. Single column reads are atomic,
+        # so the scan does not need to take the per-FD locks.
+        store = self.field_devices
+        fd_ids = store.fd_ids
+        last_received = store.column('last_data_received')
+        active_status = store.column('active_status')
+        passive_status = store.column('passive_status')
+        passive_last_active = store.column('passive_last_active')
+        owned_rows = self.owned_rows
 
-        # Sort the list by last_fetched (oldest first) and sub-classification
-        # Sub-classification priority: 'Good' > 'Acceptable' > 'Poor'
-        classification_priority = {'Good': 1, 'Acceptable': 2, 'Poor': 3, None: 4}
+        available_fds = []
+        for row, status in enumerate(active_status):
+            if owned_rows is not None and (row >= len(owned_rows) or not owned_rows[row]):
+                continue
+            status = combine_status_codes(status, passive_status[row], passive_last_active[row], current_time, self.passive_max_age)
+            if status not in AVAILABLE_STATUS_CODES:
+                continue
+            last_fetched = last_received[row]
+            due = float('-inf') if math.isnan(last_fetched) else last_fetched + self.ada_wait_time  # Never fetched first
+            available_fds.append((due, status, fd_ids[row]))
+        return available_fds
+
+    def available_fds_numpy(self):
+        """available_fds scoring with NumPy: same entries, computed with array ops over zero-copy views of the columns."""
+        current_time = time.time()
+        store = self.field_devices
+        last_received = column_array(store.column('last_data_received'))
+        active_status = column_array(store.column('active_status'))
+        passive_status = column_array(store.column('passive_status'))
+        passive_last_active = column_array(store.column('passive_last_active'))
+
+        # combine_status_codes for every FD at once
+        with np.errstate(invalid='ignore'):
+            passive_recent = (passive_status != 0) & (current_time - passive_last_active <= self.passive_max_age)
+        status = np.where(passive_recent,
+                          np.where(active_status != 0, np.maximum(active_status, passive_status), passive_status),
+                          active_status)
 
-        available_fds.sort(key=lambda x: (x[3], classification_priority.get(x[2], 4)))
+        due = np.where(np.isnan(last_received), -np.inf, last_received + self.ada_wait_time)  # Never fetched first
+        wanted = np.isin(status, list(AVAILABLE_STATUS_CODES))
+        if self.owned_rows is not None:
+            # The mask may be shorter than the columns if FDs were added since set_owned()
+            owned = np.zeros(len(wanted), dtype=bool)
+            owned_rows = np.frombuffer(self.owned_rows, dtype=np.uint8)[:len(wanted)]
+            owned[:len(owned_rows)] = owned_rows
+            wanted &= owned
+        rows = np.flatnonzero(wanted)
 
-        # Return the list of FD IDs in order
-        return [fd_id for fd_id, _, _, _ in available_fds]
+        fd_ids = store.fd_ids
+        return list(zip(due[rows].tolist(), status[rows].tolist(), [fd_ids[row] for row in rows.tolist()]))
 
     def process_fd(self, fd_id):
         """Process a single FD by attempting to fetch data."""
+        run_on_thread_loop(self.process_fd_async(fd_id))
+
+    async def process_fd_async(self, fd_id):
+        """Fetch from the FD if it is available. Returns 'delivered', 'failed', 'unavailable' or 'unknown'."""
         fd_info = self.field_devices.get(fd_id)
 
         # Check if the fd information actually exists (Ensure)
         if not fd_info:
-            print(f"FD {fd_id} not found in field_devices.\n")
-            return
+            logger.warning("FD %s not found in field_devices", fd_id)
+            return 'unknown'
         
         # Look at classification again. NM runs in background and might have new info.
-        with self.fd_locks[fd_id]:
-            is_available = self.is_fd_available(fd_id, fd_info)
+        # Status reads are atomic and lock-free, so this never waits on a writer.
+        is_available = self.is_fd_available(fd_id, fd_info)
 
         if not is_available:
-            print(f"Field device {fd_id} is marked as Unavailable\n")
-            return
+            logger.info("Field device %s is marked as Unavailable", fd_id, extra={'event': 'fd_unavailable', 'fd_id': fd_id})
+            return 'unavailable'
 
-        success = asyncio.run(self.fetch_data_from_fd(fd_id, fd_info))
-        with self.fd_locks[fd_id]:
-            if success:
-                # Update 'last_data_received' timestamp
-                fd_info['last_data_received'] = datetime.now().isoformat()
-            else:
-                # Label the FD as 'Unavailable' in active metrics
-                if 'active_metrics' not in fd_info: #This should not be an issue. Only to ensure correct setup.
-                    fd_info['active_metrics'] = {}
-                fd_info['active_metrics']['status'] = 'Unavailable'
+        success = await self.fetch_data_from_fd(fd_id, fd_info)
+        if success:
+            # Update 'last_data_received' timestamp
+            self.field_devices.update_record(fd_id, last_data_received=datetime.now())
+            self.reschedule(fd_id)
+            return 'delivered'
+        # Label the FD as 'Unavailable' in active metrics
+        self.field_devices.update_metrics(fd_id, 'active_metrics', {'status': 'Unavailable'})
+        return 'failed'
 
     def is_fd_available(self, fd_id, fd_info):
-        # Determine if FD is available based on active and passive status
-        # For now, only active status is considered
-        # Available if status is 'Good', 'Acceptable', 'Poor', or None
-
-        # Get classification from active monitoring (and make space for passive monitoring)
-        active_status = fd_info.get('active_metrics', {}).get('status')
-        # Placeholder for passive status
-        passive_status = fd_info.get('passive_metrics', {}).get('status')
-
-        available_statuses = ['Good', 'Acceptable', 'Poor'] #Tilføj none til listen hvis ADA skal køre uden nm ranking
-        return active_status in available_statuses
+        # Determine if FD is available based on active and passive status:
+        # the worse of the two, with a stale passive status ignored
+        # Available if status is 'Good', 'Acceptable' or 'Poor'
+        return self.status_code(self.field_devices.row_of(fd_id)) in AVAILABLE_STATUS_CODES #Tilføj none til listen hvis ADA skal køre uden nm ranking
 
     async def fetch_data_from_fd(self, fd_id, fd_info):
         """Fetch data from the FD using WebSockets."""
         # This function can be used both in backend focus and general cycle
         ip_address = fd_info['ip_address']
         port = fd_info.get('port', 80)
-        uri = f"ws://{ip_address}:{port}"
 
+        start = time.perf_counter()
+        ADA_FETCHES_IN_FLIGHT.inc()
         try:
-            async with websockets.connect(uri, timeout=5) as websocket:
+            async with get_pool().connection(ip_address, port) as websocket:
                 # Send a request to fetch data
                 request_message = 'FETCH_DATA'
                 await websocket.send(request_message)
@@ -137,26 +387,53 @@ class AdaptiveDataAccess:
                 # Process the response as needed
                 # For now, we assume any response means success
 
-                print(f"Successfully fetched data from FD {fd_id} at {ip_address}:{port}\n")
+                logger.info("Successfully fetched data from FD %s at %s:%s", fd_id, ip_address, port,
+                            extra={'event': 'fetch_result', 'fd_id': fd_id, 'success': True})
+                ADA_FETCH_SECONDS.observe(time.perf_counter() - start, result='success')
                 return True
 
         except Exception as e:
-            print(f"Failed to fetch data from FD {fd_id} - {e} at {ip_address}:{port}\n")
+            logger.warning("Failed to fetch data from FD %s - %s at %s:%s", fd_id, e, ip_address, port,
+                           extra={'event': 'fetch_result', 'fd_id': fd_id, 'success': False})
+            ADA_FETCH_SECONDS.observe(time.perf_counter() - start, result='failure')
+            return False
+        finally:
+            ADA_FETCHES_IN_FLIGHT.dec()
+
+    def submit_focus_job(self, job):
+        """Start a focus job. A running job with the same job_id is replaced."""
+        replaced = self.focus_queue.submit(job)
+        if replaced is not None:
+            self.end_focus_job(replaced, 'replaced')
+        job.send({'type': 'job_accepted', 'job_id': job.job_id})
+        logger.info("Adaptive Data Access is now focusing on FDs %s (job %s, priority %s, every %.3gs)",
+                    job.fd_ids, job.job_id, job.priority, job.sample_interval)
+        self.scheduler.wake()
+        return job
+
+    def cancel_focus_job(self, job_id):
+        job = self.focus_queue.cancel(job_id)
+        if job is None:
             return False
+        self.end_focus_job(job, 'cancelled')
+        return True
+
+    def end_focus_job(self, job, reason):
+        job.finish(reason)
+        logger.info("Focus job %s %s: %s/%s samples delivered, %s deadlines missed", job.job_id, reason,
+                    job.delivered, job.samples, job.deadline_missed)
 
-    def focus_on_fds(self, fd_ids):
-        # Start focusing on the specified FDs
-        with self.lock:
-            self.focused_fd_ids = fd_ids
-        print(f"Adaptive Data Access is now focusing on FDs: {fd_ids}\n")
+    def focus_on_fds(self, fd_ids, reply=None):
+        # Start focusing on the specified FDs (replaces the previous plain focus request)
+        self.submit_focus_job(FocusJob(fd_ids, job_id=LEGACY_FOCUS_JOB_ID, reply=reply))
 
     def stop_backend_focus(self):
-        # Stop focusing on specific FDs and resume normal operation
-        with self.lock:
-            self.focused_fd_ids = None
-        print("Adaptive Data Access has stopped focusing on specific FDs and will resume normal operation.\n")
+        # Stop every focus job and resume normal operation
+        for job in self.focus_queue.cancel_all():
+            self.end_focus_job(job, 'stopped')
+        logger.info("Adaptive Data Access has stopped focusing on specific FDs and will resume normal operation.")
 
     def stop(self):
         # Stop the entire Adaptive Data Access module
         self.stop_event.set()
-        print("Adaptive Data Access module is stopping.\n")
+        logger.info("Adaptive Data Access module is stopping.")
@@ -0,0 +1,133 @@
+# bench_fd_scoring.py
+#
+# Compares the ways of scoring the fleet for ADA on 1k/10k/100k FD fleets:
+# - legacy: the original get_fds_to_fetch scan over dicts of dicts with per-FD locks and ISO timestamp parsing
+# - python: AdaptiveDataAccess.available_fds, the column scan over the DeviceStore
+# - numpy:  the vectorized NumPy path (skipped when NumPy is not installed)
+# and building the fetch heap from the scores (schedule_all) against rescheduling every FD
+# one by one, as on startup and shard assignment changes.
+# Usage: python benchmarks/bench_fd_scoring.py [--sizes 1000 10000 100000] [--repeat 5]
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import adaptive_data_access
+from adaptive_data_access import AdaptiveDataAccess
+from device_store import DeviceStore
+
+STATUSES = ('Good', 'Acceptable', 'Poor', 'Unavailable', None)
+
+
+def legacy_get_fds_to_fetch(field_devices, fd_locks, ada_wait_time=5):
+    """The original implementation, on the original Manager-dict layout (plain dicts here)."""
+    available_fds = []
+    current_time = datetime.now()
+
+    for fd_id, fd_info in field_devices.items():
+        with fd_locks[fd_id]:
+            active_status = fd_info.get('active_metrics', {}).get('status')
+            is_available = active_status in ['Good', 'Acceptable', 'Poor']
+
+            last_fetched_str = fd_info.get('last_data_received')
+            if last_fetched_str:
+                last_fetched = datetime.fromisoformat(last_fetched_str)
+            else:
+                last_fetched = datetime.min
+
+            if is_available and current_time - last_fetched >= timedelta(seconds=ada_wait_time):
+                available_fds.append((fd_id, fd_info, is_available, last_fetched))
+
+    classification_priority = {'Good': 1, 'Acceptable': 2, 'Poor': 3, None: 4}
+    available_fds.sort(key=lambda x: (x[3], classification_priority.get(x[2], 4)))
+    return [fd_id for fd_id, _, _, _ in available_fds]
+
+
+def make_fleet(num_fds, seed=0):
+    rng = random.Random(seed)
+    now = time.time()
+    fleet = []
+    for fd_id in range(num_fds):
+        # Recently fetched FDs are an hour 'ahead', so they stay not due however long building
+        # the 100k fleets takes, and every implementation agrees on eligibility
+        age = -3600 if rng.random() < 0.3 else rng.uniform(10, 3600)
+        last_received = None if rng.random() < 0.05 else now - age
+        fleet.append((str(fd_id), rng.choice(STATUSES), last_received))
+    return fleet
+
+
+def build_legacy(fleet):
+    field_devices = {}
+    fd_locks = {}
+    for fd_id, status, last_received in fleet:
+        field_devices[fd_id] = {
+            'active_metrics': {'status': status},
+            'passive_metrics': {'status': None},
+            'last_data_received': datetime.fromtimestamp(last_received).isoformat() if last_received else None,
+        }
+        fd_locks[fd_id] = threading.Lock()
+    return field_devices, fd_locks
+
+
+def build_ada(fleet, scoring):
+    store = DeviceStore.from_rows([(fd_id, '127.0.0.1', 'A1', 3000, last) for fd_id, _, last in fleet])
+    for row, (_, status, _) in enumerate(fleet):
+        store.set_status(row, 'active_', status)
+    return AdaptiveDataAccess(store, store.locks, scoring=scoring)
+
+
+def timed(function, repeat):
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ADA fleet scoring implementations')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    has_numpy = adaptive_data_access.np is not None
+    if not has_numpy:
+        print("NumPy not installed: numpy scoring skipped")
+
+    for num_fds in args.sizes:
+        fleet = make_fleet(num_fds)
+        field_devices, fd_locks = build_legacy(fleet)
+        legacy_time, legacy_result = timed(lambda: legacy_get_fds_to_fetch(field_devices, fd_locks), args.repeat)
+        python_ada = build_ada(fleet, 'python')
+        python_time, python_result = timed(python_ada.available_fds, args.repeat)
+        line = f"FDs={num_fds:>7,} | score: legacy {legacy_time * 1000:8.2f} ms | python {python_time * 1000:8.2f} ms"
+
+        # The three must agree on the eligible FDs (legacy only returns those due now)
+        now = time.time()
+        assert {fd_id for due, _, fd_id in python_result if due <= now} == set(legacy_result)
+        ada = python_ada
+        if has_numpy:
+            numpy_ada = build_ada(fleet, 'numpy')
+            numpy_time, numpy_result = timed(numpy_ada.available_fds, args.repeat)
+            assert numpy_result == python_result
+            line += f" | numpy {numpy_time * 1000:8.2f} ms ({legacy_time / numpy_time:.0f}x legacy, {python_time / numpy_time:.1f}x python)"
+            ada = numpy_ada
+
+        fd_ids = ada.field_devices.keys()
+        one_by_one_time, _ = timed(lambda: [ada.reschedule(fd_id) for fd_id in fd_ids], args.repeat)
+        rebuild_time, _ = timed(ada.schedule_all, args.repeat)
+        line += (f" | heap: one by one {one_by_one_time * 1000:8.2f} ms, schedule_all {rebuild_time * 1000:8.2f} ms"
+                 f" ({one_by_one_time / rebuild_time:.1f}x)")
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
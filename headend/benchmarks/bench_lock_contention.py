@@ -0,0 +1,118 @@
+# bench_lock_contention.py
+#
+# Measures DeviceStore lock striping in two parts.
+# Stripe contention: writer threads take the stripe of a random FD and hold it across a
+# blocking section (--hold, a sleep, like I/O done under the lock). Sleeping releases the GIL,
+# so the wait measured is for the stripe only, not for the GIL handoff. Run for different
+# numbers of stripes, against the ideal of writers / hold acquisitions per second.
+# Store throughput: writers update random FDs while one reader (like the ADA scheduler) takes
+# lock-free snapshots and checks them for torn reads. This is bound by the GIL, not the
+# stripes, so it runs with the default stripe count only.
+# Usage: python benchmarks/bench_lock_contention.py [--fds 10000] [--writers 8] [--seconds 3] [--hold 0.001]
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from device_store import DeviceStore
+
+
+def make_store(num_fds, stripes=64):
+    rows = [(fd_id, '127.0.0.1', 'A1', 3000 + fd_id, None) for fd_id in range(num_fds)]
+    return DeviceStore.from_rows(rows, lock_stripes=stripes)
+
+
+def run_threads(targets, seconds):
+    stop_event = threading.Event()
+    threads = [threading.Thread(target=target, args=(stop_event,)) for target in targets]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop_event.set()
+    for t in threads:
+        t.join()
+
+
+def run_contention(num_fds, num_writers, seconds, stripes, hold):
+    store = make_store(num_fds, stripes)
+    fd_ids = store.keys()
+    acquisitions = [0] * num_writers
+
+    def writer(index):
+        def run(stop_event):
+            rng = random.Random(index)
+            while not stop_event.is_set():
+                with store.locks.locked(rng.choice(fd_ids)):
+                    time.sleep(hold)
+                acquisitions[index] += 1
+        return run
+
+    run_threads([writer(i) for i in range(num_writers)], seconds)
+    stats = store.locks.wait_stats()
+    ideal = num_writers / hold
+    rate = sum(acquisitions) / seconds
+    print(
+        f"stripes={stripes:<5} acquisitions/s={rate:>8,.0f} ({rate / ideal:>4.0%} of ideal) "
+        f"lock wait: mean={stats['wait_mean_s'] * 1e3:.3f} ms max={stats['wait_max_s'] * 1e3:.2f} ms "
+        f"total={stats['wait_total_s']:.2f} s"
+    )
+
+
+def run_throughput(num_fds, num_writers, seconds):
+    store = make_store(num_fds)
+    fd_ids = store.keys()
+    writes = [0] * num_writers
+    snapshots = [0]
+    torn = [0]
+
+    def writer(index):
+        def run(stop_event):
+            rng = random.Random(index)
+            while not stop_event.is_set():
+                value = rng.uniform(1, 1000)
+                # All three metrics carry the same value, so a torn read is detectable
+                store.update_metrics(rng.choice(fd_ids), 'active_metrics', {
+                    'latency': value, 'packet_loss': value, 'throughput': value, 'status': 'Good',
+                })
+                writes[index] += 1
+        return run
+
+    def reader(stop_event):
+        rng = random.Random(-1)
+        while not stop_event.is_set():
+            metrics = store.snapshot(rng.choice(fd_ids)).active_metrics
+            if not metrics['latency'] == metrics['packet_loss'] == metrics['throughput']:
+                if metrics['latency'] is not None:
+                    torn[0] += 1
+            snapshots[0] += 1
+
+    run_threads([writer(i) for i in range(num_writers)] + [reader], seconds)
+    print(f"stripes={store.locks.stripes:<5} writes/s={sum(writes) / seconds:>10,.0f} "
+          f"snapshots/s={snapshots[0] / seconds:>10,.0f} torn={torn[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark DeviceStore lock contention')
+    parser.add_argument('--fds', type=int, default=10000)
+    parser.add_argument('--writers', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--hold', type=float, default=0.001, help='Seconds each writer holds its stripe')
+    args = parser.parse_args()
+
+    print(f"Stripe contention | FDs: {args.fds} | Writers: {args.writers} | Hold: {args.hold * 1e3:g} ms | "
+          f"Duration: {args.seconds} s")
+    for stripes in (1, 8, 64, 1024):
+        run_contention(args.fds, args.writers, args.seconds, stripes, args.hold)
+
+    print(f"\nStore throughput (GIL-bound) | FDs: {args.fds} | Writers: {args.writers} | Readers: 1 | "
+          f"Duration: {args.seconds} s")
+    run_throughput(args.fds, args.writers, args.seconds)
+
+
+if __name__ == '__main__':
+    main()
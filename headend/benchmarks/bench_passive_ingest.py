@@ -0,0 +1,110 @@
+# bench_passive_ingest.py
+#
+# Floods PassiveMonitoring with synthetic bulk uploads from many FD connections and reports
+# uploads/s for the JSON and the binary framed format. Each connection has captured packets
+# waiting in the accumulator, like in production.
+# By default the handler is driven in-process with fake connections (measures parsing,
+# analysis and store updates); --live runs the real WebSocket server on localhost and
+# connects --connections clients to it (needs websockets).
+# Usage: python benchmarks/bench_passive_ingest.py [--connections 1000] [--messages 20] [--live]
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clock import ClockService
+from device_store import DeviceStore
+from passive_monitoring import PassiveMonitoring
+from upload_codec import encode_upload
+
+
+class FakeConnection:
+    """Stands in for a websockets connection: remote_address and async iteration over messages."""
+
+    def __init__(self, remote_address, messages):
+        self.remote_address = remote_address
+        self.messages = messages
+
+    def __aiter__(self):
+        return self._iterate()
+
+    async def _iterate(self):
+        for message in self.messages:
+            yield message
+            await asyncio.sleep(0)  # Let other connections run, like network reads would
+
+
+def make_message(fd_id, binary):
+    if binary:
+        return encode_upload(fd_id, time.time())
+    return json.dumps({"device_id": fd_id, "send_timestamp": time.time()})
+
+
+def make_monitor(num_fds, port=8765):
+    rows = [(fd_id, '127.0.0.1', 'A1', 3000 + fd_id, None) for fd_id in range(num_fds)]
+    store = DeviceStore.from_rows(rows)
+    return PassiveMonitoring(field_devices=store, host='127.0.0.1', port=port, clock=ClockService(server=None))
+
+
+def capture_packets(monitor, key, count=20):
+    now_ns = time.time_ns()
+    for i in range(count):
+        monitor.packet_data.add(key, now_ns + i * 1_000_000, 1500, i * 1448, 1448)
+
+
+async def run_in_process(monitor, connections, messages, binary):
+    clients = []
+    for fd_id in range(connections):
+        key = ('10.0.%d.%d' % (fd_id // 256 % 256, fd_id % 256), 40000 + fd_id % 20000)
+        capture_packets(monitor, key)
+        clients.append(FakeConnection(key, [make_message(fd_id, binary) for _ in range(messages)]))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(monitor.process_bulk_upload(client) for client in clients))
+    monitor.flush_updates()
+    return time.perf_counter() - start
+
+
+async def run_live(monitor, connections, messages, binary):
+    import websockets
+
+    async def client(fd_id):
+        async with websockets.connect(f"ws://{monitor.host}:{monitor.port}") as websocket:
+            for _ in range(messages):
+                await websocket.send(make_message(fd_id, binary))
+
+    async with websockets.serve(monitor.process_bulk_upload, monitor.host, monitor.port):
+        flusher = asyncio.ensure_future(monitor.update_flusher())
+        start = time.perf_counter()
+        await asyncio.gather(*(client(fd_id) for fd_id in range(connections)))
+        elapsed = time.perf_counter() - start
+        monitor.shutdown_event.set()
+        await flusher
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the PassiveMonitoring bulk-upload ingest path')
+    parser.add_argument('--connections', type=int, default=1000)
+    parser.add_argument('--messages', type=int, default=20)
+    parser.add_argument('--live', action='store_true')
+    parser.add_argument('--port', type=int, default=18765)
+    args = parser.parse_args()
+
+    print(f"Connections: {args.connections} | Uploads per connection: {args.messages} | "
+          f"{'live WebSocket server' if args.live else 'in-process'}")
+    for binary in (False, True):
+        monitor = make_monitor(args.connections, args.port)
+        runner = run_live if args.live else run_in_process
+        elapsed = asyncio.run(runner(monitor, args.connections, args.messages, binary))
+        total = args.connections * args.messages
+        print(f"{'binary' if binary else 'json':<6}: {total:,} uploads in {elapsed:.2f} s -> {total / elapsed:,.0f} uploads/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+# bench_state_writer.py
+#
+# Measures StateWriter throughput: how many FD state changes per second can be persisted.
+# Usage: python benchmarks/bench_state_writer.py [--fds 10000] [--rounds 20]
+
+import argparse
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from device_store import DeviceStore
+from persistence import StateWriter, restore_state
+
+
+def create_database(db_path, num_fds):
+    conn = sqlite3.connect(db_path)
+    conn.execute('''
+        CREATE TABLE field_devices (
+            FD_ID INTEGER PRIMARY KEY,
+            IP TEXT NOT NULL,
+            Region TEXT NOT NULL,
+            Port INTEGER NOT NULL,
+            Last_Data_Received TEXT
+        )
+    ''')
+    conn.executemany(
+        'INSERT INTO field_devices (FD_ID, IP, Region, Port) VALUES (?, ?, ?, ?)',
+        [(fd_id, '127.0.0.1', f'A{fd_id % 4}', 3000 + fd_id) for fd_id in range(num_fds)],
+    )
+    conn.commit()
+    rows = conn.execute('SELECT FD_ID, IP, Region, Port, Last_Data_Received FROM field_devices').fetchall()
+    conn.close()
+    return rows
+
+
+def update_all(store):
+    # The same writes active monitoring and ADA make for every FD
+    now = time.time()
+    for fd_info in store.values():
+        active_metrics = fd_info['active_metrics']
+        active_metrics['latency'] = random.uniform(5, 500)
+        active_metrics['packet_loss'] = random.choice((0.0, 20.0))
+        active_metrics['throughput'] = random.uniform(100, 5000)
+        active_metrics['status'] = random.choice(('Good', 'Acceptable', 'Poor'))
+        active_metrics['last_active'] = now
+        fd_info['last_data_received'] = now
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark StateWriter write throughput')
+    parser.add_argument('--fds', type=int, default=10000)
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, 'field_devices.db')
+        store = DeviceStore.from_rows(create_database(db_path, args.fds))
+        writer = StateWriter(store, db_path)
+
+        flush_times = []
+        for _ in range(args.rounds):
+            update_all(store)
+            start = time.perf_counter()
+            written = writer.flush()
+            flush_times.append(time.perf_counter() - start)
+            assert written == args.fds
+        writer.stop()
+
+        total = sum(flush_times)
+        print(f"FDs: {args.fds} | Rounds: {args.rounds}")
+        print(f"Flush time: mean {total / args.rounds * 1000:.1f} ms | max {max(flush_times) * 1000:.1f} ms")
+        print(f"Write throughput: {args.fds * args.rounds / total:,.0f} FD updates/s")
+
+        # Warm start from what was written
+        start = time.perf_counter()
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute('SELECT FD_ID, IP, Region, Port, Last_Data_Received FROM field_devices').fetchall()
+        conn.close()
+        restored_store = DeviceStore.from_rows(rows)
+        restored = restore_state(restored_store, db_path)
+        print(f"Warm start: {restored} FDs restored in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
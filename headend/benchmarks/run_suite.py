@@ -0,0 +1,299 @@
+# run_suite.py
+#
+# End-to-end headend benchmark suite. Runs every benchmark at 100/1k/10k FDs and writes the
+# results as JSON, so runs on different commits can be compared to catch regressions:
+# - store:   DeviceStore write (update_metrics) and read (get) latency, and a full column scan
+# - memory:  bytes allocated by the DeviceStore, ConnectionClassifier and AdaptiveDataAccess
+# - passive: PassiveMonitoring bulk-upload ingest rate, JSON and binary (in-process)
+# - active:  asyncio active monitoring cycle time (pings + throughput tests), cold and with pooled connections
+# - ada:     ADA fetch throughput, fetching every FD once
+# active and ada run against a local simulated fleet (relay-box/test/fleet_simulator.py,
+# started in subprocesses with no emulated latency, loss or bandwidth limit).
+# Usage: python benchmarks/run_suite.py [--sizes 100 1000 10000] [--only store memory] [--repeat 3] [--output results.json]
+#        python benchmarks/run_suite.py --compare baseline.json results.json [--threshold 0.1]
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import resource
+import signal
+import subprocess
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+HEADEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, HEADEND_DIR)
+
+from active_monitoring import ActiveMonitoring
+from adaptive_data_access import AdaptiveDataAccess
+from bench_passive_ingest import make_monitor, run_in_process
+from classifier import ConnectionClassifier
+from device_store import DeviceStore
+from ws_pool import get_pool
+
+FLEET_SIMULATOR = os.path.join(HEADEND_DIR, '..', 'relay-box', 'test', 'fleet_simulator.py')
+BENCHMARKS = ('store', 'memory', 'passive', 'active', 'ada')
+FLEET_BENCHMARKS = ('active', 'ada')
+
+
+class SimulatedFleet:
+    """
+    The fleet simulator in subprocesses, FD n listening on 127.0.0.1:base_port + n. Each process
+    hosts at most per_process FDs, as every FD takes a listening socket plus its connections.
+    """
+
+    def __init__(self, count, base_port, per_process=4000):
+        self.count = count
+        self.base_port = base_port
+        self.per_process = per_process
+        self.processes = []
+
+    def __enter__(self):
+        for first_id in range(0, self.count, self.per_process):
+            self.processes.append(subprocess.Popen(
+                [sys.executable, FLEET_SIMULATOR, '--first-id', str(first_id), '--count', str(min(self.per_process, self.count - first_id)),
+                 '--base-port', str(self.base_port), '--latency-ms', '0', '--loss', '0', '--bandwidth-mbps', '0',
+                 '--report-interval', '3600'],
+                stdout=subprocess.PIPE, text=True))
+        # Ready once every FD is listening
+        for process in self.processes:
+            for line in process.stdout:
+                if line.startswith('Serving'):
+                    break
+            else:
+                self.__exit__()
+                raise RuntimeError(f"Fleet simulator exited with code {process.wait()}")
+        return self
+
+    def __exit__(self, *exc_info):
+        for process in self.processes:
+            process.send_signal(signal.SIGINT)
+        for process in self.processes:
+            try:
+                process.wait(10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+def make_store(num_fds, base_port=3000, status=None):
+    store = DeviceStore.from_rows([(fd_id, '127.0.0.1', 'A1', base_port + fd_id, None) for fd_id in range(num_fds)])
+    if status is not None:
+        for row in range(num_fds):
+            store.set_status(row, 'active_', status)
+    return store
+
+
+def per_op_us(function, args_list):
+    start = time.perf_counter()
+    for args in args_list:
+        function(*args)
+    return (time.perf_counter() - start) / len(args_list) * 1_000_000
+
+
+def bench_store(num_fds, args):
+    store = make_store(num_fds)
+    rng = random.Random(0)
+    fd_ids = store.keys()
+    picks = [rng.choice(fd_ids) for _ in range(args.operations)]
+    metrics = {'latency': 12.5, 'packet_loss': 0.0, 'throughput': 800.0, 'status': 'Good'}
+
+    write_us = per_op_us(store.update_metrics, [(fd_id, 'active_metrics', metrics) for fd_id in picks])
+    read_us = per_op_us(store.get, [(fd_id,) for fd_id in picks])
+    start = time.perf_counter()
+    for _ in range(100):
+        sum(store.column('active_status'))
+    scan_us = (time.perf_counter() - start) / 100 * 1_000_000
+    return [
+        ('store.write_latency', write_us, 'us', 'lower'),
+        ('store.read_latency', read_us, 'us', 'lower'),
+        ('store.column_scan', scan_us, 'us', 'lower'),
+    ]
+
+
+def bench_memory(num_fds, args):
+    tracemalloc.start()
+    store = make_store(num_fds, status='Good')
+    store_bytes = tracemalloc.get_traced_memory()[0]
+    classifier = ConnectionClassifier(store)
+    ada = AdaptiveDataAccess(store, store.locks)
+    total_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del classifier, ada
+    return [
+        ('memory.store', store_bytes, 'bytes', 'lower'),
+        ('memory.total', total_bytes, 'bytes', 'lower'),
+        ('memory.per_fd', total_bytes / num_fds, 'bytes', 'lower'),
+    ]
+
+
+def bench_passive(num_fds, args):
+    results = []
+    messages = max(args.messages, args.operations // num_fds)  # Small fleets upload more often, to time enough uploads
+    for binary in (False, True):
+        monitor = make_monitor(num_fds)
+        elapsed = asyncio.run(run_in_process(monitor, num_fds, messages, binary))
+        results.append((f"passive.ingest_{'binary' if binary else 'json'}", num_fds * messages / elapsed, 'uploads/s', 'higher'))
+    return results
+
+
+def bench_active(num_fds, args):
+    store = make_store(num_fds, args.fleet_port)
+    monitor = ActiveMonitoring(store, store.locks, 1, engine='asyncio', icmp_backend=args.icmp_backend)
+
+    async def cycles():
+        semaphore = asyncio.Semaphore(monitor.max_concurrency)
+        with ThreadPoolExecutor(max_workers=monitor.ping_workers) as ping_executor:
+            cold = await monitor.run_cycle(semaphore, ping_executor)
+            warm = await monitor.run_cycle(semaphore, ping_executor)
+        await get_pool().close()
+        return cold, warm
+
+    cold, warm = asyncio.run(cycles())
+    probed = sum(1 for status in store.column('active_status') if status != 0)
+    if probed < num_fds:
+        print(f"  warning: only {probed}/{num_fds} FDs were classified")
+    return [
+        ('active.cycle_cold', cold, 's', 'lower'),
+        ('active.cycle_pooled', warm, 's', 'lower'),
+    ]
+
+
+def bench_ada(num_fds, args):
+    store = make_store(num_fds, args.fleet_port, status='Good')
+    ada = AdaptiveDataAccess(store, store.locks, max_concurrent_fetches=args.ada_concurrency)
+    ada.ada_wait_time = 3600  # Fetch every FD once
+
+    async def fetch_all():
+        pipeline = asyncio.ensure_future(ada.run_pipeline())
+        start = time.perf_counter()
+        last_received = store.column('last_data_received')
+        while any(math.isnan(value) for value in last_received) and time.perf_counter() - start < args.timeout:
+            await asyncio.sleep(0.01)
+        elapsed = time.perf_counter() - start
+        ada.stop()
+        ada.scheduler.wake()
+        await pipeline
+        await get_pool().close()
+        return elapsed
+
+    elapsed = asyncio.run(fetch_all())
+    fetched = sum(1 for value in store.column('last_data_received') if not math.isnan(value))
+    if fetched < num_fds:
+        print(f"  warning: only {fetched}/{num_fds} FDs were fetched")
+    return [('ada.fetch_throughput', fetched / elapsed, 'fetches/s', 'higher')]
+
+
+def run_suite(args):
+    benchmarks = {name: globals()['bench_' + name] for name in args.only}
+    results = []
+
+    def run(name, num_fds):
+        # Best of the repeats, which is the least disturbed by whatever else runs on the machine
+        print(f"{name} @ {num_fds} FDs")
+        best = {}
+        for _ in range(args.repeat):
+            for metric, value, unit, better in benchmarks[name](num_fds, args):
+                if metric in best:
+                    value = min(value, best[metric][0]) if better == 'lower' else max(value, best[metric][0])
+                best[metric] = (value, unit, better)
+        for metric, (value, unit, better) in best.items():
+            print(f"  {metric:<24} {value:>14,.3f} {unit}")
+            results.append({'name': metric, 'fds': num_fds, 'value': value, 'unit': unit, 'better': better})
+
+    for name in benchmarks:
+        if name not in FLEET_BENCHMARKS:
+            for num_fds in args.sizes:
+                run(name, num_fds)
+    fleet_benchmarks = [name for name in benchmarks if name in FLEET_BENCHMARKS]
+    if fleet_benchmarks:
+        raise_open_file_limit(2 * max(args.sizes) + 256)
+        with SimulatedFleet(max(args.sizes), args.fleet_port):
+            for name in fleet_benchmarks:
+                for num_fds in args.sizes:
+                    run(name, num_fds)
+    return results
+
+
+def raise_open_file_limit(needed):
+    # One pooled connection per FD
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed if hard == resource.RLIM_INFINITY else min(needed, hard), hard))
+
+
+def git_revision():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=HEADEND_DIR, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=HEADEND_DIR, capture_output=True, text=True).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline_path, current_path, threshold):
+    """Print the change of every metric between two result files. Returns the number of regressions."""
+    with open(baseline_path) as file:
+        baseline = json.load(file)
+    with open(current_path) as file:
+        current = json.load(file)
+    old = {(result['name'], result['fds']): result for result in baseline['results']}
+
+    print(f"Baseline {baseline['meta'].get('revision')} -> current {current['meta'].get('revision')} (threshold {threshold:.0%})")
+    regressions = 0
+    for result in current['results']:
+        previous = old.get((result['name'], result['fds']))
+        if previous is None or not previous['value']:
+            continue
+        change = (result['value'] - previous['value']) / previous['value']
+        worse = change > threshold if result['better'] == 'lower' else change < -threshold
+        better = change < -threshold if result['better'] == 'lower' else change > threshold
+        verdict = 'REGRESSION' if worse else 'improved' if better else ''
+        regressions += worse
+        print(f"{result['name']:<24} {result['fds']:>6} FDs  {previous['value']:>14,.3f} -> {result['value']:>14,.3f} "
+              f"{result['unit']:<10} {change:+7.1%}  {verdict}")
+    print(f"{regressions} regression(s)")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the headend benchmark suite, or compare two result files')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000])
+    parser.add_argument('--only', nargs='+', choices=BENCHMARKS, default=list(BENCHMARKS))
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per benchmark, the best one is kept')
+    parser.add_argument('--operations', type=int, default=20000, help='store operations (and at least as many passive uploads) per measurement')
+    parser.add_argument('--messages', type=int, default=10, help='passive uploads per connection')
+    parser.add_argument('--fleet-port', type=int, default=20000, help='simulated FD n listens on fleet_port + n')
+    parser.add_argument('--icmp-backend', choices=('ping3', 'batched'), default='batched')
+    parser.add_argument('--ada-concurrency', type=int, default=50)
+    parser.add_argument('--timeout', type=float, default=300, help='seconds before the ADA benchmark gives up')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'))
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change counted as a regression')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(1 if compare(*args.compare, args.threshold) else 0)
+
+    meta = {
+        'revision': git_revision(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'sizes': args.sizes,
+        'repeat': args.repeat,
+    }
+    results = run_suite(args)
+    with open(args.output, 'w') as file:
+        json.dump({'meta': meta, 'results': results}, file, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,191 @@
+# classifier.py
+
+import array
+import math
+import threading
+import time
+from collections import namedtuple
+
+from device_store import STATUSES, STATUS_CODES
+
+# A level is reached when latency and packet loss are below and throughput is at or above
+# its thresholds. Anything reachable that misses 'Acceptable' is 'Poor', so there are no gaps.
+Thresholds = namedtuple('Thresholds', (
+    'good_latency', 'good_packet_loss', 'good_throughput',
+    'acceptable_latency', 'acceptable_packet_loss', 'acceptable_throughput',
+))
+DEFAULT_THRESHOLDS = Thresholds(200, 1, 500, 500, 5, 100)
+
+GOOD = STATUS_CODES['Good']
+ACCEPTABLE = STATUS_CODES['Acceptable']
+POOR = STATUS_CODES['Poor']
+UNAVAILABLE = STATUS_CODES['Unavailable']
+UNKNOWN = STATUS_CODES[None]
+
+METRIC_KINDS = ('active', 'passive')
+NAN = float('nan')
+
+
+def classify_metrics(latency, packet_loss, throughput, thresholds=DEFAULT_THRESHOLDS, margin=0.0):
+    """
+    Status code for one set of metrics. A positive margin makes every level harder to reach
+    (by that fraction of its thresholds), a negative one easier; that is the hysteresis band.
+    """
+    if latency is None or math.isnan(latency) or packet_loss >= 100:
+        return UNAVAILABLE
+    tighter = 1 - margin
+    throughput = throughput or 0.0
+    if (latency < thresholds.good_latency * tighter and packet_loss < thresholds.good_packet_loss * tighter
+            and throughput >= thresholds.good_throughput * (1 + margin)):
+        return GOOD
+    if (latency <= thresholds.acceptable_latency * tighter and packet_loss <= thresholds.acceptable_packet_loss * tighter
+            and throughput >= thresholds.acceptable_throughput * (1 + margin)):
+        return ACCEPTABLE
+    return POOR
+
+
+def combine_status_codes(active_code, passive_code, passive_last_active, now, passive_max_age=600):
+    """
+    Status of an FD from its active and passive status codes: the worse of the two, with a
+    passive status older than passive_max_age seconds (or unknown) ignored.
+    """
+    if passive_code == UNKNOWN or math.isnan(passive_last_active) or now - passive_last_active > passive_max_age:
+        return active_code
+    if active_code == UNKNOWN:
+        return passive_code
+    return max(active_code, passive_code)  # Codes are ordered Good < Acceptable < Poor < Unavailable
+
+
+class ConnectionClassifier:
+    """
+    Classifies FDs on EWMA-smoothed metrics with hysteresis, per kind ('active', 'passive').
+
+    Each sample is folded into per-FD EWMA columns (alpha weights the new sample). A status
+    only improves once the smoothed metrics beat the better level's thresholds by the
+    hysteresis margin, and only worsens once they miss the current level's thresholds by it,
+    so metrics hovering around a threshold don't flip the status every cycle.
+    Thresholds can be set per region. A failed probe (no latency) is Unavailable right away.
+    The hysteresis is anchored to the classifier's own last decision, not the store's status,
+    which others overwrite (ADA marks an FD Unavailable after a failed fetch).
+    """
+
+    def __init__(self, field_devices, alpha=0.3, hysteresis=0.1, thresholds=DEFAULT_THRESHOLDS, region_thresholds=None):
+        self.field_devices = field_devices
+        self.alpha = alpha
+        self.hysteresis = hysteresis
+        self.thresholds = thresholds
+        self.region_thresholds = dict(region_thresholds or {})
+        self.size = field_devices.rows
+        self.ewma = {
+            (kind, metric): array.array('d', [NAN]) * self.size
+            for kind in METRIC_KINDS for metric in ('latency', 'packet_loss', 'throughput')
+        }
+        self.decided = {kind: array.array('b', [UNKNOWN]) * self.size for kind in METRIC_KINDS}  # Last status code returned
+        self.grow_lock = threading.Lock()
+        field_devices.add_device_listener(self.on_devices_changed)
+
+    def grow(self):
+        """Extend the EWMA columns to the store's rows, for FDs added at runtime."""
+        with self.grow_lock:
+            extra = self.field_devices.rows - self.size
+            if extra <= 0:
+                return
+            # In place: _smooth() on other threads keeps writing to the same columns, a copy would
+            # lose its updates. Nothing exports their buffers, so extend() cannot fail on them.
+            for column in self.ewma.values():
+                column.extend(array.array('d', [NAN]) * extra)
+            for column in self.decided.values():
+                column.extend(array.array('b', [UNKNOWN]) * extra)
+            self.size += extra
+
+    def on_devices_changed(self, added, updated, removed):
+        # Removed FDs keep their dead rows, update_many() ignores them in reclassify()
+        if added:
+            self.grow()
+
+    def thresholds_for(self, row):
+        return self.region_thresholds.get(self.field_devices.regions[row], self.thresholds)
+
+    def _smooth(self, kind, metric, row, value):
+        column = self.ewma[(kind, metric)]
+        previous = column[row]
+        column[row] = value if math.isnan(previous) else previous + self.alpha * (value - previous)
+        return column[row]
+
+    def _decide(self, row, kind, latency, packet_loss, throughput):
+        """Status code from the smoothed metrics, relative to the last decision. Records it as the new one."""
+        decided = self.decided[kind]
+        current = decided[row]
+        thresholds = self.thresholds_for(row)
+        if current in (UNKNOWN, UNAVAILABLE):
+            code = classify_metrics(latency, packet_loss, throughput, thresholds)
+        else:
+            code = current
+            stricter = classify_metrics(latency, packet_loss, throughput, thresholds, self.hysteresis)
+            looser = classify_metrics(latency, packet_loss, throughput, thresholds, -self.hysteresis)
+            if stricter < current:
+                code = stricter  # Clearly better
+            elif looser > current:
+                code = looser  # Clearly worse
+        decided[row] = code
+        return code
+
+    def classify(self, fd_id, kind, latency, packet_loss, throughput):
+        """Fold a sample into the FD's smoothed metrics and return its status."""
+        row = self.field_devices.index.get(fd_id)
+        if row is None:
+            return 'Unavailable'  # Removed, the store skips its update
+        if row >= self.size:
+            self.grow()  # Added after the last grow()
+        packet_loss = self._smooth(kind, 'packet_loss', row, packet_loss if packet_loss is not None else 100.0)
+        if latency is None:
+            self.decided[kind][row] = UNAVAILABLE
+            return 'Unavailable'
+        latency = self._smooth(kind, 'latency', row, latency)
+        throughput = self._smooth(kind, 'throughput', row, throughput if throughput is not None else 0.0)
+        return STATUSES[self._decide(row, kind, latency, packet_loss, throughput)]
+
+    def reclassify(self, kind='active'):
+        """
+        Reclassify every FD of a kind from its smoothed metrics in one pass over the columns
+        (e.g. after changing thresholds) and write the changes in one batch.
+        Returns the number of FDs whose status changed.
+        """
+        latencies = self.ewma[(kind, 'latency')]
+        losses = self.ewma[(kind, 'packet_loss')]
+        throughputs = self.ewma[(kind, 'throughput')]
+        decided = self.decided[kind]
+        statuses = self.field_devices.column(kind + '_status')
+        fd_ids = self.field_devices.fd_ids
+        index = self.field_devices.index
+
+        updates = []
+        for row, latency in enumerate(latencies):
+            if math.isnan(latency) or decided[row] == UNAVAILABLE or statuses[row] == UNAVAILABLE:
+                continue  # No sample yet, or the last probe or fetch failed
+            fd_id = fd_ids[row]
+            if index.get(fd_id) != row:
+                continue  # Dead row of a removed FD, maybe added again on a new row since
+            previous = decided[row]
+            code = self._decide(row, kind, latency, losses[row], throughputs[row])
+            if code != previous:
+                updates.append((fd_id, {'status': STATUSES[code]}))
+        self.field_devices.update_many(kind + '_metrics', updates)
+        return len(updates)
+
+    def set_thresholds(self, thresholds=None, region_thresholds=None):
+        """Change the thresholds and reclassify the fleet with them."""
+        if thresholds is not None:
+            self.thresholds = thresholds
+        if region_thresholds is not None:
+            self.region_thresholds = dict(region_thresholds)
+        return sum(self.reclassify(kind) for kind in METRIC_KINDS)
+
+    def combined_status(self, fd_id, now=None, passive_max_age=600):
+        """Status of an FD from both its active and (recent) passive status."""
+        row = self.field_devices.row_of(fd_id)
+        store = self.field_devices
+        code = combine_status_codes(store.column('active_status')[row], store.column('passive_status')[row],
+                                    store.column('passive_last_active')[row], time.time() if now is None else now,
+                                    passive_max_age)
+        return STATUSES[code]
@@ -0,0 +1,111 @@
+# clock.py
+
+import logging
+import threading
+import time
+from datetime import datetime
+
+try:
+    import ntplib
+except ImportError:  # The offset just stays 0 without ntplib
+    ntplib = None
+
+logger = logging.getLogger(__name__)
+
+
+class ClockService:
+    """
+    Shared clock of the headend.
+
+    Hot paths take monotonic_ns() timestamps (no allocation, never jumps). The NTP offset is
+    refreshed by a background thread, so nothing blocks on the network, and timestamps are
+    converted to NTP corrected wall-clock time only when they are reported.
+    server can be a local stand-in (e.g. a relay box running ntpd); None disables NTP.
+    """
+
+    def __init__(self, server="pool.ntp.org", port=123, refresh_interval=600, retry_interval=30, timeout=2):
+        self.server = server
+        self.port = port
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.offset = 0.0  # Seconds to add to the local clock (0 until the first NTP reply)
+        self.synced = False
+        self.last_sync = None  # monotonic_ns() of the last successful refresh
+        # Wall-clock time at a fixed monotonic instant, to map monotonic timestamps to wall-clock
+        self.wall_anchor_ns = time.time_ns()
+        self.monotonic_anchor_ns = time.monotonic_ns()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def monotonic_ns():
+        return time.monotonic_ns()
+
+    def refresh(self):
+        """Query the NTP server once. Returns True if the offset was updated."""
+        if ntplib is None or self.server is None:
+            return False
+        try:
+            response = ntplib.NTPClient().request(self.server, port=self.port, timeout=self.timeout)
+        except Exception as e:
+            logger.warning("Failed to fetch NTP time from %s: %s", self.server, e)
+            return False
+        self.offset = response.offset
+        self.synced = True
+        self.last_sync = time.monotonic_ns()
+        # Re-anchor, so drift between the monotonic and the system clock doesn't build up
+        self.wall_anchor_ns = time.time_ns()
+        self.monotonic_anchor_ns = time.monotonic_ns()
+        return True
+
+    def run(self):
+        while not self.stop_event.is_set():
+            interval = self.refresh_interval if self.refresh() else self.retry_interval
+            self.stop_event.wait(interval)
+
+    def start(self):
+        if self.thread is None and self.server is not None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def monotonic_to_epoch(self, monotonic_ns):
+        """NTP corrected epoch seconds of a monotonic_ns() timestamp."""
+        wall_ns = self.wall_anchor_ns + (monotonic_ns - self.monotonic_anchor_ns)
+        return wall_ns / 1_000_000_000 + self.offset
+
+    def to_datetime(self, epoch_ns):
+        """NTP corrected datetime of a system clock timestamp in ns (e.g. a packet capture time)."""
+        return datetime.fromtimestamp(epoch_ns / 1_000_000_000 + self.offset)
+
+    def monotonic_to_datetime(self, monotonic_ns):
+        return datetime.fromtimestamp(self.monotonic_to_epoch(monotonic_ns))
+
+    def time(self):
+        """NTP corrected epoch seconds."""
+        return time.time() + self.offset
+
+    def now(self):
+        """NTP corrected current time (as a datetime object)."""
+        return datetime.fromtimestamp(time.time() + self.offset)
+
+
+# Shared instance, so every module sees the same offset
+_clock = None
+_clock_lock = threading.Lock()
+
+
+def get_clock(**options):
+    """The shared ClockService, created and started on first use (options only apply then)."""
+    global _clock
+    with _clock_lock:
+        if _clock is None:
+            _clock = ClockService(**options).start()
+        return _clock
@@ -0,0 +1,273 @@
+# config.py
+
+import argparse
+import dataclasses
+import json
+import os
+import typing
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+try:
+    import tomllib  # Python 3.11+, only needed for .toml config files
+except ImportError:
+    tomllib = None
+
+# Environment variables override the config file: HEADEND_<SECTION>_<FIELD>, e.g. HEADEND_ACTIVE_ENGINE=asyncio
+ENV_PREFIX = 'HEADEND_'
+
+
+@dataclass
+class ServerConfig:
+    host: str = '192.168.1.3'  # Address the passive, backend and metrics servers listen on
+    passive_port: int = 8765
+    backend_port: int = 8000
+    metrics_port: Optional[int] = 9100  # Prometheus /metrics, None disables it
+
+
+@dataclass
+class DatabaseConfig:
+    path: str = 'field_devices.db'
+    state_flush_interval: float = 1.0  # Seconds between StateWriter flushes
+    history_capacity: int = 60  # Samples kept per FD and kind in memory
+    history_flush_interval: float = 30.0
+    registry_poll_interval: Optional[float] = 5.0  # Seconds between polls for added/removed FDs, None disables it
+
+
+@dataclass
+class ActiveConfig:
+    engine: str = 'threads'  # 'threads' or 'asyncio'
+    threads: int = 5  # Threads of the 'threads' engine
+    max_concurrency: int = 500  # In-flight probes of the 'asyncio' engine
+    ping_workers: int = 64
+    icmp_backend: str = 'ping3'  # 'ping3' or 'batched'
+    ping_count: int = 5
+    ping_timeout: float = 2.0
+    throughput_probe_bytes: int = 1024 * 100
+    cycle_interval: float = 10.0  # Seconds between monitoring cycles
+    fd_interval: float = 1.0  # Seconds between FDs of a 'threads' engine thread
+
+
+@dataclass
+class AdaConfig:
+    max_concurrent_fetches: int = 50
+    wait_time: float = 5.0  # Seconds until a FD has generated a new data point
+    idle_wait: float = 10.0  # Sleep when no FD is scheduled (wakes early on a status change)
+    passive_max_age: float = 600.0
+    scoring: str = 'auto'  # How the fetch heap is built in bulk: 'auto', 'python' or 'numpy'
+    region_rate_limits: Dict[str, List[float]] = field(default_factory=dict)  # {'A1': [fetches per second, burst]}
+    default_region_rate: Optional[List[float]] = None
+
+
+@dataclass
+class PassiveConfig:
+    interface: str = 'Wi-Fi'
+    capture_backend: str = 'scapy'  # 'scapy', 'afpacket' or 'pcap'
+    pcap_path: Optional[str] = None
+    capture_workers: int = 1
+    connection_ttl: float = 300.0
+    max_connections: int = 100_000
+    update_interval: float = 0.05
+    update_batch_size: int = 500
+
+
+@dataclass
+class PoolConfig:
+    max_idle_per_fd: int = 1
+    idle_timeout: float = 60.0
+    keepalive_interval: float = 20.0
+    connect_timeout: float = 5.0
+
+
+@dataclass
+class ClassifierConfig:
+    alpha: float = 0.3
+    hysteresis: float = 0.1
+    thresholds: Optional[List[float]] = None  # The 6 Thresholds fields, None keeps the defaults
+    region_thresholds: Dict[str, List[float]] = field(default_factory=dict)
+
+
+@dataclass
+class ClockConfig:
+    ntp_server: Optional[str] = 'pool.ntp.org'  # None disables NTP
+    refresh_interval: float = 600.0
+
+
+@dataclass
+class ShardConfig:
+    shard_id: Optional[str] = None  # Set to run as one shard of a sharded deployment (see coordinator.py)
+    coordinator_url: Optional[str] = None  # e.g. ws://10.0.0.1:8100
+    advertise_url: Optional[str] = None  # Backend listener URL given to the coordinator, default ws://<server.host>:<server.backend_port>
+    reconnect_interval: float = 5.0
+
+
+@dataclass
+class LoggingConfig:
+    level: str = 'INFO'
+    json_output: bool = True
+
+
+@dataclass
+class HeadendConfig:
+    server: ServerConfig = field(default_factory=ServerConfig)
+    database: DatabaseConfig = field(default_factory=DatabaseConfig)
+    active: ActiveConfig = field(default_factory=ActiveConfig)
+    ada: AdaConfig = field(default_factory=AdaConfig)
+    passive: PassiveConfig = field(default_factory=PassiveConfig)
+    pool: PoolConfig = field(default_factory=PoolConfig)
+    classifier: ClassifierConfig = field(default_factory=ClassifierConfig)
+    clock: ClockConfig = field(default_factory=ClockConfig)
+    shard: ShardConfig = field(default_factory=ShardConfig)
+    logging: LoggingConfig = field(default_factory=LoggingConfig)
+
+    def validate(self):
+        """Raise ValueError on settings the modules would reject (or misbehave with) later."""
+        choices = [
+            ('active.engine', self.active.engine, ('threads', 'asyncio')),
+            ('active.icmp_backend', self.active.icmp_backend, ('ping3', 'batched')),
+            ('ada.scoring', self.ada.scoring, ('auto', 'python', 'numpy')),
+            ('passive.capture_backend', self.passive.capture_backend, ('scapy', 'afpacket', 'pcap')),
+        ]
+        for name, value, allowed in choices:
+            if value not in allowed:
+                raise ValueError(f"{name} must be one of {allowed}, got {value!r}")
+        for name in ('active.threads', 'active.max_concurrency', 'active.ping_workers', 'active.ping_count',
+                     'ada.max_concurrent_fetches', 'passive.capture_workers', 'database.history_capacity'):
+            if get_setting(self, name) < 1:
+                raise ValueError(f"{name} must be at least 1")
+        if self.passive.capture_backend == 'pcap' and not self.passive.pcap_path:
+            raise ValueError("passive.pcap_path is required with the 'pcap' capture backend")
+        if self.classifier.thresholds is not None and len(self.classifier.thresholds) != 6:
+            raise ValueError("classifier.thresholds needs 6 values")
+        if self.shard.shard_id and not self.shard.coordinator_url:
+            raise ValueError("shard.coordinator_url is required with shard.shard_id")
+        return self
+
+    def to_dict(self):
+        return dataclasses.asdict(self)
+
+
+def get_setting(config, name):
+    section, key = name.split('.')
+    return getattr(getattr(config, section), key)
+
+
+def settings(config):
+    """(section, field name, type) of every setting."""
+    for section in dataclasses.fields(config):
+        section_type = type(getattr(config, section.name))
+        hints = typing.get_type_hints(section_type)
+        for setting in dataclasses.fields(section_type):
+            yield section.name, setting.name, hints[setting.name]
+
+
+def parse_value(value, value_type):
+    """Convert a string from the environment or the command line to the setting's type."""
+    if typing.get_origin(value_type) is typing.Union:  # Optional[X]
+        if value.lower() in ('', 'none', 'null'):
+            return None
+        value_type = next(arg for arg in typing.get_args(value_type) if arg is not type(None))
+    if value_type is bool:
+        if value.lower() in ('1', 'true', 'yes', 'on'):
+            return True
+        if value.lower() in ('0', 'false', 'no', 'off'):
+            return False
+        raise ValueError(f"Not a boolean: {value!r}")
+    if typing.get_origin(value_type) in (dict, list):
+        return check_value(json.loads(value), value_type)  # e.g. HEADEND_ADA_REGION_RATE_LIMITS='{"A1": [20, 40]}'
+    return value_type(value)
+
+
+def check_value(value, value_type):
+    """
+    Convert a value from a config file (JSON or TOML types) to the setting's type. Strings
+    are parsed like environment values, so "capture_workers": "4" works too.
+    """
+    if isinstance(value, str) and value_type is not str:
+        return parse_value(value, value_type)
+    origin = typing.get_origin(value_type)
+    if origin is typing.Union:  # Optional[X]
+        if value is None:
+            return None
+        value_type = next(arg for arg in typing.get_args(value_type) if arg is not type(None))
+        return check_value(value, value_type)
+    if origin is list:
+        if not isinstance(value, list):
+            raise ValueError(f"Expected a list, got {value!r}")
+        item_type, = typing.get_args(value_type)
+        return [check_value(item, item_type) for item in value]
+    if origin is dict:
+        if not isinstance(value, dict):
+            raise ValueError(f"Expected a table, got {value!r}")
+        key_type, item_type = typing.get_args(value_type)
+        return {check_value(key, key_type): check_value(item, item_type) for key, item in value.items()}
+    # bool is an int, but neither true for a count nor 1 for a flag
+    if value_type is float and isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if type(value) is not value_type:
+        raise ValueError(f"Expected {value_type.__name__}, got {value!r}")
+    return value
+
+
+def read_config_file(path):
+    """Settings from a JSON or TOML file: {"section": {"field": value}}."""
+    if path.endswith('.toml'):
+        if tomllib is None:
+            raise ImportError("TOML config files need Python 3.11+")
+        with open(path, 'rb') as file:
+            return tomllib.load(file)
+    with open(path) as file:
+        return json.load(file)
+
+
+def apply_settings(config, values, source):
+    types = {(section, key): value_type for section, key, value_type in settings(config)}
+    for section_name, section_values in values.items():
+        if not isinstance(section_values, dict):
+            raise ValueError(f"Section {section_name} in {source} must be a table, got {section_values!r}")
+        for key, value in section_values.items():
+            value_type = types.get((section_name, key))
+            if value_type is None:
+                raise ValueError(f"Unknown setting {section_name}.{key} in {source}")
+            try:
+                value = check_value(value, value_type)
+            except ValueError as e:
+                raise ValueError(f"Invalid value for {section_name}.{key} in {source}: {e}") from None
+            setattr(getattr(config, section_name), key, value)
+
+
+def add_arguments(parser, config=None):
+    """Add a --<section>-<field> option for every setting, plus --config."""
+    parser.add_argument('--config', help=f'JSON or TOML config file (or {ENV_PREFIX}CONFIG)')
+    for section, key, _ in settings(config or HeadendConfig()):
+        parser.add_argument(f"--{section}-{key}".replace('_', '-'), dest=f"{section}.{key}", metavar='VALUE', default=None)
+    return parser
+
+
+def load_config(argv=None, environ=None):
+    """
+    HeadendConfig from, in increasing precedence: the defaults, the config file (--config or
+    HEADEND_CONFIG), HEADEND_<SECTION>_<FIELD> environment variables and command line options.
+    """
+    environ = os.environ if environ is None else environ
+    config = HeadendConfig()
+    args = add_arguments(argparse.ArgumentParser(description='P5 headend')).parse_args(argv)
+
+    config_path = args.config or environ.get(ENV_PREFIX + 'CONFIG')
+    if config_path:
+        apply_settings(config, read_config_file(config_path), config_path)
+
+    for section, key, value_type in settings(config):
+        source = f"{ENV_PREFIX}{section}_{key}".upper()
+        value = environ.get(source)
+        option = getattr(args, f"{section}.{key}")
+        if option is not None:
+            value, source = option, f"--{section}-{key}".replace('_', '-')
+        if value is None:
+            continue
+        try:
+            setattr(getattr(config, section), key, parse_value(value, value_type))
+        except ValueError as e:
+            raise ValueError(f"Invalid value for {source}: {e}") from None
+
+    return config.validate()
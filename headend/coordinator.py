@@ -0,0 +1,319 @@
+# coordinator.py
+
+import argparse
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+
+import websockets
+
+from focus_jobs import FocusJob
+from sharding import STRATEGIES, HashRing, shard_key
+from structured_logging import setup_logging
+
+logger = logging.getLogger(__name__)
+
+# Job id the coordinator gives a plain "1,2,3" focus request, like AdaptiveDataAccess.focus_on_fds
+LEGACY_FOCUS_JOB_ID = 'legacy'
+
+
+def load_regions(db_path):
+    """{fd_id: region} from the field device table, needed to route with the 'region' strategy."""
+    conn = sqlite3.connect(db_path)
+    try:
+        return {str(fd_id): region for fd_id, region in conn.execute('SELECT FD_ID, Region FROM field_devices')}
+    finally:
+        conn.close()
+
+
+class ShardCoordinator:
+    """
+    Coordinator of a sharded deployment: headends started with a shard id register on the
+    shard port and get the list of live shards pushed to them, from which each works out
+    its own FDs (see sharding.ShardMember). A shard is a member for as long as its connection
+    is open; joins and leaves trigger a rebalance, which bumps the assignment version.
+
+    The backend connects to the backend port exactly like to a single headend. Focus
+    requests are split by owning shard and forwarded to the shards' backend listeners, and
+    moved along when a rebalance changes the owners.
+    """
+
+    def __init__(self, host='0.0.0.0', shard_port=8100, backend_port=8000, strategy='hash', vnodes=64, db_path=None,
+                 rebalance_delay=0.5):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"strategy must be one of {STRATEGIES}, got {strategy!r}")
+        if strategy == 'region' and db_path is None:
+            raise ValueError("The 'region' strategy needs the field device database (--db)")
+        self.host = host
+        self.shard_port = shard_port
+        self.backend_port = backend_port
+        self.strategy = strategy
+        self.vnodes = vnodes
+        self.db_path = db_path
+        self.regions = load_regions(db_path) if db_path else {}  # {fd_id: region}
+        self.rebalance_delay = rebalance_delay  # Joins and leaves within this many seconds make one rebalance
+        self.ring = HashRing(vnodes=vnodes)
+        self.shards = {}  # {shard_id: (websocket, backend_url)}
+        self.sessions = set()  # Open BackendSessions
+        self.version = 0
+        self.rebalance_task = None
+        self.rebalance_pending = False  # Shards joined or left since the running rebalance took its snapshot
+
+    def route(self, fd_ids):
+        """{shard_id: [fd_ids]} for the current shards. Empty if no shard is live."""
+        if self.db_path and any(fd_id not in self.regions for fd_id in fd_ids):
+            self.regions = load_regions(self.db_path)  # FDs added since the last load
+        routes = {}
+        for fd_id in fd_ids:
+            shard_id = self.ring.node_for(shard_key(fd_id, self.regions.get(fd_id), self.strategy))
+            if shard_id is not None:
+                routes.setdefault(shard_id, []).append(fd_id)
+        return routes
+
+    def backend_url(self, shard_id):
+        shard = self.shards.get(shard_id)
+        return shard[1] if shard else None
+
+    def assignment(self):
+        return {'type': 'assignment', 'version': self.version, 'shards': self.ring.nodes,
+                'strategy': self.strategy, 'vnodes': self.vnodes}
+
+    def schedule_rebalance(self):
+        self.rebalance_pending = True
+        if self.rebalance_task is None or self.rebalance_task.done():
+            self.rebalance_task = asyncio.create_task(self.rebalance())
+
+    async def rebalance(self):
+        # A join or leave while the assignment is being sent or jobs rerouted sets the flag
+        # again, and gets a rebalance of its own once this one is done
+        while self.rebalance_pending:
+            await asyncio.sleep(self.rebalance_delay)
+            self.rebalance_pending = False
+            self.version += 1
+            if self.db_path:
+                self.regions = load_regions(self.db_path)
+            message = json.dumps(self.assignment())
+            logger.info("Rebalancing to assignment %d over shards %s", self.version, self.ring.nodes)
+            for websocket, _ in list(self.shards.values()):
+                try:
+                    await websocket.send(message)
+                except websockets.exceptions.ConnectionClosed:
+                    pass  # Its handler removes it and rebalances again
+            for session in list(self.sessions):
+                await session.reroute()
+
+    async def handle_shard(self, websocket):
+        try:
+            register = json.loads(await websocket.recv())
+            shard_id, backend_url = str(register['shard_id']), register['backend_url']
+        except (ValueError, KeyError, TypeError, websockets.exceptions.ConnectionClosed) as e:
+            logger.warning("Invalid shard registration from %s: %s", websocket.remote_address, e)
+            return
+
+        previous = self.shards.get(shard_id)
+        self.shards[shard_id] = (websocket, backend_url)
+        if previous is not None:
+            # Same shard reconnecting before its old connection timed out
+            await previous[0].close()
+        else:
+            self.ring.add_node(shard_id)
+        logger.info("Shard %s joined (backend %s), %d shards", shard_id, backend_url, len(self.shards))
+        self.schedule_rebalance()  # It owns nothing until then
+
+        try:
+            await websocket.wait_closed()
+        finally:
+            if self.shards.get(shard_id, (None,))[0] is websocket:
+                del self.shards[shard_id]
+                self.ring.remove_node(shard_id)
+                logger.warning("Shard %s left, %d shards", shard_id, len(self.shards))
+                for session in list(self.sessions):
+                    await session.close_upstream(shard_id)
+                self.schedule_rebalance()
+
+    async def handle_backend(self, websocket):
+        session = BackendSession(self, websocket)
+        self.sessions.add(session)
+        try:
+            async for message in websocket:
+                await session.handle(message.strip())
+        finally:
+            self.sessions.discard(session)
+            await session.close()
+
+    async def serve(self):
+        async with websockets.serve(self.handle_shard, self.host, self.shard_port), \
+                websockets.serve(self.handle_backend, self.host, self.backend_port):
+            logger.info("Coordinator listening for shards on %s:%d and the backend on %s:%d (%s strategy)",
+                        self.host, self.shard_port, self.host, self.backend_port, self.strategy)
+            await asyncio.Future()  # Run forever
+
+
+class BackendSession:
+    """
+    One backend connection to the coordinator. Keeps its focus jobs and where their parts
+    went, so a rebalance only resends the parts whose owner changed (for the remaining
+    duration) and cancels them on shards that lost them. Shard replies are relayed to the
+    backend with a "shard" field added.
+    """
+
+    def __init__(self, coordinator, websocket):
+        self.coordinator = coordinator
+        self.websocket = websocket
+        self.upstreams = {}  # {shard_id: (websocket, relay task)}
+        self.jobs = {}  # {job_id: (request, expires_at)}
+        self.routes = {}  # {job_id: {shard_id: tuple(fd_ids)}}
+        self.lock = asyncio.Lock()  # Requests and reroutes do not interleave
+
+    async def reply(self, message):
+        try:
+            await self.websocket.send(json.dumps(message))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def upstream(self, shard_id):
+        """Connection to the shard's backend listener, opened on first use."""
+        if shard_id in self.upstreams:
+            return self.upstreams[shard_id][0]
+        websocket = await websockets.connect(self.coordinator.backend_url(shard_id), open_timeout=5)
+        self.upstreams[shard_id] = (websocket, asyncio.create_task(self.relay(shard_id, websocket)))
+        return websocket
+
+    async def relay(self, shard_id, websocket):
+        try:
+            async for message in websocket:
+                message = json.loads(message)
+                message['shard'] = shard_id
+                await self.reply(message)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            if self.upstreams.get(shard_id, (None,))[0] is websocket:
+                del self.upstreams[shard_id]
+
+    async def send(self, shard_id, message):
+        """Send to a shard. Returns False (and tells the backend) if it cannot be reached."""
+        try:
+            websocket = await self.upstream(shard_id)
+            await websocket.send(message)
+            return True
+        except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+            logger.warning("Could not reach shard %s: %s", shard_id, e)
+            await self.reply({'type': 'error', 'shard': shard_id, 'error': f'shard unreachable: {e}'})
+            return False
+
+    async def handle(self, message):
+        async with self.lock:
+            if message.lower() == 'stop':
+                logger.info("Received 'stop' command from backend, forwarding to %d shards", len(self.coordinator.shards))
+                for shard_id in list(self.coordinator.shards):
+                    await self.send(shard_id, 'stop')
+                self.jobs.clear()
+                self.routes.clear()
+                return
+            if not message.startswith('{'):
+                # Plain "1,2,3" focus request, one job replacing the previous one like on a single headend
+                message = json.dumps({'job_id': LEGACY_FOCUS_JOB_ID, 'fd_ids': message})
+            try:
+                request = json.loads(message)
+                if 'cancel' in request:
+                    await self.cancel(str(request['cancel']))
+                    return
+                job = FocusJob.from_request(request)  # Validates it before it is split up
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning("Invalid backend request %r: %s", message, e)
+                await self.reply({'type': 'error', 'error': str(e)})
+                return
+
+            # Every shard runs its part under the same job id
+            request['job_id'] = job.job_id
+            request['fd_ids'] = job.fd_ids
+            self.jobs[request['job_id']] = (request, job.expires_at)
+            logger.info("Received backend focus job %s for FDs: %s", request['job_id'], job.fd_ids)
+            await self.place(request['job_id'])
+
+    async def cancel(self, job_id):
+        if self.jobs.pop(job_id, None) is None:
+            await self.reply({'type': 'error', 'job_id': job_id, 'error': 'unknown job'})
+            return
+        for shard_id in self.routes.pop(job_id, {}):
+            if shard_id in self.coordinator.shards:
+                await self.send(shard_id, json.dumps({'cancel': job_id}))
+
+    async def place(self, job_id):
+        """Send the job's parts to their owners, leaving parts that did not move alone."""
+        request, expires_at = self.jobs[job_id]
+        if expires_at is not None and expires_at <= time.time():
+            del self.jobs[job_id]
+            self.routes.pop(job_id, None)
+            return
+        routes = {shard_id: tuple(fd_ids) for shard_id, fd_ids in self.coordinator.route(request['fd_ids']).items()}
+        if not routes:
+            await self.reply({'type': 'error', 'job_id': job_id, 'error': 'no shards available'})
+        placed = self.routes.setdefault(job_id, {})
+
+        for shard_id in list(placed):
+            if shard_id not in routes:
+                del placed[shard_id]
+                if shard_id in self.coordinator.shards:
+                    await self.send(shard_id, json.dumps({'cancel': job_id}))
+        for shard_id, fd_ids in routes.items():
+            if placed.get(shard_id) == fd_ids:
+                continue
+            part = dict(request, fd_ids=list(fd_ids))
+            if expires_at is not None:
+                part['duration'] = expires_at - time.time()
+            if await self.send(shard_id, json.dumps(part)):
+                placed[shard_id] = fd_ids
+            else:
+                placed.pop(shard_id, None)  # Sent again on the next rebalance
+
+    async def reroute(self):
+        async with self.lock:
+            for job_id in list(self.jobs):
+                await self.place(job_id)
+
+    async def close_upstream(self, shard_id):
+        websocket, task = self.upstreams.pop(shard_id, (None, None))
+        if websocket is not None:
+            task.cancel()
+            await websocket.close()
+        for placed in self.routes.values():
+            placed.pop(shard_id, None)
+
+    async def close(self):
+        # The backend is gone, so are its focus jobs
+        for job_id in list(self.jobs):
+            await self.cancel(job_id)
+        for shard_id in list(self.upstreams):
+            await self.close_upstream(shard_id)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Coordinator of a sharded P5 headend deployment')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--shard-port', type=int, default=8100, help='Port the shards register on')
+    parser.add_argument('--backend-port', type=int, default=8000, help='Port the backend sends focus requests to')
+    parser.add_argument('--strategy', choices=STRATEGIES, default='hash',
+                        help="Partition FDs by consistent hashing of the FD id, or keep each region on one shard")
+    parser.add_argument('--vnodes', type=int, default=64, help='Points per shard on the hash ring')
+    parser.add_argument('--db', help="Field device database, needed for the 'region' strategy")
+    parser.add_argument('--rebalance-delay', type=float, default=0.5)
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args(argv)
+
+    log_listener = setup_logging(level=getattr(logging, args.log_level.upper()))
+    coordinator = ShardCoordinator(args.host, args.shard_port, args.backend_port, args.strategy, args.vnodes,
+                                   db_path=args.db, rebalance_delay=args.rebalance_delay)
+    try:
+        asyncio.run(coordinator.serve())
+    except KeyboardInterrupt:
+        logger.info("Shutting down...")
+    finally:
+        log_listener.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,147 @@
+# device_registry.py
+
+import logging
+import threading
+import time
+
+from instrumentation import REGISTRY
+from persistence import connect
+
+logger = logging.getLogger(__name__)
+
+REGISTRY_CHANGES = REGISTRY.counter('headend_registry_changes_total', 'Field devices added, updated, removed or skipped (shared store) at runtime', ('change',))
+REGISTRY_POLLS = REGISTRY.counter('headend_registry_polls_total', 'Polls of the fd_changes table', ('result',))
+
+FIELD_DEVICE_COLUMNS = 'FD_ID, IP, Region, Port, Last_Data_Received'
+
+# Every change to field_devices that matters to the headend is logged to fd_changes by triggers,
+# whoever makes it (setup scripts, the sqlite3 shell, a provisioning system). Last_Data_Received
+# is written back by the StateWriter and is not logged.
+CHANGE_LOG_SCHEMA = (
+    '''CREATE TABLE IF NOT EXISTS fd_changes (
+        Seq INTEGER PRIMARY KEY AUTOINCREMENT,
+        FD_ID TEXT NOT NULL,
+        Changed REAL NOT NULL
+    )''',
+    '''CREATE TRIGGER IF NOT EXISTS fd_changes_insert AFTER INSERT ON field_devices BEGIN
+        INSERT INTO fd_changes (FD_ID, Changed) VALUES (NEW.FD_ID, strftime('%s', 'now'));
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS fd_changes_update AFTER UPDATE OF FD_ID, IP, Region, Port ON field_devices BEGIN
+        INSERT INTO fd_changes (FD_ID, Changed) VALUES (OLD.FD_ID, strftime('%s', 'now'));
+        INSERT INTO fd_changes (FD_ID, Changed) SELECT NEW.FD_ID, strftime('%s', 'now') WHERE NEW.FD_ID != OLD.FD_ID;
+    END''',
+    '''CREATE TRIGGER IF NOT EXISTS fd_changes_delete AFTER DELETE ON field_devices BEGIN
+        INSERT INTO fd_changes (FD_ID, Changed) VALUES (OLD.FD_ID, strftime('%s', 'now'));
+    END''',
+)
+
+
+def create_change_log(conn):
+    with conn:
+        for statement in CHANGE_LOG_SCHEMA:
+            conn.execute(statement)
+
+
+class DeviceRegistry:
+    """
+    Keeps the DeviceStore in step with the field_devices table while the headend runs.
+
+    Polls the fd_changes table every poll_interval seconds and re-reads only the FDs logged
+    since the last poll: FDs now in the table are added (or get their address, region and
+    port updated), FDs gone from it are removed. The store's device listeners then bring
+    the modules along (ADA scheduling, classifier state, shard ownership, ...).
+    On start the whole table is compared with the store once, for changes made while the
+    headend was down or before the triggers existed.
+    """
+
+    def __init__(self, field_devices, db_path='field_devices.db', poll_interval=5, retention=86400):
+        self.field_devices = field_devices
+        self.db_path = db_path
+        self.poll_interval = poll_interval
+        self.retention = retention  # Seconds fd_changes entries are kept (other headends may share the table)
+        self.last_seq = 0  # Last fd_changes entry applied
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.conn = None
+
+    def connection(self):
+        if self.conn is None:
+            self.conn = connect(self.db_path, check_same_thread=False)
+            create_change_log(self.conn)
+        return self.conn
+
+    def apply(self, rows, fd_ids):
+        """Bring the FDs fd_ids in line with their field_devices rows (no row: removed)."""
+        store = self.field_devices
+        try:
+            added, updated = store.add_devices(rows)
+        except TypeError as e:
+            # Shared with capture workers: the store cannot grow, only the FDs it has are updated
+            new_fd_ids = [str(row[0]) for row in rows if str(row[0]) not in store]
+            logger.error("Cannot add field devices %s at runtime: %s. Restart the headend to monitor them",
+                         new_fd_ids, e, extra={'event': 'registry_change'})
+            REGISTRY_CHANGES.inc(len(new_fd_ids), change='skipped')
+            added, updated = store.add_devices([row for row in rows if str(row[0]) in store])
+        present = {str(row[0]) for row in rows}
+        removed = store.remove_devices([fd_id for fd_id in fd_ids if fd_id not in present])
+        for change, changed in (('added', added), ('updated', updated), ('removed', removed)):
+            if changed:
+                REGISTRY_CHANGES.inc(len(changed), change=change)
+        if added or updated or removed:
+            logger.info("Field devices changed: %d added, %d updated, %d removed (%d in total)",
+                        len(added), len(updated), len(removed), len(store), extra={'event': 'registry_change'})
+        return added, updated, removed
+
+    def sync_all(self):
+        """Compare the whole table with the store. Returns (added, updated, removed)."""
+        conn = self.connection()
+        # Log position first: a change made in between is applied again by the next poll, never missed
+        self.last_seq = conn.execute('SELECT COALESCE(MAX(Seq), 0) FROM fd_changes').fetchone()[0]
+        rows = conn.execute(f'SELECT {FIELD_DEVICE_COLUMNS} FROM field_devices').fetchall()
+        return self.apply(rows, self.field_devices.keys())
+
+    def poll(self):
+        """Apply the changes logged since the last poll. Returns (added, updated, removed)."""
+        conn = self.connection()
+        changes = conn.execute('SELECT Seq, FD_ID FROM fd_changes WHERE Seq > ? ORDER BY Seq', (self.last_seq,)).fetchall()
+        if not changes:
+            return [], [], []
+        fd_ids = list(dict.fromkeys(fd_id for _, fd_id in changes))  # Several changes to one FD count once
+        rows = []
+        for start in range(0, len(fd_ids), 500):  # Stay below SQLite's variable limit
+            chunk = fd_ids[start:start + 500]
+            rows += conn.execute(f"SELECT {FIELD_DEVICE_COLUMNS} FROM field_devices WHERE FD_ID IN ({', '.join('?' * len(chunk))})",
+                                 chunk).fetchall()
+        self.last_seq = changes[-1][0]
+        return self.apply(rows, fd_ids)
+
+    def prune(self):
+        with self.connection() as conn:
+            conn.execute('DELETE FROM fd_changes WHERE Changed < ?', (time.time() - self.retention,))
+
+    def run(self):
+        last_prune = time.monotonic()
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.poll()
+                REGISTRY_POLLS.inc(result='success')
+                if time.monotonic() - last_prune > 3600:
+                    self.prune()
+                    last_prune = time.monotonic()
+            except Exception as e:
+                REGISTRY_POLLS.inc(result='failure')
+                logger.exception("Failed to poll the field device registry: %s", e)
+
+    def start(self):
+        self.sync_all()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
@@ -0,0 +1,657 @@
+# device_store.py
+
+import array
+import math
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from multiprocessing import shared_memory
+
+# Classification values are stored as small integer codes. The order matches the
+# ADA priority (Good > Acceptable > Poor), so codes can be sorted on directly.
+STATUSES = (None, 'Good', 'Acceptable', 'Poor', 'Unavailable')
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+
+# Fields of the nested metric records, per metric kind
+METRIC_FIELDS = {
+    'active_metrics': ('latency', 'packet_loss', 'throughput', 'status', 'last_active'),
+    'passive_metrics': ('latency', 'throughput', 'status', 'last_active'),
+}
+METRIC_PREFIXES = {'active_metrics': 'active_', 'passive_metrics': 'passive_'}
+
+# Fixed numeric schema: column name -> array typecode.
+# Missing float values are stored as NaN and status code 0 means "no status yet".
+COLUMNS = (
+    ('version', 'q'),  # Per-row seqlock counter, odd while a multi-field update is in progress
+    ('port', 'i'),
+    ('last_data_received', 'd'),
+    ('active_latency', 'd'),
+    ('active_packet_loss', 'd'),
+    ('active_throughput', 'd'),
+    ('active_status', 'b'),
+    ('active_last_active', 'd'),
+    ('passive_latency', 'd'),
+    ('passive_throughput', 'd'),
+    ('passive_status', 'b'),
+    ('passive_last_active', 'd'),
+)
+RECORD_FIELDS = ('ip_address', 'port', 'region', 'last_data_received', 'active_metrics', 'passive_metrics')
+
+NAN = float('nan')
+
+# Consistent copy of one FD row, as returned by DeviceStore.snapshot()
+DeviceSnapshot = namedtuple('DeviceSnapshot', (
+    'fd_id', 'ip_address', 'port', 'region', 'last_data_received', 'active_metrics', 'passive_metrics', 'version',
+))
+
+
+def to_timestamp(value):
+    """Convert an ISO string, datetime or epoch float into an epoch float (NaN for None)."""
+    if value is None:
+        return NAN
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+def decode_metric(key, raw):
+    """Column value -> metric value as the modules see it."""
+    if key == 'status':
+        return STATUSES[raw]
+    if math.isnan(raw):
+        return None
+    if key == 'last_active':
+        return datetime.fromtimestamp(raw)
+    return raw
+
+
+def encode_metric(key, value):
+    """Metric value -> column value."""
+    if key == 'status':
+        return STATUS_CODES[value]
+    if key == 'last_active':
+        return to_timestamp(value)
+    return NAN if value is None else value
+
+
+class StripedLocks:
+    """
+    A fixed number of locks shared by all FDs, picked by hashing the FD id. Indexing works
+    like the old per-FD lock dict (``fd_locks[fd_id]``); locked() also records the time
+    spent waiting for each stripe.
+    """
+
+    def __init__(self, stripes=64):
+        self.stripes = stripes
+        self.locks = [threading.Lock() for _ in range(stripes)]
+        # Per-stripe wait statistics, only updated while holding that stripe
+        self.acquisitions = [0] * stripes
+        self.wait_total = [0.0] * stripes
+        self.wait_max = [0.0] * stripes
+
+    def stripe(self, key):
+        return hash(key) % self.stripes
+
+    def __getitem__(self, key):
+        return self.locks[self.stripe(key)]
+
+    def locked(self, key):
+        return self.stripe_locked(self.stripe(key))
+
+    @contextmanager
+    def stripe_locked(self, index):
+        lock = self.locks[index]
+        start = time.perf_counter()
+        with lock:
+            waited = time.perf_counter() - start
+            self.acquisitions[index] += 1
+            self.wait_total[index] += waited
+            if waited > self.wait_max[index]:
+                self.wait_max[index] = waited
+            yield
+
+    @contextmanager
+    def all_locked(self):
+        """Hold every stripe, in order, e.g. while the store changes shape."""
+        for lock in self.locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(self.locks):
+                lock.release()
+
+    def wait_stats(self):
+        acquisitions = sum(self.acquisitions)
+        total = sum(self.wait_total)
+        return {
+            'acquisitions': acquisitions,
+            'wait_total_s': total,
+            'wait_mean_s': total / acquisitions if acquisitions else 0.0,
+            'wait_max_s': max(self.wait_max),
+        }
+
+
+class MetricsView:
+    """Dict-like view of the active or passive metrics of one field device."""
+
+    __slots__ = ('_store', '_row', '_kind', '_prefix', '_fields')
+
+    def __init__(self, store, row, kind):
+        self._store = store
+        self._row = row
+        self._kind = kind
+        self._prefix = METRIC_PREFIXES[kind]
+        self._fields = METRIC_FIELDS[kind]
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        if key not in self._fields:
+            return default
+        return decode_metric(key, self._store.columns[self._prefix + key][self._row])
+
+    def __setitem__(self, key, value):
+        if key not in self._fields:
+            raise KeyError(f"Unknown metric '{key}'")
+        self._store.update_row(self._row, **{self._kind: {key: value}})
+
+    def __contains__(self, key):
+        return key in self._fields
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def keys(self):
+        return list(self._fields)
+
+    def items(self):
+        return [(key, self.get(key)) for key in self._fields]
+
+    def update(self, values):
+        for key in values:
+            if key not in self._fields:
+                raise KeyError(f"Unknown metric '{key}'")
+        self._store.update_row(self._row, **{self._kind: dict(values)})
+
+    def to_dict(self):
+        return dict(self.items())
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class DeviceRecord:
+    """Dict-like view of one field device row, compatible with the old nested Manager dicts."""
+
+    __slots__ = ('_store', '_row', 'fd_id')
+
+    def __init__(self, store, row, fd_id):
+        self._store = store
+        self._row = row
+        self.fd_id = fd_id
+
+    @property
+    def row(self):
+        return self._row
+
+    def __getitem__(self, key):
+        store = self._store
+        if key == 'ip_address':
+            return store.ip_addresses[self._row]
+        if key == 'region':
+            return store.regions[self._row]
+        if key == 'port':
+            return store.columns['port'][self._row]
+        if key == 'last_data_received':
+            value = store.columns['last_data_received'][self._row]
+            return None if math.isnan(value) else datetime.fromtimestamp(value).isoformat()
+        if key in METRIC_PREFIXES:
+            return MetricsView(store, self._row, key)
+        raise KeyError(key)
+
+    def get(self, key, default=None):
+        if key not in RECORD_FIELDS:
+            return default
+        return self[key]
+
+    def __setitem__(self, key, value):
+        store = self._store
+        if key == 'last_data_received':
+            store.update_row(self._row, last_data_received=value)
+        elif key == 'port':
+            store.update_row(self._row, port=int(value))
+        elif key in METRIC_PREFIXES:
+            # Assigning the view back to itself (the old Manager idiom) is a no-op
+            if isinstance(value, MetricsView) and value._store is store and value._row == self._row:
+                return
+            MetricsView(store, self._row, key).update(value)
+        else:
+            raise KeyError(f"Field '{key}' is read-only or unknown")
+
+    def __contains__(self, key):
+        return key in RECORD_FIELDS
+
+    def __iter__(self):
+        return iter(RECORD_FIELDS)
+
+    def keys(self):
+        return list(RECORD_FIELDS)
+
+    def to_dict(self):
+        record = {key: self[key] for key in RECORD_FIELDS}
+        record['active_metrics'] = record['active_metrics'].to_dict()
+        record['passive_metrics'] = record['passive_metrics'].to_dict()
+        return record
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+
+class DeviceStore:
+    """
+    Fixed-schema, column-oriented store of field device state.
+
+    Numeric state lives in one typed array per column, indexed by row, so fleet-wide scans
+    are plain array reads instead of Manager proxy round-trips. The store behaves like the
+    old ``field_devices`` mapping (``get``, ``items``, ``fd_info['active_metrics']`` ...).
+
+    With ``shared=True`` the numeric columns are placed in a ``multiprocessing.shared_memory``
+    block, and pickling the store (e.g. passing it to a ``multiprocessing.Process``) attaches
+    the child to the same block instead of copying it.
+
+    Single field reads are atomic. All writes, the record views included, go through
+    update_row(), which serializes writers on striped locks and bumps the row's seqlock
+    version; snapshot() reads a consistent copy of a row without taking any lock. The locks
+    are per process, so in shared mode each FD row should have one writing process.
+
+    FDs can be added and removed while the modules run (see device_registry.py). Rows are
+    never reused: a removed FD leaves a dead row behind with no status, so row numbers held
+    by other modules stay valid and fleet-wide scans skip it like an FD not probed yet.
+    ``len()`` and the mapping interface only cover live FDs, ``rows`` counts every row.
+    """
+
+    def __init__(self, fd_ids, ip_addresses, regions, shared=False, shm_name=None, lock_stripes=64):
+        self.fd_ids = list(fd_ids)
+        self.ip_addresses = list(ip_addresses)
+        self.regions = list(regions)
+        self.index = {fd_id: row for row, fd_id in enumerate(self.fd_ids)}
+        self.status_listeners = []  # Called as listener(fd_id, column, status) when a status changes (None: FD removed)
+        self.device_listeners = []  # Called as listener(added, updated, removed) when FDs are added, changed or removed
+        self.dirty = bytearray(len(self.fd_ids))  # 1 for rows written since the last take_dirty(), for persistence
+        self.locks = StripedLocks(lock_stripes)  # Writer locks, also handed out as fd_locks
+        self.shm = None
+        self._owner = False
+
+        capacity = len(self.fd_ids)
+        if shared:
+            self.columns = self._map_shared_columns(capacity, shm_name)
+        else:
+            self.columns = {name: self._new_column(typecode, capacity) for name, typecode in COLUMNS}
+
+        self.records = [DeviceRecord(self, row, fd_id) for row, fd_id in enumerate(self.fd_ids)]
+
+    @classmethod
+    def from_rows(cls, rows, shared=False, lock_stripes=64):
+        """Build a store from (fd_id, ip_address, region, port, last_data_received) rows."""
+        rows = list(rows)
+        store = cls(
+            [str(row[0]) for row in rows],
+            [row[1] for row in rows],
+            [row[2] for row in rows],
+            shared=shared,
+            lock_stripes=lock_stripes,
+        )
+        ports = store.columns['port']
+        last_received = store.columns['last_data_received']
+        for index, (_, _, _, port, last_data_received) in enumerate(rows):
+            ports[index] = port
+            last_received[index] = to_timestamp(last_data_received)
+        return store
+
+    @staticmethod
+    def _new_column(typecode, capacity):
+        fill = NAN if typecode == 'd' else 0
+        return array.array(typecode, [fill]) * capacity
+
+    @staticmethod
+    def _layout(capacity):
+        # Each column is 8-byte aligned inside the shared block
+        offsets = {}
+        offset = 0
+        for name, typecode in COLUMNS:
+            offsets[name] = offset
+            size = array.array(typecode).itemsize * capacity
+            offset += (size + 7) & ~7
+        return offsets, max(offset, 8)
+
+    def _map_shared_columns(self, capacity, shm_name):
+        offsets, size = self._layout(capacity)
+        if shm_name is None:
+            self.shm = shared_memory.SharedMemory(create=True, size=size)
+            self._owner = True
+        else:
+            self.shm = shared_memory.SharedMemory(name=shm_name)
+
+        columns = {}
+        for name, typecode in COLUMNS:
+            nbytes = array.array(typecode).itemsize * capacity
+            raw = self.shm.buf[offsets[name]:offsets[name] + nbytes]
+            if self._owner:
+                raw[:] = self._new_column(typecode, capacity).tobytes()
+            columns[name] = raw.cast(typecode)
+        return columns
+
+    def __reduce__(self):
+        if self.shm is None:
+            raise TypeError("Only a shared DeviceStore can be passed to another process")
+        return (DeviceStore, (self.fd_ids, self.ip_addresses, self.regions, True, self.shm.name))
+
+    def close(self):
+        """Release the shared memory block (the creating process also unlinks it)."""
+        if self.shm is None:
+            return
+        for name in list(self.columns):
+            self.columns[name].release()
+        self.columns = {}
+        self.shm.close()
+        if self._owner:
+            self.shm.unlink()
+        self.shm = None
+
+    # Mapping interface (same operations as the old Manager dict)
+
+    def get(self, fd_id, default=None):
+        row = self.index.get(fd_id)
+        return default if row is None else self.records[row]
+
+    def __getitem__(self, fd_id):
+        return self.records[self.index[fd_id]]
+
+    def __contains__(self, fd_id):
+        return fd_id in self.index
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.index)
+
+    def keys(self):
+        return list(self.index)
+
+    def values(self):
+        records = self.records
+        return [records[row] for row in list(self.index.values())]
+
+    def items(self):
+        records = self.records
+        return [(fd_id, records[row]) for fd_id, row in list(self.index.items())]
+
+    # Column access for fleet-wide scans
+
+    @property
+    def rows(self):
+        """Number of rows, dead rows of removed FDs included. Columns are at least this long."""
+        return len(self.fd_ids)
+
+    def row_of(self, fd_id):
+        return self.index[fd_id]
+
+    def is_live(self, row):
+        """False for the row of a removed FD."""
+        return self.index.get(self.fd_ids[row]) == row
+
+    def column(self, name):
+        return self.columns[name]
+
+    def set_status(self, row, prefix, status):
+        kind = 'active_metrics' if prefix == 'active_' else 'passive_metrics'
+        self.update_row(row, **{kind: {'status': status}})
+
+    # Consistent multi-field updates and lock-free snapshots
+
+    def update_metrics(self, fd_id, kind, values):
+        """Atomically update several metrics of one FD, e.g. update_metrics('7', 'active_metrics', {...})."""
+        self.update_record(fd_id, **{kind: values})
+
+    def update_record(self, fd_id, last_data_received=None, active_metrics=None, passive_metrics=None):
+        """Atomically update last_data_received and/or the metrics of one FD. Removed FDs are skipped."""
+        row = self.index.get(fd_id)
+        if row is None:
+            return  # e.g. a probe or fetch that was in flight when the FD was removed
+        self.update_row(row, last_data_received, active_metrics, passive_metrics)
+
+    def update_row(self, row, last_data_received=None, active_metrics=None, passive_metrics=None, port=None):
+        """update_record() by row, for the record views. A dead row is skipped."""
+        fd_id = self.fd_ids[row]
+        changed_statuses = []
+
+        with self.locks.locked(fd_id):
+            if self.index.get(fd_id) != row:
+                return  # Removed, possibly re-added on another row
+            columns = self.columns
+            version = columns['version']
+            version[row] += 1  # Odd: readers retry until the update is complete
+            try:
+                if last_data_received is not None:
+                    columns['last_data_received'][row] = to_timestamp(last_data_received)
+                if port is not None:
+                    columns['port'][row] = port
+                for kind, values in (('active_metrics', active_metrics), ('passive_metrics', passive_metrics)):
+                    if values and self._write_metrics(row, kind, values):
+                        changed_statuses.append((METRIC_PREFIXES[kind] + 'status', values['status']))
+            finally:
+                version[row] += 1
+            self.mark_dirty(row)
+
+        # Listeners run outside the lock, so they may read or update the store themselves
+        for column, status in changed_statuses:
+            for listener in self.status_listeners:
+                listener(fd_id, column, status)
+
+    def update_many(self, kind, updates):
+        """
+        Atomically update the metrics of many FDs, e.g. update_many('passive_metrics', [(fd_id, {...}), ...]).
+        Updates are grouped by lock stripe, so each stripe is taken once per batch.
+        Unknown FDs are skipped. Returns the number of updates applied.
+        """
+        by_stripe = {}
+        for fd_id, values in updates:
+            row = self.index.get(fd_id)
+            if row is not None:
+                by_stripe.setdefault(self.locks.stripe(fd_id), []).append((fd_id, row, values))
+
+        changed_statuses = []
+        applied = 0
+        for index, items in by_stripe.items():
+            with self.locks.stripe_locked(index):
+                version = self.columns['version']
+                for fd_id, row, values in items:
+                    if self.index.get(fd_id) != row:
+                        continue  # Removed meanwhile
+                    version[row] += 1
+                    try:
+                        if self._write_metrics(row, kind, values):
+                            changed_statuses.append((fd_id, values['status']))
+                    finally:
+                        version[row] += 1
+                    self.mark_dirty(row)
+                    applied += 1
+
+        column = METRIC_PREFIXES[kind] + 'status'
+        for fd_id, status in changed_statuses:
+            for listener in self.status_listeners:
+                listener(fd_id, column, status)
+        return applied
+
+    def _write_metrics(self, row, kind, values):
+        """Write metric values to the columns. Returns True if the status changed."""
+        prefix = METRIC_PREFIXES[kind]
+        fields = METRIC_FIELDS[kind]
+        status_changed = False
+        for key, value in values.items():
+            if key not in fields:
+                raise KeyError(f"Unknown metric '{key}'")
+            raw = encode_metric(key, value)
+            column = self.columns[prefix + key]
+            if key == 'status' and column[row] != raw:
+                status_changed = True
+            column[row] = raw
+        return status_changed
+
+    def read_row(self, row):
+        """
+        Consistent copy of one row as ({column: raw value}, ip_address, region), dead rows
+        included. Never blocks: retries if a writer was mid-update.
+        """
+        columns = self.columns
+        version = columns['version']
+        while True:
+            before = version[row]
+            if before & 1:
+                time.sleep(0)  # Let the writer finish
+                continue
+            raw = {name: column[row] for name, column in columns.items()}
+            ip_address, region = self.ip_addresses[row], self.regions[row]
+            if version[row] == before:
+                return raw, ip_address, region
+
+    def snapshot(self, fd_id):
+        """Consistent copy of one FD row, decoded. Never blocks, like read_row()."""
+        raw, ip_address, region = self.read_row(self.index[fd_id])
+        before = raw['version']
+
+        metrics = {}
+        for kind, prefix in METRIC_PREFIXES.items():
+            metrics[kind] = {key: decode_metric(key, raw[prefix + key]) for key in METRIC_FIELDS[kind]}
+        last_received = raw['last_data_received']
+        return DeviceSnapshot(
+            fd_id, ip_address, raw['port'], region,
+            None if math.isnan(last_received) else last_received,
+            metrics['active_metrics'], metrics['passive_metrics'], before,
+        )
+
+    def add_status_listener(self, listener):
+        self.status_listeners.append(listener)
+
+    def add_device_listener(self, listener):
+        self.device_listeners.append(listener)
+
+    # Adding and removing FDs at runtime
+
+    def add_devices(self, rows):
+        """
+        Add FDs from (fd_id, ip_address, region, port, last_data_received) rows. FDs already in
+        the store get their address, region and port updated instead. Returns (added, updated).
+        """
+        # A fd_id repeated within the batch is added once, with the values of its last row
+        rows = list({str(fd_id): (str(fd_id), *rest) for fd_id, *rest in rows}.values())
+        new_rows = [row for row in rows if row[0] not in self.index]
+        if new_rows and self.shm is not None:
+            # Raised before anything changed, FDs already in the store can still be updated on their own
+            raise TypeError("A shared DeviceStore has a fixed size")
+        updated = []
+        for fd_id, ip_address, region, port, _ in rows:
+            if fd_id in self.index and self.update_device(fd_id, ip_address, region, port):
+                updated.append(fd_id)
+
+        added = []
+        if new_rows:
+            first = len(self.fd_ids)
+            with self.locks.all_locked():
+                # Writers pick the columns up under their stripe lock, so none can write to a replaced array
+                columns = {}
+                for name, typecode in COLUMNS:
+                    columns[name] = self.columns[name] + self._new_column(typecode, len(new_rows))
+                for offset, (_, _, _, port, last_data_received) in enumerate(new_rows):
+                    columns['port'][first + offset] = port
+                    columns['last_data_received'][first + offset] = to_timestamp(last_data_received)
+                self.columns = columns
+                self.dirty.extend(bytes(len(new_rows)))
+                for offset, (fd_id, ip_address, region, _, _) in enumerate(new_rows):
+                    self.fd_ids.append(fd_id)
+                    self.ip_addresses.append(ip_address)
+                    self.regions.append(region)
+                    self.records.append(DeviceRecord(self, first + offset, fd_id))
+            # Publish the rows last, a lookup never finds a row the columns do not have yet
+            for offset, (fd_id, _, _, _, _) in enumerate(new_rows):
+                self.index[fd_id] = first + offset
+                added.append(fd_id)
+
+        self._notify_devices(added, updated, [])
+        return added, updated
+
+    def update_device(self, fd_id, ip_address, region, port):
+        """Change the address, region or port of an FD. Returns True if anything changed."""
+        row = self.index[fd_id]
+        with self.locks.locked(fd_id):
+            port_column = self.columns['port']
+            if (self.ip_addresses[row], self.regions[row], port_column[row]) == (ip_address, region, port):
+                return False
+            version = self.columns['version']
+            version[row] += 1
+            try:
+                self.ip_addresses[row] = ip_address
+                self.regions[row] = region
+                port_column[row] = port
+            finally:
+                version[row] += 1
+            self.mark_dirty(row)
+        return True
+
+    def remove_devices(self, fd_ids):
+        """Remove FDs from the store. Their rows stay behind, dead. Returns the FDs removed."""
+        removed = []
+        changed_statuses = []
+        for fd_id in fd_ids:
+            row = self.index.get(fd_id)
+            if row is None:
+                continue
+            with self.locks.locked(fd_id):
+                del self.index[fd_id]
+                # No status: scans of the columns skip the row from now on
+                for column in ('active_status', 'passive_status'):
+                    if self.columns[column][row]:
+                        self.columns[column][row] = 0
+                        changed_statuses.append((fd_id, column))
+                self.dirty[row] = 0
+            removed.append(fd_id)
+
+        # Status listeners see the statuses cleared like any other change, then device listeners the removal
+        for fd_id, column in changed_statuses:
+            for listener in self.status_listeners:
+                listener(fd_id, column, None)
+        self._notify_devices([], [], removed)
+        return removed
+
+    def _notify_devices(self, added, updated, removed):
+        if added or updated or removed:
+            for listener in self.device_listeners:
+                listener(added, updated, removed)
+
+    def mark_dirty(self, row):
+        # A single byte store, so writers never contend on it. Always called after the write.
+        self.dirty[row] = 1
+
+    def take_dirty(self):
+        """
+        Return the rows written since the last call and clear their flags (process-local).
+        Flags are cleared before the caller reads the rows, so a concurrent write is never lost.
+        """
+        dirty = self.dirty
+        rows = [row for row, flag in enumerate(dirty) if flag]
+        for row in rows:
+            dirty[row] = 0
+        return rows
+
+    def __repr__(self):
+        return f"DeviceStore({len(self)} field devices, shared={self.shm is not None})"
@@ -0,0 +1,110 @@
+# fetch_scheduler.py
+
+import heapq
+import itertools
+import threading
+
+
+class FetchScheduler:
+    """
+    Min-heap of FDs keyed on (next due time, classification priority).
+
+    Entries are updated incrementally: rescheduling or removing a FD only marks its old heap
+    entry as stale, and stale entries are dropped when they reach the top of the heap. Picking
+    the next FD is O(log n) and never rescans the fleet. Thread-safe.
+    """
+
+    def __init__(self):
+        self.heap = []  # (due, priority, sequence, fd_id)
+        self.entries = {}  # fd_id -> sequence of its live heap entry
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.changes = 0  # Bumped by schedule() and wake(), so wait() notices what happened before it blocked
+
+    def schedule(self, fd_id, due, priority):
+        """Add the FD, or move it if it is already scheduled."""
+        with self.condition:
+            sequence = next(self.sequence)
+            self.entries[fd_id] = sequence
+            heapq.heappush(self.heap, (due, priority, sequence, fd_id))
+            self._compact()
+            self.changes += 1
+            self.condition.notify_all()
+
+    def rebuild(self, score):
+        """
+        Replace the whole schedule with the (due, priority, fd_id) entries returned by score(),
+        in one O(n) heapify instead of n pushes. score() runs under the scheduler lock, so a
+        schedule() racing the rebuild is applied after it, not overwritten by an older score.
+        """
+        with self.condition:
+            heap = []
+            entries = {}
+            for due, priority, fd_id in score():
+                sequence = next(self.sequence)
+                entries[fd_id] = sequence
+                heap.append((due, priority, sequence, fd_id))
+            heapq.heapify(heap)
+            self.heap = heap
+            self.entries = entries
+            self.changes += 1
+            self.condition.notify_all()
+
+    def remove(self, fd_id):
+        with self.condition:
+            self.entries.pop(fd_id, None)
+
+    def pop_due(self, now):
+        """Remove and return the most urgent FD that is due at `now`, or None."""
+        with self.condition:
+            self._drop_stale()
+            if not self.heap or self.heap[0][0] > now:
+                return None
+            _, _, _, fd_id = heapq.heappop(self.heap)
+            del self.entries[fd_id]
+            return fd_id
+
+    def next_due(self):
+        """Due time of the most urgent FD, or None if nothing is scheduled."""
+        with self.condition:
+            self._drop_stale()
+            return self.heap[0][0] if self.heap else None
+
+    def wait(self, timeout, changes=None):
+        """
+        Block until something is (re)scheduled or the timeout expires. Pass the value of
+        self.changes read before deciding to wait: if anything changed since, returns at once
+        instead of sleeping through a wake that came too early.
+        """
+        with self.condition:
+            if changes is None:
+                changes = self.changes
+            self.condition.wait_for(lambda: self.changes != changes, timeout)
+
+    def wake(self):
+        """Wake up wait() callers, e.g. because a fetch slot was freed or a focus job arrived."""
+        with self.condition:
+            self.changes += 1
+            self.condition.notify_all()
+
+    def ordered(self):
+        """All scheduled FDs in fetch order (for inspection, O(n log n))."""
+        with self.condition:
+            return [entry[3] for entry in sorted(self.heap) if self.entries.get(entry[3]) == entry[2]]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, fd_id):
+        return fd_id in self.entries
+
+    def _drop_stale(self):
+        heap = self.heap
+        while heap and self.entries.get(heap[0][3]) != heap[0][2]:
+            heapq.heappop(heap)
+
+    def _compact(self):
+        # Rebuild once stale entries dominate, so the heap stays O(live FDs)
+        if len(self.heap) > 2 * len(self.entries) + 64:
+            self.heap = [entry for entry in self.heap if self.entries.get(entry[3]) == entry[2]]
+            heapq.heapify(self.heap)
@@ -0,0 +1,195 @@
+# focus_jobs.py
+
+import heapq
+import itertools
+import threading
+import time
+import uuid
+
+# Background (non-focus) fetches run at this priority; focus jobs above it preempt them
+BACKGROUND_PRIORITY = 0
+
+
+class FocusJob:
+    """
+    A backend request to sample some FDs: every FD is fetched once per sample_interval
+    seconds until the job is cancelled or `duration` seconds have passed. Each sample should
+    be delivered within `deadline` seconds of being due. Jobs with a higher priority go
+    first and may preempt lower priority fetches. reply(message) is called with a dict for
+    every sample and when the job ends.
+    """
+
+    def __init__(self, fd_ids, priority=10, sample_interval=1.0, deadline=None, duration=None, job_id=None, reply=None):
+        self.job_id = job_id or uuid.uuid4().hex[:12]
+        self.fd_ids = list(dict.fromkeys(fd_ids))  # A repeated FD would get two samples per interval
+        self.priority = priority
+        self.sample_interval = sample_interval
+        self.deadline = deadline
+        self.duration = duration
+        self.reply = reply
+        self.created = time.time()
+        self.expires_at = self.created + duration if duration is not None else None
+        self.samples = 0
+        self.delivered = 0
+        self.deadline_missed = 0
+
+    @classmethod
+    def from_request(cls, request, reply=None):
+        """Job from a backend JSON request, e.g. {"fd_ids": [1, 2], "priority": 20, "sample_rate": 2, "deadline": 0.5}."""
+        fd_ids = request['fd_ids']
+        if isinstance(fd_ids, str):
+            fd_ids = fd_ids.split(',')
+        sample_rate = float(request.get('sample_rate', 1.0))
+        deadline = request.get('deadline')
+        duration = request.get('duration')
+        if sample_rate <= 0:
+            raise ValueError("sample_rate must be positive")
+        return cls(
+            [str(fd_id).strip() for fd_id in fd_ids],
+            priority=int(request.get('priority', 10)),
+            sample_interval=1 / sample_rate,
+            deadline=float(deadline) if deadline is not None else None,
+            duration=float(duration) if duration is not None else None,
+            job_id=str(request['job_id']) if request.get('job_id') is not None else None,
+            reply=reply,
+        )
+
+    def record_sample(self, fd_id, result, due, delivered_at):
+        """Count a finished sample and tell the backend about it."""
+        self.samples += 1
+        deadline_met = None
+        if self.deadline is not None:
+            deadline_met = delivered_at - due <= self.deadline
+            if not deadline_met:
+                self.deadline_missed += 1
+        if result == 'delivered':
+            self.delivered += 1
+        self.send({
+            'type': 'sample', 'job_id': self.job_id, 'fd_id': fd_id, 'result': result,
+            'due': due, 'delivered_at': delivered_at, 'latency_s': delivered_at - due, 'deadline_met': deadline_met,
+        })
+
+    def finish(self, reason):
+        self.send({
+            'type': 'job_done', 'job_id': self.job_id, 'reason': reason, 'samples': self.samples,
+            'delivered': self.delivered, 'deadline_missed': self.deadline_missed,
+        })
+
+    def send(self, message):
+        if self.reply is not None:
+            try:
+                self.reply(message)
+            except Exception:
+                pass  # The backend connection may be gone; the job keeps running until cancelled
+
+
+class FocusQueue:
+    """
+    Samples of the active focus jobs. Samples wait in a heap on their due time; once due they
+    move to a ready heap ordered by (priority, deadline), so the most urgent due sample is
+    popped first. A job has at most one sample per FD queued or in flight. Thread-safe.
+    """
+
+    def __init__(self):
+        self.jobs = {}  # job_id -> FocusJob
+        self.waiting = []  # (due, sequence, job, fd_id)
+        self.ready = []  # (-priority, deadline_at, sequence, job, due, fd_id)
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+
+    def submit(self, job, now=None):
+        """Add a job (replacing a job with the same id). Returns the replaced job, if any."""
+        now = time.time() if now is None else now
+        with self.lock:
+            replaced = self.jobs.pop(job.job_id, None)
+            self.jobs[job.job_id] = job
+            for fd_id in job.fd_ids:
+                heapq.heappush(self.waiting, (now, next(self.sequence), job, fd_id))
+            return replaced
+
+    def cancel(self, job_id):
+        with self.lock:
+            return self.jobs.pop(job_id, None)
+
+    def cancel_all(self):
+        with self.lock:
+            jobs = list(self.jobs.values())
+            self.jobs.clear()
+            self.waiting.clear()
+            self.ready.clear()
+            return jobs
+
+    def expire(self, now=None):
+        """Remove and return the jobs whose duration is over."""
+        now = time.time() if now is None else now
+        with self.lock:
+            expired = [job for job in self.jobs.values() if job.expires_at is not None and job.expires_at <= now]
+            for job in expired:
+                del self.jobs[job.job_id]
+            return expired
+
+    def _is_active(self, job):
+        return self.jobs.get(job.job_id) is job
+
+    def is_active(self, job):
+        """False once the job was cancelled, replaced or expired."""
+        with self.lock:
+            return self._is_active(job)
+
+    def _promote_due(self, now):
+        # Move due samples to the ready heap and drop the samples of ended jobs from its top
+        waiting = self.waiting
+        while waiting and waiting[0][0] <= now:
+            due, sequence, job, fd_id = heapq.heappop(waiting)
+            if self._is_active(job):
+                deadline_at = due + job.deadline if job.deadline is not None else float('inf')
+                heapq.heappush(self.ready, (-job.priority, deadline_at, sequence, job, due, fd_id))
+        ready = self.ready
+        while ready and not self._is_active(ready[0][3]):
+            heapq.heappop(ready)
+
+    def pop_due(self, now=None):
+        """The most urgent due sample as (job, fd_id, due), or None."""
+        now = time.time() if now is None else now
+        with self.lock:
+            self._promote_due(now)
+            if not self.ready:
+                return None
+            _, _, _, job, due, fd_id = heapq.heappop(self.ready)
+            return job, fd_id, due
+
+    def peek_priority(self, now=None):
+        """Priority of the most urgent due sample (without popping it), or None."""
+        now = time.time() if now is None else now
+        with self.lock:
+            self._promote_due(now)
+            return self.ready[0][3].priority if self.ready else None
+
+    def requeue(self, job, fd_id, due):
+        """Put back a sample that could not run (e.g. it was preempted), keeping its due time."""
+        with self.lock:
+            if self._is_active(job):
+                heapq.heappush(self.waiting, (due, next(self.sequence), job, fd_id))
+
+    def sample_done(self, job, fd_id, due, now=None):
+        """Schedule the FD's next sample of the job, keeping the sample rate (samples missed while busy are skipped)."""
+        now = time.time() if now is None else now
+        next_due = due + job.sample_interval
+        if next_due < now:
+            next_due = now
+        with self.lock:
+            if self._is_active(job) and (job.expires_at is None or next_due < job.expires_at):
+                heapq.heappush(self.waiting, (next_due, next(self.sequence), job, fd_id))
+
+    def next_due(self):
+        """Due time of the next sample, or None if no job is active."""
+        with self.lock:
+            ready = self.ready
+            while ready and not self._is_active(ready[0][3]):
+                heapq.heappop(ready)
+            if ready:
+                return 0.0
+            return self.waiting[0][0] if self.waiting else None
+
+    def __len__(self):
+        return len(self.jobs)
@@ -0,0 +1,188 @@
+# icmp_prober.py
+
+import heapq
+import logging
+import random
+import socket
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+ICMP_ECHO_REQUEST = 8
+ICMP_ECHO_REPLY = 0
+ICMP_HEADER = struct.Struct('!BBHHH')  # type, code, checksum, identifier, sequence
+IP_HEADER_MIN_SIZE = 20
+
+
+def icmp_checksum(data):
+    """Internet checksum (RFC 1071) of the given bytes."""
+    if len(data) % 2:
+        data += b'\x00'
+    total = sum(struct.unpack(f'!{len(data) // 2}H', data))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def build_echo_request(identifier, sequence, payload):
+    header = ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, 0, identifier, sequence)
+    checksum = icmp_checksum(header + payload)
+    return ICMP_HEADER.pack(ICMP_ECHO_REQUEST, 0, checksum, identifier, sequence) + payload
+
+
+def open_icmp_socket():
+    """
+    Open an ICMP socket. Prefers the unprivileged datagram ICMP socket (Linux, allowed by
+    net.ipv4.ping_group_range) and falls back to a raw socket, which needs root/CAP_NET_RAW.
+    """
+    try:
+        return socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_ICMP)
+    except (PermissionError, OSError):
+        return socket.socket(socket.AF_INET, socket.SOCK_RAW, socket.IPPROTO_ICMP)
+
+
+class BatchedIcmpProber:
+    """
+    Pings many hosts at once from a single ICMP socket.
+
+    The echo requests of round n all carry sequence number n, so replies can be matched back
+    to (host, send time) whatever order they arrive in, however many hosts there are. Each
+    call to probe() opens its own socket, which makes the prober safe to share between threads.
+    Hostnames are resolved once per probe() call, since replies come back from an address.
+    If no ICMP socket can be opened (no CAP_NET_RAW and ping sockets not allowed), every host
+    is reported unreachable and the error is logged once.
+    """
+
+    def __init__(self, socket_factory=open_icmp_socket, payload_size=32):
+        self.socket_factory = socket_factory
+        self.payload = b'\x00' * payload_size
+        self.socket_failing = False  # Last socket_factory() call failed, already logged
+
+    def probe(self, ip_addresses, count=5, timeout=2, interval=0.1):
+        """
+        Send count echo requests to every host and collect the replies.
+        Returns {ip_address: (avg_latency_ms, packet_loss_percent)}, like ping_icmp_test(),
+        keyed by the hosts as given (hostnames included).
+        """
+        if not 0 < count <= 0x10000:
+            raise ValueError(f"count must be between 1 and 65536 (one sequence number per round), got {count}")
+        hosts = list(dict.fromkeys(ip_addresses))  # Unique hosts, in order
+        if not hosts:
+            return {}
+
+        try:
+            sock = self.socket_factory()
+        except OSError as e:
+            if not self.socket_failing:
+                logger.error("Cannot open an ICMP socket, all FDs are reported unreachable: %s", e,
+                             extra={'event': 'icmp_socket_failed'})
+                self.socket_failing = True
+            return {host: (None, 100.0) for host in hosts}
+        if self.socket_failing:
+            logger.info("ICMP socket available again", extra={'event': 'icmp_socket_recovered'})
+            self.socket_failing = False
+        try:
+            addresses = self._resolve(hosts)
+            targets = list(dict.fromkeys(address for address in addresses.values() if address is not None))
+            latencies = {ip: [] for ip in targets}
+            self._run_batch(sock, targets, latencies, count, timeout, interval)
+        finally:
+            sock.close()
+
+        results = {}
+        for host in hosts:
+            samples = latencies.get(addresses[host])
+            if samples:
+                results[host] = (sum(samples) / len(samples), ((count - len(samples)) / count) * 100)
+            else:
+                results[host] = (None, 100.0)  # No successful pings, or the name did not resolve
+        return results
+
+    @staticmethod
+    def _resolve(hosts):
+        """{host: IPv4 address, or None if it cannot be resolved}. Addresses resolve to themselves."""
+        addresses = {}
+        for host in hosts:
+            try:
+                addresses[host] = socket.gethostbyname(host)
+            except (OSError, UnicodeError) as e:  # socket.gaierror, or a malformed name
+                logger.warning("Cannot resolve %s, reported unreachable: %s", host, e,
+                               extra={'event': 'icmp_resolve_failed'})
+                addresses[host] = None
+        return addresses
+
+    def _run_batch(self, sock, targets, latencies, count, timeout, interval):
+        # Datagram ICMP sockets get no IP header and the kernel rewrites the identifier,
+        # raw sockets see every ICMP packet on the host, so only those check the identifier.
+        is_raw = sock.type == socket.SOCK_RAW
+        identifier = random.getrandbits(16)
+
+        pending = {}  # (ip, sequence) -> send time
+        deadlines = []  # heap of (deadline, ip, sequence)
+        next_round = 0
+        next_send_at = time.perf_counter()
+
+        while next_round < count or pending:
+            now = time.perf_counter()
+
+            # Fire the next round of echo requests to all hosts
+            if next_round < count and now >= next_send_at:
+                # (host, round) is unique, a global counter would wrap and collide past 65536 requests
+                seq = next_round
+                packet = build_echo_request(identifier, seq, self.payload)
+                for ip in targets:
+                    try:
+                        sock.sendto(packet, (ip, 0))
+                    except OSError:
+                        continue  # Unroutable host, counted as lost
+                    sent_at = time.perf_counter()
+                    pending[(ip, seq)] = sent_at
+                    heapq.heappush(deadlines, (sent_at + timeout, ip, seq))
+                next_round += 1
+                next_send_at = now + interval
+                continue
+
+            # Expire requests that were not answered in time
+            while deadlines and deadlines[0][0] <= now:
+                _, ip, seq = heapq.heappop(deadlines)
+                pending.pop((ip, seq), None)
+            if not pending and next_round >= count:
+                break
+
+            # Wait for the next reply, but not past the next send or expiry
+            wake_at = deadlines[0][0] if deadlines else now + timeout
+            if next_round < count:
+                wake_at = min(wake_at, next_send_at)
+            sock.settimeout(max(wake_at - now, 0.0001))
+            try:
+                data, address = sock.recvfrom(2048)
+            except socket.timeout:
+                continue
+            received_at = time.perf_counter()
+
+            reply = self._parse_reply(data, is_raw, identifier)
+            if reply is None:
+                continue
+            key = (address[0], reply)
+            sent_at = pending.pop(key, None)
+            if sent_at is not None:
+                latencies[address[0]].append((received_at - sent_at) * 1000)  # ms
+
+    @staticmethod
+    def _parse_reply(data, is_raw, identifier):
+        """Return the sequence number of an echo reply meant for us, else None."""
+        if is_raw:
+            if len(data) < IP_HEADER_MIN_SIZE:
+                return None
+            header_length = (data[0] & 0x0f) * 4
+            data = data[header_length:]
+        if len(data) < ICMP_HEADER.size:
+            return None
+        icmp_type, _, _, reply_identifier, sequence = ICMP_HEADER.unpack_from(data)
+        if icmp_type != ICMP_ECHO_REPLY:
+            return None
+        if is_raw and reply_identifier != identifier:
+            return None
+        return sequence
+
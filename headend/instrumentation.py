@@ -0,0 +1,228 @@
+# instrumentation.py
+
+import asyncio
+import logging
+import math
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Default histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def _format_value(value):
+    if value is None:
+        return 'NaN'
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base of the metric types: a value per combination of label values. Thread-safe."""
+
+    type_name = None
+
+    def __init__(self, name, help_text='', labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """(suffix, label values, extra labels, value) of every series."""
+        with self.lock:
+            return [('', key, (), value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down. set_function() makes it read a callable at scrape time."""
+
+    type_name = 'gauge'
+
+    def __init__(self, name, help_text='', labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.function = None
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            try:
+                return [('', (), (), self.function())]
+            except Exception as e:
+                logger.warning("Failed to read gauge %s: %s", self.name, e)
+                return []
+        return super().samples()
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name, help_text='', labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            index = 0
+            for bound in self.buckets:
+                if value <= bound:
+                    break
+                index += 1
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, series in self.values.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets + (math.inf,), series):
+                    cumulative += count
+                    samples.append(('_bucket', key, (('le', _format_value(float(bound))),), cumulative))
+                samples.append(('_sum', key, (), series[-2]))
+                samples.append(('_count', key, (), series[-1]))
+        return samples
+
+
+class Registry:
+    """
+    Named metrics plus collectors: functions called at scrape time that return
+    (name, type, help, [(labels dict, value), ...]) for values other modules already keep.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.collectors = []
+        self.lock = threading.Lock()
+
+    def _get_or_create(self, cls, name, help_text, labelnames, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = cls(name, help_text, labelnames, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"{name} is already registered as a {metric.type_name}")
+            return metric
+
+    def counter(self, name, help_text='', labelnames=()):
+        return self._get_or_create(Counter, name, help_text, labelnames)
+
+    def gauge(self, name, help_text='', labelnames=()):
+        return self._get_or_create(Gauge, name, help_text, labelnames)
+
+    def histogram(self, name, help_text='', labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def add_collector(self, collector):
+        with self.lock:
+            self.collectors.append(collector)
+
+    def render(self):
+        """Prometheus text exposition format."""
+        with self.lock:
+            metrics = list(self.metrics.values())
+            collectors = list(self.collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                collected = collector()
+            except Exception as e:
+                logger.warning("Metrics collector %s failed: %s", collector, e)
+                continue
+            for name, type_name, help_text, series in collected:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {type_name}")
+                for labels, value in series:
+                    lines.append(f"{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+
+# Registry shared by the headend modules
+REGISTRY = Registry()
+
+
+async def handle_metrics_request(reader, writer, registry=REGISTRY):
+    """Minimal HTTP/1.0 handler: GET /metrics returns the registry, anything else 404."""
+    try:
+        request_line = await reader.readline()
+        # Skip the headers
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            # Collectors may block (e.g. a round trip to the capture workers), keep them off the event loop
+            body = (await asyncio.get_running_loop().run_in_executor(None, registry.render)).encode()
+            status = '200 OK'
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            body = b'Not Found\n'
+            status = '404 Not Found'
+            content_type = 'text/plain'
+        writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except Exception as e:
+        logger.warning("Error serving /metrics: %s", e)
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(host, port, registry=REGISTRY):
+    """Serve /metrics on the running event loop. Returns the asyncio server."""
+    server = await asyncio.start_server(lambda r, w: handle_metrics_request(r, w, registry), host, port)
+    logger.info("Serving metrics on http://%s:%s/metrics", host, port)
+    return server
@@ -1,5 +1,8 @@
 # main.py
 
+import dataclasses
+import json
+import logging
 import threading
 import time
 from datetime import datetime
@@ -7,55 +10,95 @@ import sqlite3
 import asyncio
 import websockets
 
-from multiprocessing import Manager
-
 from active_monitoring import ActiveMonitoring
 from passive_monitoring import PassiveMonitoring
 from adaptive_data_access import AdaptiveDataAccess
-
-def load_field_devices():
-    conn = sqlite3.connect('field_devices.db')
+from classifier import DEFAULT_THRESHOLDS, ConnectionClassifier, Thresholds
+from clock import get_clock
+from config import load_config
+from device_registry import DeviceRegistry
+from device_store import DeviceStore
+from focus_jobs import FocusJob
+from instrumentation import REGISTRY, start_metrics_server
+from metrics_history import MetricsHistory
+from persistence import StateWriter, restore_state
+from sharding import ShardMember
+from structured_logging import setup_logging
+from ws_pool import all_pool_metrics, configure_pool
+
+logger = logging.getLogger(__name__)
+
+def load_field_devices(shared=False, db_path='field_devices.db'):
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     cursor.execute('SELECT FD_ID, IP, Region, Port, Last_Data_Received FROM field_devices')
     rows = cursor.fetchall()
     conn.close()
 
-    manager = Manager()
-    field_devices = manager.dict()
-    fd_locks = {}
-
-    for fd_id, ip_address, region, port, last_data_received in rows:
-        fd_id = str(fd_id)  # Ensure FD_ID is a string
-        field_devices[fd_id] = manager.dict({
-            'ip_address': ip_address,
-            'port': port,
-            'region': region,
-            'last_data_received': last_data_received,  # This can be None
-            'active_metrics': manager.dict(),
-            'passive_metrics': manager.dict(),  # Placeholder for now
-        })
-        fd_locks[fd_id] = threading.Lock()
-
-    #print(f"{field_devices}\n \n \n {field_devices.items}")
+    # Columnar device table. Set shared=True when workers run as separate processes.
+    field_devices = DeviceStore.from_rows(rows, shared=shared)
+    # Striped writer locks of the store, indexable per FD like the old per-FD lock dict
+    fd_locks = field_devices.locks
 
     return field_devices, fd_locks
 
-def backend_listener(adaptive_data_access, server_ip, backend_listen_port):
+def store_metrics(field_devices):
+    """REGISTRY collector for the device store's lock wait times."""
+    def collect():
+        stats = field_devices.locks.wait_stats()
+        return [
+            ('headend_store_lock_acquisitions_total', 'counter', 'Device store writer lock acquisitions', [({}, stats['acquisitions'])]),
+            ('headend_store_lock_wait_seconds_total', 'counter', 'Time writers waited for device store locks', [({}, stats['wait_total_s'])]),
+            ('headend_store_lock_wait_max_seconds', 'gauge', 'Longest wait for a device store lock', [({}, stats['wait_max_s'])]),
+        ]
+    return collect
+
+def pool_metrics():
+    """REGISTRY collector for the WebSocket connection pools."""
+    return [(f'headend_ws_pool_{name}', 'gauge', f'WebSocket pool {name}', [({}, value)])
+            for name, value in all_pool_metrics().items()]
+
+def backend_listener(adaptive_data_access, server_ip, backend_listen_port, metrics_port=None):
     async def handler(websocket):
+        loop = asyncio.get_running_loop()
+
+        def reply(message):
+            # Called from the ADA loop thread; send on this connection's loop
+            asyncio.run_coroutine_threadsafe(websocket.send(json.dumps(message)), loop)
+
         async for message in websocket:
             message = message.strip()
             if message.lower() == 'stop':
-                print("Received 'stop' command from backend.\n")
+                logger.info("Received 'stop' command from backend.")
                 adaptive_data_access.stop_backend_focus()
+            elif message.startswith('{'):
+                # Focus job, e.g. {"job_id": "a", "fd_ids": [1, 2], "priority": 20, "sample_rate": 2, "deadline": 0.5, "duration": 60}
+                # or {"cancel": "a"}
+                try:
+                    request = json.loads(message)
+                    if 'cancel' in request:
+                        if not adaptive_data_access.cancel_focus_job(str(request['cancel'])):
+                            reply({'type': 'error', 'job_id': request['cancel'], 'error': 'unknown job'})
+                        continue
+                    job = FocusJob.from_request(request, reply)
+                except (ValueError, KeyError, TypeError) as e:
+                    logger.warning("Invalid backend request %r: %s", message, e)
+                    await websocket.send(json.dumps({'type': 'error', 'error': str(e)}))
+                    continue
+                logger.info("Received backend focus job %s for FDs: %s", job.job_id, job.fd_ids)
+                adaptive_data_access.submit_focus_job(job)
             else:
                 # Process the backend request
                 # Assuming the message is a comma-separated list of FD IDs, e.g., "1,2,3"
                 requested_fd_ids = message.split(',')
                 requested_fd_ids = [fd_id.strip() for fd_id in requested_fd_ids]
-                print(f"Received backend request to focus on FDs: {requested_fd_ids}\n")
-                adaptive_data_access.focus_on_fds(requested_fd_ids)
+                logger.info("Received backend request to focus on FDs: %s", requested_fd_ids)
+                adaptive_data_access.focus_on_fds(requested_fd_ids, reply)
 
     async def server():
+        # /metrics is served from the same event loop
+        if metrics_port is not None:
+            await start_metrics_server(server_ip, metrics_port)
         async with websockets.serve(handler, server_ip, backend_listen_port):
             await asyncio.Future()  # Run forever
 
@@ -63,40 +106,135 @@ def backend_listener(adaptive_data_access, server_ip, backend_listen_port):
     asyncio.set_event_loop(loop)
     loop.run_until_complete(server())
 
-def main():
+def main(argv=None):
+    # Settings from the defaults, a config file, HEADEND_* environment variables and the command line (see config.py)
+    config = load_config(argv)
+
+    # JSON logs written by a background thread; per-FD lines are rate limited per message type
+    log_listener = setup_logging(level=getattr(logging, config.logging.level.upper()), json_output=config.logging.json_output,
+                                 default_limit=(20, 100), limits={'probe_result': (50, 200), 'fetch_result': (50, 200)})
+
     # Server Information
-    server_ip = '192.168.1.3'
-    passive_server_port = '8765'
-    backend_listen_port = '8000'
+    server_ip = config.server.host
+    passive_server_port = config.server.passive_port
+    backend_listen_port = config.server.backend_port
+    metrics_port = config.server.metrics_port  # Prometheus /metrics
+    db_path = config.database.path
 
-    # Load field devices from SQLite database
-    field_devices, fd_locks = load_field_devices()
+    # Pooled WebSocket connections to the FDs (one pool per event loop)
+    configure_pool(**dataclasses.asdict(config.pool))
 
-    # Initialize the Passive Monitoring module (placeholder)
-    passive_monitor = PassiveMonitoring(field_devices=field_devices, fd_locks=fd_locks, host=server_ip, port=passive_server_port, interface="Wi-Fi")
+    # Load field devices from SQLite database
+    field_devices, fd_locks = load_field_devices(db_path=db_path)
+
+    # Warm start from the last persisted state, so a restart does not refetch every FD at once
+    restored = restore_state(field_devices, db_path)
+    logger.info("Restored state for %d field devices", restored)
+    state_writer = StateWriter(field_devices, db_path, flush_interval=config.database.state_flush_interval)
+    state_writer.start()
+
+    # Bounded per-FD history of active and passive samples, flushed to the database
+    metrics_history = MetricsHistory(capacity=config.database.history_capacity, db_path=db_path,
+                                     flush_interval=config.database.history_flush_interval)
+    metrics_history.start()
+
+    # Shared NTP corrected clock, refreshed in the background (can point at a local NTP server)
+    clock = get_clock(server=config.clock.ntp_server, refresh_interval=config.clock.refresh_interval)
+
+    # Status classification on EWMA-smoothed metrics with hysteresis, shared by active and passive monitoring
+    # Region thresholds, e.g. {"A1": [300, 2, 300, 800, 8, 50]} for a region on a slow backhaul
+    region_thresholds = {region: Thresholds(*values) for region, values in config.classifier.region_thresholds.items()}
+    thresholds = Thresholds(*config.classifier.thresholds) if config.classifier.thresholds else DEFAULT_THRESHOLDS
+    classifier = ConnectionClassifier(field_devices, alpha=config.classifier.alpha, hysteresis=config.classifier.hysteresis,
+                                      thresholds=thresholds, region_thresholds=region_thresholds)
+
+    # Initialize the Passive Monitoring module
+    passive = config.passive
+    passive_monitor = PassiveMonitoring(field_devices=field_devices, fd_locks=fd_locks, host=server_ip, port=passive_server_port,
+                                        interface=passive.interface, history=metrics_history, capture_backend=passive.capture_backend,
+                                        pcap_path=passive.pcap_path, connection_ttl=passive.connection_ttl,
+                                        max_connections=passive.max_connections, clock=clock, capture_workers=passive.capture_workers,
+                                        update_interval=passive.update_interval, update_batch_size=passive.update_batch_size,
+                                        classifier=classifier)
+    # A shard owns no FDs until the coordinator assigns them, so no two shards probe the same FD
+    sharded = config.shard.shard_id is not None
+    if sharded:
+        passive_monitor.set_owned([])
     passive_monitor.start()
 
+    # Internals exposed on /metrics next to the counters the modules keep themselves
+    REGISTRY.add_collector(store_metrics(field_devices))
+    REGISTRY.add_collector(pool_metrics)
+    REGISTRY.add_collector(passive_monitor.collect_metrics)
+
     # Initialize the Adaptive Data Access module
-    adaptive_data_access = AdaptiveDataAccess(field_devices, fd_locks)
+    # Region rate limits, e.g. {"A1": [20, 40]} for 20 fetches/s with bursts of 40 on a constrained backhaul
+    ada = config.ada
+    adaptive_data_access = AdaptiveDataAccess(field_devices, fd_locks, max_concurrent_fetches=ada.max_concurrent_fetches,
+                                              region_rate_limits={region: tuple(rate) for region, rate in ada.region_rate_limits.items()},
+                                              default_region_rate=tuple(ada.default_region_rate) if ada.default_region_rate else None,
+                                              passive_max_age=ada.passive_max_age, scoring=ada.scoring,
+                                              ada_wait_time=ada.wait_time, idle_wait=ada.idle_wait)
+    if sharded:
+        adaptive_data_access.set_owned([])
     adaptive_data_access_thread = threading.Thread(target=adaptive_data_access.run, daemon=True)
     adaptive_data_access_thread.start()
 
     # Start the backend listener in a separate thread
-    backend_listener_thread = threading.Thread(target=backend_listener, args=(adaptive_data_access, server_ip, backend_listen_port,), daemon=True)
+    backend_listener_thread = threading.Thread(target=backend_listener, args=(adaptive_data_access, server_ip, backend_listen_port, metrics_port), daemon=True)
     backend_listener_thread.start()
 
-    # Initialize and start Active Monitoring
-    num_active_threads = 5  # Adjust as needed
-    active_monitor = ActiveMonitoring(field_devices, fd_locks, num_active_threads)
+    # Initialize and start Active Monitoring ('threads' engine: active.threads threads, 'asyncio': active.max_concurrency probes)
+    active = config.active
+    active_monitor = ActiveMonitoring(field_devices, fd_locks, active.threads, engine=active.engine, max_concurrency=active.max_concurrency,
+                                      ping_workers=active.ping_workers, icmp_backend=active.icmp_backend, history=metrics_history,
+                                      classifier=classifier, time_monitoring_cycle=active.cycle_interval, fd_interval=active.fd_interval,
+                                      ping_count=active.ping_count, ping_timeout=active.ping_timeout,
+                                      throughput_probe_bytes=active.throughput_probe_bytes)
+    if sharded:
+        active_monitor.set_fd_ids([])
     active_monitor.start()
 
+    # Sharded deployment: register with the coordinator and monitor only the FDs it assigns to this shard
+    shard_member = None
+    if sharded:
+        def on_assignment(fd_ids):
+            active_monitor.set_fd_ids(fd_ids)
+            passive_monitor.set_owned(fd_ids)
+            adaptive_data_access.set_owned(fd_ids)
+
+        shard = config.shard
+        shard_member = ShardMember(shard.shard_id, shard.coordinator_url,
+                                   shard.advertise_url or f"ws://{server_ip}:{backend_listen_port}",
+                                   field_devices, on_assignment, reconnect_interval=shard.reconnect_interval)
+        shard_member.start()
+
+    # Pick up FDs added to or removed from the database without a restart (see device_registry.py)
+    def on_devices_changed(added, updated, removed):
+        if (added or removed) and not sharded:
+            active_monitor.set_fd_ids(field_devices.keys())  # A shard's FDs come from its ShardMember
+        if removed:
+            metrics_history.forget(removed)
+
+    registry = None
+    if config.database.registry_poll_interval:
+        field_devices.add_device_listener(on_devices_changed)
+        registry = DeviceRegistry(field_devices, db_path, poll_interval=config.database.registry_poll_interval).start()
 
     # Keep the main thread alive
     try:
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
-        print("Shutting down...")
+        logger.info("Shutting down...")
+        if registry is not None:
+            registry.stop()
+        if shard_member is not None:
+            shard_member.stop()
+        metrics_history.stop()
+        state_writer.stop()
+        clock.stop()
+        log_listener.stop()
 
 if __name__ == '__main__':
     main()
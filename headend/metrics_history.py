@@ -0,0 +1,204 @@
+# metrics_history.py
+
+import array
+import logging
+import math
+import threading
+import time
+
+from persistence import connect
+
+logger = logging.getLogger(__name__)
+
+# Metrics kept per kind of monitoring
+SERIES_FIELDS = {
+    'active': ('latency', 'packet_loss', 'throughput'),
+    'passive': ('latency', 'throughput'),
+}
+
+NAN = float('nan')
+
+
+class MetricRing:
+    """Fixed-capacity ring buffer of (timestamp, metric values) samples for one FD and kind."""
+
+    __slots__ = ('fields', 'capacity', 'timestamps', 'values', 'written', 'flushed')
+
+    def __init__(self, fields, capacity):
+        self.fields = fields
+        self.capacity = capacity
+        self.timestamps = array.array('d', [NAN]) * capacity
+        self.values = {field: array.array('d', [NAN]) * capacity for field in fields}
+        self.written = 0  # Total samples ever appended
+        self.flushed = 0  # Samples already written to SQLite
+
+    def append(self, timestamp, values):
+        slot = self.written % self.capacity
+        self.timestamps[slot] = timestamp
+        for field in self.fields:
+            value = values.get(field)
+            self.values[field][slot] = NAN if value is None else value
+        self.written += 1
+
+    def slots(self, since=None):
+        """Ring slots holding samples (oldest first), optionally only those at or after `since`."""
+        count = min(self.written, self.capacity)
+        first = self.written - count
+        slots = [(first + i) % self.capacity for i in range(count)]
+        if since is not None:
+            slots = [slot for slot in slots if self.timestamps[slot] >= since]
+        return slots
+
+    def window(self, field, since=None):
+        column = self.values[field]
+        return [column[slot] for slot in self.slots(since) if not math.isnan(column[slot])]
+
+    def unflushed(self):
+        """Samples not yet flushed. Samples overwritten before a flush are lost."""
+        pending = min(self.written - self.flushed, self.capacity)
+        first = self.written - pending
+        return [(first + i) % self.capacity for i in range(pending)]
+
+
+def percentile(values, q):
+    """Linear-interpolated percentile (q in 0-100) of the values, or None if there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    if lower == upper:
+        return ordered[lower]
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class MetricsHistory:
+    """
+    Bounded time-series history of active and passive metrics per FD.
+
+    Each FD gets one array-backed ring buffer per kind ('active', 'passive') on its first
+    sample, so memory is capped at capacity samples per FD. A background thread bulk-flushes
+    new samples to the metrics_history table every flush_interval seconds.
+    """
+
+    def __init__(self, capacity=60, db_path='field_devices.db', flush_interval=30):
+        self.capacity = capacity
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.rings = {}  # (fd_id, kind) -> MetricRing
+        self.forgotten = set()  # FDs whose rings are dropped once their last samples are flushed
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.flush_thread = None
+        self.dropped = 0  # Samples overwritten before they could be flushed
+
+    def record(self, fd_id, kind, timestamp=None, **values):
+        """Append a sample, e.g. record('7', 'active', latency=12.5, packet_loss=0.0, throughput=900.0)."""
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            ring = self.rings.get((fd_id, kind))
+            if ring is None:
+                ring = self.rings[(fd_id, kind)] = MetricRing(SERIES_FIELDS[kind], self.capacity)
+            if ring.written - ring.flushed >= self.capacity:
+                self.dropped += 1
+            ring.append(timestamp, values)
+
+    def window(self, fd_id, kind, metric, seconds=None, now=None):
+        """Values of one metric in the last `seconds` (all kept samples if None), oldest first."""
+        since = None if seconds is None else (time.time() if now is None else now) - seconds
+        with self.lock:
+            ring = self.rings.get((fd_id, kind))
+            return ring.window(metric, since) if ring else []
+
+    def percentile(self, fd_id, kind, metric, q, seconds=None):
+        return percentile(self.window(fd_id, kind, metric, seconds), q)
+
+    def percentiles(self, fd_id, kind, metric, qs=(50, 95, 99), seconds=None):
+        values = self.window(fd_id, kind, metric, seconds)
+        return {q: percentile(values, q) for q in qs}
+
+    def create_table(self, conn):
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS metrics_history (
+                FD_ID TEXT NOT NULL,
+                Kind TEXT NOT NULL,
+                Timestamp REAL NOT NULL,
+                Latency REAL,
+                Packet_Loss REAL,
+                Throughput REAL
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS metrics_history_fd_time ON metrics_history (FD_ID, Timestamp)')
+
+    def collect_unflushed(self):
+        """
+        Rows for all samples not yet flushed, plus the (ring, written) marks and the forgotten
+        FDs to hand to mark_flushed() once the rows are committed.
+        """
+        rows = []
+        marks = []
+        with self.lock:
+            for (fd_id, kind), ring in self.rings.items():
+                slots = ring.unflushed()
+                for slot in slots:
+                    values = {field: ring.values[field][slot] for field in ring.fields}
+                    rows.append((
+                        fd_id, kind, ring.timestamps[slot],
+                        *(None if math.isnan(values.get(field, NAN)) else values[field]
+                          for field in ('latency', 'packet_loss', 'throughput')),
+                    ))
+                if slots:
+                    marks.append((ring, ring.written))
+            forgotten = set(self.forgotten)
+        return rows, marks, forgotten
+
+    def mark_flushed(self, marks, forgotten):
+        """Advance the rings past the committed samples and drop the rings of forgotten FDs."""
+        with self.lock:
+            for ring, written in marks:
+                ring.flushed = max(ring.flushed, written)
+            if forgotten:
+                for key in [key for key in self.rings if key[0] in forgotten]:
+                    del self.rings[key]
+                self.forgotten -= forgotten
+
+    def forget(self, fd_ids):
+        """Drop the rings of removed FDs after the next flush."""
+        with self.lock:
+            self.forgotten.update(fd_ids)
+
+    def flush(self):
+        """Write all new samples to SQLite in one transaction. Returns the number of rows written."""
+        rows, marks, forgotten = self.collect_unflushed()
+        if rows:
+            conn = connect(self.db_path)
+            try:
+                with conn:
+                    self.create_table(conn)
+                    conn.executemany(
+                        'INSERT INTO metrics_history (FD_ID, Kind, Timestamp, Latency, Packet_Loss, Throughput) VALUES (?, ?, ?, ?, ?, ?)',
+                        rows,
+                    )
+            finally:
+                conn.close()
+        # Only once committed: if the write failed, the samples are collected again next time
+        self.mark_flushed(marks, forgotten)
+        return len(rows)
+
+    def run_flusher(self):
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("Failed to flush metrics history: %s", e)
+
+    def start(self):
+        self.flush_thread = threading.Thread(target=self.run_flusher, daemon=True)
+        self.flush_thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.flush_thread:
+            self.flush_thread.join()
+        self.flush()
@@ -0,0 +1,173 @@
+# packet_accumulator.py
+
+import threading
+from collections import OrderedDict
+
+from streaming_stats import LogHistogram, RunningStats
+
+
+SEQ_MODULO = 1 << 32
+
+
+class ConnectionStats:
+    """
+    Streaming stats of the packets seen on one connection, updated in O(1) per packet:
+    totals, packet size mean/variance, inter-arrival time mean/variance/percentiles,
+    RFC 3550 style jitter and TCP retransmissions (data segments that don't advance the
+    highest sequence number seen). Nothing per packet is stored.
+    """
+
+    __slots__ = ('packet_count', 'total_bytes', 'first_ns', 'last_ns', 'sizes', 'inter_arrival',
+                 'inter_arrival_us', 'jitter_us', 'last_gap_us', 'next_seq', 'retransmissions')
+
+    def __init__(self):
+        self.packet_count = 0
+        self.total_bytes = 0
+        self.first_ns = 0
+        self.last_ns = 0
+        self.sizes = RunningStats()
+        self.inter_arrival = RunningStats()  # Microseconds between packets
+        self.inter_arrival_us = LogHistogram()
+        self.jitter_us = 0.0
+        self.last_gap_us = None
+        self.next_seq = None  # Sequence number after the highest data byte seen
+        self.retransmissions = 0
+
+    def add(self, ts_ns, size, seq=None, payload_len=0):
+        if self.packet_count:
+            gap_us = (ts_ns - self.last_ns) / 1000
+            self.inter_arrival.add(gap_us)
+            self.inter_arrival_us.add(gap_us)
+            if self.last_gap_us is not None:
+                # J += (|D| - J) / 16, with D the change in inter-arrival time
+                self.jitter_us += (abs(gap_us - self.last_gap_us) - self.jitter_us) / 16
+            self.last_gap_us = gap_us
+        else:
+            self.first_ns = ts_ns
+        self.packet_count += 1
+        self.total_bytes += size
+        self.sizes.add(size)
+        if ts_ns > self.last_ns:
+            self.last_ns = ts_ns
+
+        if seq is not None and payload_len > 0:
+            end = (seq + payload_len) % SEQ_MODULO
+            if self.next_seq is None:
+                self.next_seq = end
+            elif 0 < (end - self.next_seq) % SEQ_MODULO < SEQ_MODULO // 2:
+                self.next_seq = end  # New data (modulo sequence number wraparound)
+            else:
+                self.retransmissions += 1
+
+    def merge(self, other):
+        """Fold in the stats of the same connection collected elsewhere (e.g. another capture worker)."""
+        if not other.packet_count:
+            return
+        if not self.packet_count or other.first_ns < self.first_ns:
+            self.first_ns = other.first_ns
+        self.last_ns = max(self.last_ns, other.last_ns)
+        self.packet_count += other.packet_count
+        self.total_bytes += other.total_bytes
+        self.sizes.merge(other.sizes)
+        self.inter_arrival.merge(other.inter_arrival)
+        self.inter_arrival_us.merge(other.inter_arrival_us)
+        self.jitter_us = max(self.jitter_us, other.jitter_us)
+        self.retransmissions += other.retransmissions
+        if self.next_seq is None:
+            self.next_seq = other.next_seq
+
+    def summary(self):
+        """The derived metrics, readable at any time (milliseconds and bytes)."""
+        return {
+            "packet_count": self.packet_count,
+            "total_data_size": self.total_bytes,
+            "duration_s": (self.last_ns - self.first_ns) / 1_000_000_000,
+            "size_mean": self.sizes.mean,
+            "size_stddev": self.sizes.stddev,
+            "inter_arrival_mean_ms": self.inter_arrival.mean / 1000,
+            "inter_arrival_stddev_ms": self.inter_arrival.stddev / 1000,
+            "inter_arrival_p50_ms": _us_to_ms(self.inter_arrival_us.percentile(50)),
+            "inter_arrival_p95_ms": _us_to_ms(self.inter_arrival_us.percentile(95)),
+            "inter_arrival_p99_ms": _us_to_ms(self.inter_arrival_us.percentile(99)),
+            "jitter_ms": self.jitter_us / 1000,
+            "retransmissions": self.retransmissions,
+            "retransmission_rate": self.retransmissions / self.packet_count if self.packet_count else 0.0,
+        }
+
+
+def _us_to_ms(value):
+    return None if value is None else value / 1000
+
+
+class PacketAccumulator:
+    """
+    Bounded per-connection packet accumulator, keyed by (src_ip, src_port).
+
+    Connections are kept in least-recently-updated order, so connections that stopped
+    sending for longer than ttl seconds (of capture time) are evicted from the front in O(1),
+    and the oldest connection is dropped when max_connections is reached. Thread-safe.
+    """
+
+    def __init__(self, ttl=300, max_connections=100_000):
+        self.ttl_ns = int(ttl * 1_000_000_000)
+        self.max_connections = max_connections
+        self.connections = OrderedDict()
+        self.latest_ns = 0  # Newest capture timestamp seen, the clock used for the TTL
+        self.lock = threading.Lock()
+        self.evicted_expired = 0
+        self.evicted_full = 0
+        self.packets = 0  # Packets added, ever
+
+    def add(self, key, ts_ns, size, seq=None, payload_len=0):
+        with self.lock:
+            connections = self.connections
+            stats = connections.get(key)
+            if stats is None:
+                if len(connections) >= self.max_connections:
+                    connections.popitem(last=False)
+                    self.evicted_full += 1
+                stats = connections[key] = ConnectionStats()
+            else:
+                connections.move_to_end(key)
+            stats.add(ts_ns, size, seq, payload_len)
+            self.packets += 1
+
+            if ts_ns > self.latest_ns:
+                self.latest_ns = ts_ns
+            self._evict_expired()
+
+    def pop(self, key):
+        """Remove and return the stats of a connection (None if nothing was captured)."""
+        with self.lock:
+            return self.connections.pop(key, None)
+
+    def get(self, key):
+        with self.lock:
+            return self.connections.get(key)
+
+    def summary(self, key):
+        """Current metrics of a connection while it is still capturing (None if unknown)."""
+        with self.lock:
+            stats = self.connections.get(key)
+            return stats.summary() if stats is not None else None
+
+    def evict_expired(self):
+        with self.lock:
+            self._evict_expired()
+
+    def _evict_expired(self):
+        # Only the front can be expired, so this is O(1) unless something is evicted
+        connections = self.connections
+        cutoff = self.latest_ns - self.ttl_ns
+        while connections:
+            key, stats = next(iter(connections.items()))
+            if stats.last_ns >= cutoff:
+                break
+            del connections[key]
+            self.evicted_expired += 1
+
+    def __len__(self):
+        return len(self.connections)
+
+    def __contains__(self, key):
+        return key in self.connections
@@ -0,0 +1,285 @@
+# packet_capture.py
+
+import ctypes
+import mmap
+import select
+import socket
+import struct
+from collections import deque, namedtuple
+
+# Compact per-packet record: only the IP/TCP header fields passive monitoring needs.
+# ts_ns is the capture timestamp (ns since the epoch, from the kernel when available),
+# size is the frame length on the wire and payload_len the TCP payload length.
+PacketRecord = namedtuple('PacketRecord', (
+    'ts_ns', 'src_ip', 'src_port', 'dst_ip', 'dst_port', 'seq', 'payload_len', 'size', 'flags',
+))
+
+ETH_P_ALL = 0x0003
+ETH_P_IP = 0x0800
+ETH_P_8021Q = 0x8100
+
+# Link-layer types (pcap DLT values)
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_LINUX_SLL2 = 276
+
+IPV4_HEADER = struct.Struct('!BBHHHBBH4s4s')
+TCP_HEADER = struct.Struct('!HHIIBB')  # ports, seq, ack, data offset, flags
+
+
+def parse_ipv4_tcp(buf, offset, size, ts_ns, port=None):
+    """Parse the IPv4 and TCP headers starting at buf[offset]. Returns a PacketRecord or None."""
+    if len(buf) - offset < IPV4_HEADER.size:
+        return None
+    version_ihl, _, total_length, _, fragment, _, protocol, _, src, dst = IPV4_HEADER.unpack_from(buf, offset)
+    if version_ihl >> 4 != 4 or protocol != 6 or fragment & 0x1fff:
+        return None
+    ip_header_length = (version_ihl & 0x0f) * 4
+    tcp_offset = offset + ip_header_length
+    if len(buf) - tcp_offset < TCP_HEADER.size:
+        return None
+    src_port, dst_port, seq, _, data_offset, flags = TCP_HEADER.unpack_from(buf, tcp_offset)
+    if port is not None and src_port != port and dst_port != port:
+        return None
+    payload_len = total_length - ip_header_length - (data_offset >> 4) * 4
+    return PacketRecord(
+        ts_ns, socket.inet_ntoa(src), src_port, socket.inet_ntoa(dst), dst_port, seq, max(payload_len, 0), size, flags,
+    )
+
+
+def network_offset(buf, offset, linktype):
+    """Offset of the IPv4 header in a captured frame, or None if it is not IPv4 (or cut short)."""
+    try:
+        return _network_offset(buf, offset, linktype)
+    except struct.error:
+        return None  # Frame shorter than its link-layer header
+
+
+def _network_offset(buf, offset, linktype):
+    if linktype == LINKTYPE_ETHERNET:
+        ethertype = struct.unpack_from('!H', buf, offset + 12)[0]
+        offset += 14
+        while ethertype == ETH_P_8021Q:
+            ethertype = struct.unpack_from('!H', buf, offset + 2)[0]
+            offset += 4
+        return offset if ethertype == ETH_P_IP else None
+    if linktype == LINKTYPE_LINUX_SLL:
+        return offset + 16 if struct.unpack_from('!H', buf, offset + 14)[0] == ETH_P_IP else None
+    if linktype == LINKTYPE_LINUX_SLL2:
+        return offset + 20 if struct.unpack_from('!H', buf, offset)[0] == ETH_P_IP else None
+    if linktype == LINKTYPE_RAW:
+        return offset
+    return None
+
+
+def tcp_port_filter(port, snaplen=256):
+    """
+    Classic BPF program for 'ip and tcp port <port>' on Ethernet frames (what tcpdump -dd
+    emits). Packets are truncated to snaplen bytes, which is enough for the headers.
+    """
+    return [
+        (0x28, 0, 0, 12),          # ldh [12]               ethertype
+        (0x15, 0, 10, ETH_P_IP),   # jeq #0x800             else drop
+        (0x30, 0, 0, 23),          # ldb [23]               IP protocol
+        (0x15, 0, 8, 6),           # jeq #6 (TCP)           else drop
+        (0x28, 0, 0, 20),          # ldh [20]               fragment offset
+        (0x45, 6, 0, 0x1fff),      # jset #0x1fff           fragments: drop
+        (0xb1, 0, 0, 14),          # ldxb 4*([14]&0xf)      X = IP header length
+        (0x48, 0, 0, 14),          # ldh [x + 14]           source port
+        (0x15, 2, 0, port),        # jeq #port              accept
+        (0x48, 0, 0, 16),          # ldh [x + 16]           destination port
+        (0x15, 0, 1, port),        # jeq #port              else drop
+        (0x06, 0, 0, snaplen),     # ret #snaplen           accept
+        (0x06, 0, 0, 0),           # ret #0                 drop
+    ]
+
+
+class PcapFileCapture:
+    """Replays a classic pcap file (e.g. relay-box/test/*.pcap) as PacketRecords."""
+
+    def __init__(self, path, port=None):
+        self.path = path
+        self.port = port
+
+    def records(self, stop_event=None):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+
+        magic = data[:4]
+        if len(data) < 24:
+            raise ValueError(f"{self.path} is not a pcap file")
+        if magic in (b'\xd4\xc3\xb2\xa1', b'\x4d\x3c\xb2\xa1'):
+            endian = '<'
+        elif magic in (b'\xa1\xb2\xc3\xd4', b'\xa1\xb2\x3c\x4d'):
+            endian = '>'
+        else:
+            raise ValueError(f"{self.path} is not a pcap file")
+        frac_to_ns = 1 if magic in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d') else 1000
+        linktype = struct.unpack_from(endian + 'I', data, 20)[0]
+        record_header = struct.Struct(endian + 'IIII')
+
+        view = memoryview(data)
+        offset = 24
+        end = len(data)
+        while offset + record_header.size <= end:
+            if stop_event is not None and stop_event.is_set():
+                return
+            ts_sec, ts_frac, captured_length, original_length = record_header.unpack_from(data, offset)
+            offset += record_header.size
+            if offset + captured_length > end:
+                return  # Truncated file, e.g. still being written
+            # Parsed within its own bytes, a packet cut short by the snap length never reads the next record
+            frame = view[offset:offset + captured_length]
+            net = network_offset(frame, 0, linktype)
+            if net is not None:
+                record = parse_ipv4_tcp(frame, net, original_length, ts_sec * 1_000_000_000 + ts_frac * frac_to_ns, self.port)
+                if record is not None:
+                    yield record
+            offset += captured_length
+
+    def close(self):
+        pass
+
+
+class AfPacketRingCapture:
+    """
+    Linux AF_PACKET capture through a TPACKET_V3 memory-mapped ring.
+
+    The kernel filters packets with a BPF program (tcp port), truncates them to the headers
+    and fills whole blocks of the ring, so user space wakes up once per block instead of once
+    per packet. Timestamps come from the kernel. Needs root or CAP_NET_RAW.
+    """
+
+    SOL_PACKET = 263
+    PACKET_RX_RING = 5
+    PACKET_VERSION = 10
+    PACKET_FANOUT = 18
+    TPACKET_V3 = 2
+    SO_ATTACH_FILTER = 26
+    TP_STATUS_KERNEL = 0
+    TP_STATUS_USER = 1
+
+    BLOCK_HEADER = struct.Struct('=III')  # block_status, num_pkts, offset_to_first_pkt (at offset 8)
+    PACKET_HEADER = struct.Struct('=IIIIIIHH')  # next_offset, sec, nsec, snaplen, len, status, mac, net
+
+    def __init__(self, interface, port=None, block_size=1 << 20, block_count=64, frame_size=2048,
+                 block_timeout_ms=100, fanout_group=None, fanout_mode=0):
+        self.interface = interface
+        self.port = port
+        self.block_size = block_size
+        self.block_count = block_count
+        self.frame_size = frame_size
+        self.block_timeout_ms = block_timeout_ms
+        self.fanout_group = fanout_group
+        self.fanout_mode = fanout_mode  # 0 = PACKET_FANOUT_HASH (flow hash)
+        self.sock = None
+        self.ring = None
+        self._filter = None
+
+    def open(self):
+        sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(ETH_P_ALL))
+        sock.setsockopt(self.SOL_PACKET, self.PACKET_VERSION, self.TPACKET_V3)
+        if self.port is not None:
+            self._attach_filter(sock, tcp_port_filter(self.port))
+
+        frame_count = self.block_size * self.block_count // self.frame_size
+        request = struct.pack('=IIIIIII', self.block_size, self.block_count, self.frame_size, frame_count,
+                              self.block_timeout_ms, 0, 0)
+        sock.setsockopt(self.SOL_PACKET, self.PACKET_RX_RING, request)
+        sock.bind((self.interface, 0))
+        if self.fanout_group is not None:
+            # Share the packets of this interface with the other sockets of the group
+            sock.setsockopt(self.SOL_PACKET, self.PACKET_FANOUT, self.fanout_group | (self.fanout_mode << 16))
+
+        self.ring = mmap.mmap(sock.fileno(), self.block_size * self.block_count,
+                              mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+        self.sock = sock
+
+    def _attach_filter(self, sock, program):
+        instructions = b''.join(struct.pack('=HBBI', *instruction) for instruction in program)
+        self._filter = ctypes.create_string_buffer(instructions)  # Must outlive the setsockopt call
+        fprog = struct.pack('HP', len(program), ctypes.addressof(self._filter))
+        sock.setsockopt(socket.SOL_SOCKET, self.SO_ATTACH_FILTER, fprog)
+
+    def records(self, stop_event=None):
+        if self.sock is None:
+            self.open()
+        ring = self.ring
+        poller = select.poll()
+        poller.register(self.sock.fileno(), select.POLLIN | select.POLLERR)
+        block_index = 0
+
+        while stop_event is None or not stop_event.is_set():
+            block = block_index * self.block_size
+            status, packet_count, first_packet = self.BLOCK_HEADER.unpack_from(ring, block + 8)
+            if not status & self.TP_STATUS_USER:
+                poller.poll(self.block_timeout_ms)
+                continue
+
+            packet = block + first_packet
+            for _ in range(packet_count):
+                next_offset, sec, nsec, _, length, _, mac, net = self.PACKET_HEADER.unpack_from(ring, packet)
+                record = parse_ipv4_tcp(ring, packet + net, length, sec * 1_000_000_000 + nsec, self.port)
+                if record is not None:
+                    yield record
+                packet += next_offset
+
+            # Hand the block back to the kernel
+            struct.pack_into('=I', ring, block + 8, self.TP_STATUS_KERNEL)
+            block_index = (block_index + 1) % self.block_count
+
+    def close(self):
+        if self.ring is not None:
+            self.ring.close()
+            self.ring = None
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+
+class ScapyCapture:
+    """The original scapy sniff() capture, converted to PacketRecords."""
+
+    def __init__(self, interface, port=None):
+        self.interface = interface
+        self.port = port
+
+    def records(self, stop_event=None):
+        from scapy.all import sniff  # Only needed for this backend
+
+        records = deque()
+
+        def collect(packet):
+            if packet.haslayer("IP") and packet.haslayer("TCP"):
+                ip = packet["IP"]
+                tcp = packet["TCP"]
+                records.append(PacketRecord(
+                    int(float(packet.time) * 1_000_000_000), ip.src, tcp.sport, ip.dst, tcp.dport,
+                    tcp.seq, len(tcp.payload), len(packet), int(tcp.flags),
+                ))
+
+        while stop_event is None or not stop_event.is_set():
+            sniff(
+                iface=self.interface,
+                filter=f"tcp port {self.port}" if self.port is not None else None,
+                prn=collect,
+                store=False,
+                timeout=1,
+            )
+            while records:
+                yield records.popleft()
+
+    def close(self):
+        pass
+
+
+def open_capture(backend, interface=None, port=None, pcap_path=None, **options):
+    """Create the capture backend: 'scapy', 'afpacket' or 'pcap' (replay of pcap_path)."""
+    if backend == 'afpacket':
+        return AfPacketRingCapture(interface, port, **options)
+    if backend == 'pcap':
+        return PcapFileCapture(pcap_path, port)
+    if backend == 'scapy':
+        return ScapyCapture(interface, port)
+    raise ValueError(f"Unknown capture backend '{backend}'")
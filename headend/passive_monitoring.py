@@ -1,15 +1,26 @@
 import asyncio
+import logging
 import websockets
-from scapy.all import sniff
-from datetime import datetime, timedelta
+from datetime import datetime
 import threading
-import json
-import ntplib
 import time  # Added to keep the main thread alive if needed
 
+from clock import get_clock
+from instrumentation import REGISTRY
+from packet_accumulator import PacketAccumulator
+from packet_capture import open_capture
+from sharded_capture import ShardedCapture
+from upload_codec import decode_upload
+
+logger = logging.getLogger(__name__)
+
+PASSIVE_UPLOADS = REGISTRY.counter('headend_passive_uploads_total', 'Bulk uploads processed', ('result',))
+
 
 class PassiveMonitoring:
-    def __init__(self, field_devices=None, fd_locks=None, host="192.168.1.3", port=8765, interface="Wi-Fi"):
+    def __init__(self, field_devices=None, fd_locks=None, host="192.168.1.3", port=8765, interface="Wi-Fi", history=None,
+                 capture_backend="scapy", pcap_path=None, connection_ttl=300, max_connections=100_000,
+                 clock=None, capture_workers=1, update_interval=0.05, update_batch_size=500, classifier=None):
         """
         Initialize Passive Network Monitoring.
         :param field_devices: Dictionary to store field device data.
@@ -17,101 +28,131 @@ class PassiveMonitoring:
         :param host: Host IP for the WebSocket server.
         :param port: Port for the WebSocket server.
         :param interface: Network interface for packet sniffing.
+        :param history: Optional MetricsHistory that keeps every passive sample.
+        :param capture_backend: 'scapy', 'afpacket' (TPACKET_V3 ring, Linux) or 'pcap' (replay pcap_path).
+        :param pcap_path: pcap file to replay with the 'pcap' backend.
+        :param connection_ttl: Seconds without packets after which a connection's stats are dropped.
+        :param max_connections: Hard cap on the number of connections tracked at once.
+        :param clock: ClockService for NTP corrected timestamps (the shared one by default).
+        :param capture_workers: Number of capture processes; >1 shards connections over them.
+        :param update_interval: Seconds between batched device store writes.
+        :param update_batch_size: Pending updates that trigger an immediate store write.
+        :param classifier: Optional ConnectionClassifier for the passive status (EWMA + hysteresis).
         """
         self.field_devices = field_devices if field_devices is not None else {}
         self.fd_locks = fd_locks if fd_locks is not None else {}
         self.host = host
         self.port = port
         self.interface = interface
-        self.packet_data = {}  # Store packet data per connection (keyed by (src_ip, src_port))
+        self.history = history
+        self.capture_backend = capture_backend
+        self.pcap_path = pcap_path
+        # Running packet stats per connection (keyed by (src_ip, src_port)), bounded by TTL and size.
+        # Sharded over worker processes when capture_workers > 1, with the same lookups.
+        if capture_workers > 1:
+            self.packet_data = ShardedCapture(capture_workers, capture_backend, interface=interface, port=int(port),
+                                              pcap_path=pcap_path, ttl=connection_ttl, max_connections=max_connections)
+        else:
+            self.packet_data = PacketAccumulator(ttl=connection_ttl, max_connections=max_connections)
+        self.pending_updates = []  # (fd_id, passive metrics), only touched on the server's event loop
+        self.update_interval = update_interval
+        self.update_batch_size = update_batch_size
+        self.classifier = classifier
+        self.owned_fd_ids = None  # Set of FDs whose uploads are recorded, None = all (see set_owned)
         self.capture_thread = None  # Will be the sniffer later. Can be used to restart etc
         self.server_thread = None  # Will be the server later. Can be used to restart etc
         self.shutdown_event = threading.Event()  # Event to signal shutdown
-        self.ntp_offset = self.get_ntp_offset()
+        # NTP offset is refreshed in the background, so startup never blocks on the network
+        self.clock = clock if clock is not None else get_clock()
 
-    def get_ntp_offset(self):
-        """
-        Fetch NTP time offset to synchronize timing.
-        """
-        try:
-            client = ntplib.NTPClient()
-            response = client.request("pool.ntp.org")
-            return response.offset
-        except Exception as e:
-            print(f"Failed to fetch NTP time: {e}")
-            return 0
+    @property
+    def ntp_offset(self):
+        return self.clock.offset
 
     def get_ntp_time(self):
         """
         Get current time synchronized with NTP (as a datetime object).
         """
-        return datetime.now() + timedelta(seconds=self.ntp_offset)
+        return self.clock.now()
 
     def start_packet_capture(self):
         """
-        Start packet sniffing to capture Layer 3 packets (IP/TCP).
+        Start packet capture of Layer 3 packets (IP/TCP) on the configured backend.
         """
+        if isinstance(self.packet_data, ShardedCapture):
+            # The worker processes capture; this thread only owns their lifetime
+            try:
+                self.packet_data.start()
+                self.shutdown_event.wait()
+            except Exception as e:
+                logger.exception("Error in sharded packet capture: %s", e)
+            finally:
+                self.packet_data.stop()
+                logger.info("Packet capture stopped.")
+            return
+
+        capture = None
         try:
-            sniff(
-                iface=self.interface,
-                filter=f"tcp port {self.port}",
-                prn=self.process_packet,
-                store=False,
-                stop_filter=lambda _: self.shutdown_event.is_set(),
-            )
+            capture = open_capture(self.capture_backend, interface=self.interface, port=int(self.port), pcap_path=self.pcap_path)
+            for record in capture.records(self.shutdown_event):
+                self.process_record(record)
         except Exception as e:
-            print(f"Error in packet sniffing: {e}")
+            logger.exception("Error in packet sniffing: %s", e)
         finally:
-            print("Packet capture stopped.")
+            if capture is not None:
+                capture.close()
+            logger.info("Packet capture stopped.")
 
-    def process_packet(self, packet):
+    def process_record(self, record):
         """
-        Process captured packets and store them for analysis.
+        Add a captured packet record to its connection's running stats.
         """
-        if packet.haslayer("IP") and packet.haslayer("TCP"):
-            src_ip = packet["IP"].src
-            src_port = packet["TCP"].sport
-            timestamp = self.get_ntp_time()  # Use NTP-synced time as datetime
-
-            # Unique key for the field device connection
-            key = (src_ip, src_port)
-
-            # Store packet details
-            packet_info = {
-                "timestamp": timestamp,
-                "size": len(packet),
-            }
+        # Unique key for the field device connection
+        self.packet_data.add((record.src_ip, record.src_port), record.ts_ns, record.size, record.seq, record.payload_len)
 
-            # Initialize packet storage for this connection if not present
-            if key not in self.packet_data:
-                self.packet_data[key] = []
+    def connection_metrics(self, src_ip, src_port):
+        """
+        Streaming metrics of a connection so far, without waiting for its bulk upload.
+        """
+        return self.packet_data.summary((src_ip, src_port))
 
-            self.packet_data[key].append(packet_info)
+    async def pop_stats(self, key):
+        """
+        Take the packet stats of a connection (clears them for the next upload).
+        """
+        if isinstance(self.packet_data, ShardedCapture):
+            # A round trip over every capture worker's pipe, run off the event loop so the
+            # other uploads are not held up by it
+            return await asyncio.get_running_loop().run_in_executor(None, self.packet_data.pop, key)
+        return self.packet_data.pop(key)
 
-    def analyze_packets(self, send_time, packets):
+    def analyze_packets(self, send_time, stats):
         """
-        Analyze captured packets to calculate metrics (latency and throughput).
+        Calculate metrics (latency, throughput, jitter, inter-arrival percentiles and
+        retransmissions) from a connection's running packet stats.
         """
-        packet_count = len(packets)
+        packet_count = stats.packet_count if stats is not None else 0
         if packet_count == 0:
-            print("No packets found for this connection.")
+            logger.debug("No packets found for this connection.")
             return {
                 "packet_count": 0,
                 "total_data_size": 0,
                 "total_time": 0,
                 "avg_latency_ms": 0,
                 "throughput_kbps": 0,
+                "last_active": self.get_ntp_time(),
             }
 
-        total_data_size = sum(p["size"] for p in packets)
-        t_last_packet = packets[-1]["timestamp"]
+        total_data_size = stats.total_bytes
+        # Capture timestamps are converted to (NTP corrected) wall-clock time only here
+        t_last_packet = self.clock.to_datetime(stats.last_ns)
 
         # Calculate total time as the difference between the last packet and the send timestamp
         total_time = (t_last_packet - send_time).total_seconds()
 
         # Prevent negative total_time
         if total_time < 0:
-            print("Error: Total time is negative. Check NTP synchronization.")
+            logger.warning("Total time is negative. Check NTP synchronization.", extra={'event': 'negative_total_time'})
             total_time = 0
 
         # Calculate average latency per packet as total_time / packet_count
@@ -121,92 +162,149 @@ class PassiveMonitoring:
         throughput = total_data_size / total_time if total_time > 0 else 0
         throughput_kbps = (throughput * 8) / 1000  # Convert bytes/sec to kbps
 
-        timestamp = self.get_ntp_time
+        timestamp = self.get_ntp_time()
 
-        return {
-            "packet_count": packet_count,
-            "total_data_size": total_data_size,
+        metrics = stats.summary()
+        metrics.update({
             "total_time": total_time,
             "avg_latency_ms": avg_latency * 1000,  # Convert to milliseconds
             "throughput_kbps": throughput_kbps,
             "last_active": timestamp
-        }
+        })
+        return metrics
 
     async def process_bulk_upload(self, websocket):
         """
         Handle WebSocket messages for bulk uploads and analyze metrics.
+        Messages are JSON or binary framed (see upload_codec), store updates are batched.
         """
         # These variables are used for cleanup if communication fails
         fd_id = None
-        key = None
 
         try:
+            # Extract WebSocket connection details
+            src_ip, src_port = websocket.remote_address
+            key = (src_ip, src_port)
+
             async for message in websocket:
-                # Extract WebSocket connection details
-                src_ip, src_port = websocket.remote_address
-                print(f"Field Device IP: {src_ip}:{src_port}")
+                try:
+                    fd_id, send_timestamp = decode_upload(message)
+                    # Convert Timestamp
+                    send_time = datetime.fromtimestamp(send_timestamp)
+                except (ValueError, TypeError, OverflowError, OSError) as e:
+                    # One bad message does not end the connection, the FD keeps uploading on it
+                    logger.warning("Invalid bulk upload from %s:%s: %s", src_ip, src_port, e,
+                                   extra={'event': 'bulk_upload_invalid'})
+                    PASSIVE_UPLOADS.inc(result='invalid')
+                    continue
+
+                if self.owned_fd_ids is not None and fd_id not in self.owned_fd_ids:
+                    # Another shard's FD, its status is kept there
+                    await self.pop_stats(key)
+                    PASSIVE_UPLOADS.inc(result='not_owned')
+                    continue
+
+                stats = await self.pop_stats(key)
 
-                # Parse the message
-                data = json.loads(message)
-                fd_id = data.get("device_id", "Unknown")
-                send_timestamp = float(data.get("send_timestamp"))
+                # Analyze packets for latency and throughput
+                metrics = self.analyze_packets(send_time, stats)
 
-                # Convert Timestamp
-                send_time = datetime.fromtimestamp(send_timestamp)
+                status = self.classify_connection(metrics, fd_id)
 
-                # Get packets for this connection
-                key = (src_ip, src_port)
-                packets = self.packet_data.get(key, [])
+                if self.history is not None:
+                    self.history.record(fd_id, 'passive', latency=metrics['avg_latency_ms'], throughput=metrics['throughput_kbps'])
 
-                # Analyze packets for latency and throughput
-                metrics = self.analyze_packets(send_time, packets)
-
-                status = self.classify_connection(metrics)
-
-                # Print results
-                print(f"Device ID: {fd_id}")
-                print(f"Packet Count: {metrics['packet_count']}")
-                print(f"Total Data Size: {metrics['total_data_size']} bytes")
-                print(f"Total Time: {metrics['total_time']:.2f} seconds")
-                print(f"Average Latency per Packet: {metrics['avg_latency_ms']:.2f} ms")
-                print(f"Throughput: {metrics['throughput_kbps']:.2f} kbps")
-                print(f"Status: {status}\n")
-
-                # Clear packet data for this connection after processing
-                if key in self.packet_data:
-                    del self.packet_data[key]
-
-                # Update the field device storage
-                with self.fd_locks[fd_id]:
-                    fd_info = self.field_devices.get(fd_id)
-                    passive_metrics = fd_info.get('passive_metrics', {})
-
-                    # Update the fields
-                    passive_metrics['latency'] = metrics['avg_latency_ms']
-                    passive_metrics['throughput'] = metrics['throughput_kbps']
-                    passive_metrics['status'] = status
-                    passive_metrics['last_active'] = metrics['last_active']
-                    fd_info['passive_metrics'] = passive_metrics 
+                logger.debug("Device ID: %s (%s:%s) | Packets: %d | Latency: %.2f ms | Throughput: %.2f kbps | Status: %s",
+                             fd_id, src_ip, src_port, metrics['packet_count'], metrics['avg_latency_ms'],
+                             metrics['throughput_kbps'], status, extra={'event': 'bulk_upload', 'fd_id': fd_id})
+
+                PASSIVE_UPLOADS.inc(result='success')
+
+                # Queue the field device update, written to the store in batches
+                self.queue_update(fd_id, {
+                    'latency': metrics['avg_latency_ms'],
+                    'throughput': metrics['throughput_kbps'],
+                    'status': status,
+                    'last_active': metrics['last_active'],
+                })
 
         except Exception as e:
-            print(f"Error processing bulk upload: {e}")
-            print(f"Classifying as Unavailable\n")
+            logger.warning("Error processing bulk upload from FD %s: %s. Classifying as Unavailable", fd_id, e,
+                           extra={'event': 'bulk_upload_failed', 'fd_id': fd_id})
 
-            status = self.classify_connection(self, 0)
+            PASSIVE_UPLOADS.inc(result='failure')
+            status = self.classify_connection(0)
 
             # Update the field device storage
-            with self.fd_locks[fd_id]:
-                fd_info = self.field_devices.get(fd_id)
-                passive_metrics = fd_info.get('passive_metrics', {})
+            if fd_id is not None:
+                self.queue_update(fd_id, {
+                    'status': status,
+                    'last_active': self.get_ntp_time(),
+                })
+
+    def set_owned(self, fd_ids):
+        """Only record uploads from these FDs (a shard's part of the fleet), or from every FD with None."""
+        self.owned_fd_ids = None if fd_ids is None else frozenset(fd_ids)
+
+    def queue_update(self, fd_id, values):
+        """
+        Queue a passive metrics update. Flushed every update_interval seconds, or right away
+        once update_batch_size updates are pending.
+        """
+        self.pending_updates.append((fd_id, values))
+        if len(self.pending_updates) >= self.update_batch_size:
+            self.flush_updates()
+
+    def flush_updates(self):
+        """
+        Write the queued updates to the device store, one lock acquisition per stripe.
+        """
+        if not self.pending_updates:
+            return 0
+        updates, self.pending_updates = self.pending_updates, []
+        return self.field_devices.update_many('passive_metrics', updates)
 
-                # Update the fields
-                passive_metrics['status'] = status
-                passive_metrics['last_active'] = self.get_ntp_time
-                fd_info['passive_metrics'] = passive_metrics
+    async def update_flusher(self):
+        """
+        Coroutine that flushes queued store updates until shutdown.
+        """
+        while not self.shutdown_event.is_set():
+            await asyncio.sleep(self.update_interval)
+            self.flush_updates()
+        self.flush_updates()
 
-    def classify_connection(self, metrics):
+    def collect_metrics(self):
+        """
+        Capture metrics for the /metrics endpoint (a REGISTRY collector).
+        """
+        if isinstance(self.packet_data, ShardedCapture):
+            stats = self.packet_data.stats() if self.packet_data.conns else {}
+        else:
+            accumulator = self.packet_data
+            stats = {
+                'records': accumulator.packets,
+                'connections': len(accumulator),
+                'evicted_expired': accumulator.evicted_expired,
+                'evicted_full': accumulator.evicted_full,
+            }
+        return [
+            ('headend_passive_packets_total', 'counter', 'Packets captured', [({}, stats.get('records', 0))]),
+            ('headend_passive_connections', 'gauge', 'Connections with packet stats', [({}, stats.get('connections', 0))]),
+            ('headend_passive_evicted_connections_total', 'counter', 'Connections dropped before their upload', [
+                ({'reason': 'expired'}, stats.get('evicted_expired', 0)),
+                ({'reason': 'full'}, stats.get('evicted_full', 0)),
+            ]),
+            ('headend_passive_pending_updates', 'gauge', 'Store updates waiting for the next batch',
+             [({}, len(self.pending_updates))]),
+        ]
+
+    def classify_connection(self, metrics, fd_id=None):
         if metrics == 0:
             return "Unavailable"
+        if self.classifier is not None and metrics['packet_count'] and fd_id in self.field_devices:
+            # Retransmitted segments stand in for packet loss on the passive side
+            return self.classifier.classify(fd_id, 'passive', metrics['avg_latency_ms'], metrics['retransmission_rate'] * 100,
+                                            metrics['throughput_kbps'])
         return "Good"
 
     async def start_server(self):
@@ -214,8 +312,10 @@ class PassiveMonitoring:
         Start the WebSocket server and keep it running until shutdown event is set.
         """
         async with websockets.serve(self.process_bulk_upload, self.host, self.port):
-            print(f"Starting WebSocket server on ws://{self.host}:{self.port}")
+            logger.info("Starting WebSocket server on ws://%s:%s", self.host, self.port)
+            flusher = asyncio.ensure_future(self.update_flusher())
             await self.wait_for_shutdown()
+            await flusher
 
     async def wait_for_shutdown(self):
         """
@@ -236,10 +336,10 @@ class PassiveMonitoring:
             # Run start_server(), which handles the server setup and waiting
             loop.run_until_complete(self.start_server())
         except Exception as e:
-            print(f"Error while running server: {e}")
+            logger.exception("Error while running server: %s", e)
         finally:
             loop.close()
-            print("WebSocket server stopped.")
+            logger.info("WebSocket server stopped.")
 
     def start(self):
         """
@@ -260,7 +360,7 @@ class PassiveMonitoring:
         """
         Stop all ongoing operations and close the server gracefully.
         """
-        print("Shutting down...")
+        logger.info("Shutting down...")
         self.shutdown_event.set()  # Signal both threads to stop
 
         # Wait for threads to finish
@@ -268,7 +368,7 @@ class PassiveMonitoring:
             self.capture_thread.join()
         if self.server_thread:
             self.server_thread.join()
-        print("Shutdown complete.")
+        logger.info("Shutdown complete.")
 
 
 # Uncomment and adjust the following lines if you want to run this module directly
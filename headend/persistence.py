@@ -0,0 +1,166 @@
+# persistence.py
+
+import logging
+import math
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from device_store import STATUSES, STATUS_CODES
+
+logger = logging.getLogger(__name__)
+
+# fd_state column -> DeviceStore column
+STATE_COLUMNS = (
+    ('Last_Data_Received', 'last_data_received'),
+    ('Active_Latency', 'active_latency'),
+    ('Active_Packet_Loss', 'active_packet_loss'),
+    ('Active_Throughput', 'active_throughput'),
+    ('Active_Status', 'active_status'),
+    ('Active_Last_Active', 'active_last_active'),
+    ('Passive_Latency', 'passive_latency'),
+    ('Passive_Throughput', 'passive_throughput'),
+    ('Passive_Status', 'passive_status'),
+    ('Passive_Last_Active', 'passive_last_active'),
+)
+
+UPSERT_STATE = (
+    f"INSERT OR REPLACE INTO fd_state (FD_ID, {', '.join(name for name, _ in STATE_COLUMNS)}, Updated) "
+    f"VALUES ({', '.join('?' * (len(STATE_COLUMNS) + 2))})"
+)
+
+
+def connect(db_path, **kwargs):
+    """Open a connection in WAL mode, so the background writers never block the readers."""
+    conn = sqlite3.connect(db_path, timeout=30, **kwargs)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+def create_state_table(conn):
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS fd_state (
+            FD_ID TEXT PRIMARY KEY,
+            {', '.join(f"{name} {'TEXT' if name.endswith('Status') else 'REAL'}" for name, _ in STATE_COLUMNS)},
+            Updated REAL NOT NULL
+        )
+    ''')
+
+
+def state_row(fd_id, raw, now):
+    """fd_state row from the raw column values of a store row: NaN becomes NULL and status codes become names."""
+    values = [fd_id]
+    for _, column in STATE_COLUMNS:
+        value = raw[column]
+        if column.endswith('status'):
+            values.append(STATUSES[value])
+        else:
+            values.append(None if math.isnan(value) else value)
+    values.append(now)
+    return tuple(values)
+
+
+def restore_state(store, db_path='field_devices.db'):
+    """
+    Warm start: load the last persisted metrics and last_data_received into the store.
+    Returns the number of FDs restored. Must run before modules subscribe to status changes.
+    """
+    conn = connect(db_path)
+    try:
+        create_state_table(conn)
+        rows = conn.execute(f"SELECT FD_ID, {', '.join(name for name, _ in STATE_COLUMNS)} FROM fd_state").fetchall()
+    finally:
+        conn.close()
+
+    restored = 0
+    for fd_id, *values in rows:
+        row = store.index.get(fd_id)
+        if row is None:
+            continue  # FD no longer in field_devices
+        for (_, column), value in zip(STATE_COLUMNS, values):
+            if column.endswith('status'):
+                store.columns[column][row] = STATUS_CODES.get(value, 0)
+            elif value is not None:
+                store.columns[column][row] = value
+        restored += 1
+    return restored
+
+
+class StateWriter:
+    """
+    Background writer persisting device state changes.
+
+    Every flush_interval seconds it takes the rows written since the last flush from the
+    DeviceStore and writes them with executemany in a single transaction: the full row to
+    fd_state and last_data_received back to field_devices.Last_Data_Received.
+    """
+
+    def __init__(self, field_devices, db_path='field_devices.db', flush_interval=1):
+        self.field_devices = field_devices
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.conn = None
+        self.rows_written = 0
+        self.flushes = 0
+
+    def flush(self):
+        """Write all dirty rows now. Returns the number of FDs written."""
+        rows = self.field_devices.take_dirty()
+        if not rows:
+            return 0
+
+        store = self.field_devices
+        now = time.time()
+        state_rows = []
+        field_device_rows = []
+        for row in rows:
+            # Seqlock read, so a row is never written half-updated
+            raw, _, _ = store.read_row(row)
+            fd_id = store.fd_ids[row]
+            state_rows.append(state_row(fd_id, raw, now))
+            last_received = raw['last_data_received']
+            if not math.isnan(last_received):
+                field_device_rows.append((datetime.fromtimestamp(last_received).isoformat(), fd_id))
+
+        try:
+            if self.conn is None:
+                # The final flush in stop() runs on the caller's thread
+                conn = connect(self.db_path, check_same_thread=False)
+                create_state_table(conn)
+                self.conn = conn
+            with self.conn:
+                self.conn.executemany(UPSERT_STATE, state_rows)
+                self.conn.executemany('UPDATE field_devices SET Last_Data_Received = ? WHERE FD_ID = ?', field_device_rows)
+        except Exception:
+            # Put the rows back so the next flush retries them
+            for row in rows:
+                store.mark_dirty(row)
+            raise
+
+        self.rows_written += len(state_rows)
+        self.flushes += 1
+        return len(state_rows)
+
+    def run(self):
+        while not self.stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception("Failed to persist device state: %s", e)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+        self.flush()
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
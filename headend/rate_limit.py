@@ -0,0 +1,65 @@
+# rate_limit.py
+
+import threading
+import time
+
+
+class TokenBucket:
+    """Token bucket allowing `rate` operations per second with bursts of up to `burst`. Thread-safe."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst if burst is not None else max(rate, 1))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available. Returns True on success."""
+        with self.lock:
+            self._refill(time.monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return True
+            return False
+
+    def time_until_available(self, tokens=1):
+        """Seconds until `tokens` can be taken (0 if they are available now)."""
+        with self.lock:
+            self._refill(time.monotonic())
+            missing = tokens - self.tokens
+            return max(missing / self.rate, 0.0) if self.rate > 0 else float('inf')
+
+
+class RegionRateLimiter:
+    """
+    One token bucket per region. `limits` maps region -> (rate, burst); regions without an
+    entry use `default`, and a default of None means those regions are not limited.
+    """
+
+    def __init__(self, limits=None, default=None):
+        self.limits = dict(limits or {})
+        self.default = default
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, region):
+        with self.lock:
+            bucket = self.buckets.get(region)
+            if bucket is None:
+                limit = self.limits.get(region, self.default)
+                if limit is None:
+                    return None
+                bucket = self.buckets[region] = TokenBucket(*limit)
+            return bucket
+
+    def try_acquire(self, region):
+        """Returns 0 if the operation may go ahead now, else the seconds to wait for a token."""
+        bucket = self.bucket(region)
+        if bucket is None or bucket.try_acquire():
+            return 0.0
+        return max(bucket.time_until_available(), 0.001)
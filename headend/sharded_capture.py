@@ -0,0 +1,256 @@
+# sharded_capture.py
+
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import zlib
+
+from packet_accumulator import PacketAccumulator
+from packet_capture import open_capture
+
+logger = logging.getLogger(__name__)
+
+PACKET_FANOUT_HASH = 0
+
+NO_REPLY = object()  # A worker did not answer in time
+
+
+def shard_of(key, shards):
+    """Shard that owns a (src_ip, src_port) connection (stable across processes, unlike hash())."""
+    return zlib.crc32(f"{key[0]}:{key[1]}".encode()) % shards
+
+
+def capture_worker(conn, capture_args, record_queue, ttl, max_connections):
+    """
+    Worker process owning one accumulator shard. Packets either come from its own capture
+    socket (AF_PACKET fanout member) or in batches from the dispatcher. The main thread
+    answers the parent's requests on conn.
+    """
+    accumulator = PacketAccumulator(ttl=ttl, max_connections=max_connections)
+    stop_event = threading.Event()
+    counters = {'records': 0}
+
+    def capture():
+        if record_queue is not None:
+            while not stop_event.is_set():
+                batch = record_queue.get()
+                if batch is None:
+                    break
+                for key, ts_ns, size, seq, payload_len in batch:
+                    accumulator.add(key, ts_ns, size, seq, payload_len)
+                counters['records'] += len(batch)
+            return
+
+        capture = open_capture(**capture_args)
+        try:
+            for record in capture.records(stop_event):
+                accumulator.add((record.src_ip, record.src_port), record.ts_ns, record.size, record.seq, record.payload_len)
+                counters['records'] += 1
+        except Exception as e:
+            logger.exception("Error in capture worker %d: %s", os.getpid(), e)
+        finally:
+            capture.close()
+
+    capture_thread = threading.Thread(target=capture, daemon=True)
+    capture_thread.start()
+
+    while True:
+        # Replies carry the request's sequence number, so the parent can drop late ones
+        sequence, command, key = conn.recv()
+        if command == 'pop':
+            conn.send((sequence, accumulator.pop(key)))
+        elif command == 'get':
+            with accumulator.lock:  # Don't pickle it while the capture thread updates it
+                conn.send((sequence, accumulator.connections.get(key)))
+        elif command == 'stats':
+            conn.send((sequence, {
+                'records': counters['records'],
+                'connections': len(accumulator),
+                'evicted_expired': accumulator.evicted_expired,
+                'evicted_full': accumulator.evicted_full,
+            }))
+        elif command == 'stop':
+            stop_event.set()
+            conn.send((sequence, None))
+            break
+
+
+def dispatch_worker(capture_args, record_queues, stop_event, batch_size, flush_interval):
+    """
+    Software fanout for backends without PACKET_FANOUT: capture and parse in this process
+    and send the records in batches to the worker owning each connection.
+    Partial batches are flushed every flush_interval seconds while packets keep arriving.
+    """
+    shards = len(record_queues)
+    batches = [[] for _ in range(shards)]
+    last_flush = time.monotonic()
+    capture = open_capture(**capture_args)
+    try:
+        for record in capture.records(stop_event):
+            key = (record.src_ip, record.src_port)
+            shard = shard_of(key, shards)
+            batch = batches[shard]
+            batch.append((key, record.ts_ns, record.size, record.seq, record.payload_len))
+            if len(batch) >= batch_size:
+                record_queues[shard].put(batch)
+                batches[shard] = []
+            now = time.monotonic()
+            if now - last_flush >= flush_interval:
+                for shard, batch in enumerate(batches):
+                    if batch:
+                        record_queues[shard].put(batch)
+                        batches[shard] = []
+                last_flush = now
+    except Exception as e:
+        logger.exception("Error in capture dispatcher: %s", e)
+    finally:
+        capture.close()
+        for shard, batch in enumerate(batches):
+            if batch:
+                record_queues[shard].put(batch)
+        for record_queue in record_queues:
+            record_queue.put(None)
+
+
+class ShardedCapture:
+    """
+    Passive capture spread over `workers` processes, each owning a shard of the connections.
+
+    With the 'afpacket' backend every worker opens its own ring in one PACKET_FANOUT group,
+    and the kernel hashes flows to the workers, so capture and parsing scale with cores.
+    Other backends ('pcap', 'scapy') capture in one dispatcher process that hashes
+    (src_ip, src_port) to the workers over queues.
+    Offers the PacketAccumulator lookups (pop, get, summary), merging the shards' stats.
+    """
+
+    def __init__(self, workers, backend, interface=None, port=None, pcap_path=None, ttl=300, max_connections=100_000,
+                 fanout_group=None, batch_size=256, flush_interval=0.05, timeout=2):
+        self.workers = workers
+        self.backend = backend
+        self.capture_args = {'backend': backend, 'interface': interface, 'port': port, 'pcap_path': pcap_path}
+        self.ttl = ttl
+        self.max_connections = max_connections // workers  # Per shard
+        self.fanout_group = fanout_group if fanout_group is not None else os.getpid() & 0xffff
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.timeout = timeout
+        self.context = multiprocessing.get_context('spawn')  # Don't fork the headend's threads
+        self.processes = []
+        self.conns = []
+        self.record_queues = []
+        self.dispatcher = None
+        self.stop_event = None
+        self.lock = threading.Lock()  # One request/reply round at a time
+        self.sequence = 0  # Of the last request round
+
+    def start(self):
+        context = self.context
+        kernel_fanout = self.backend == 'afpacket'
+        # Kept referenced, the queues must outlive the children's startup
+        self.record_queues = record_queues = [] if kernel_fanout else [context.Queue(maxsize=1024) for _ in range(self.workers)]
+
+        for index in range(self.workers):
+            parent_conn, child_conn = context.Pipe()
+            if kernel_fanout:
+                capture_args = dict(self.capture_args, fanout_group=self.fanout_group, fanout_mode=PACKET_FANOUT_HASH)
+                record_queue = None
+            else:
+                capture_args = None
+                record_queue = record_queues[index]
+            process = context.Process(target=capture_worker, daemon=True,
+                                      args=(child_conn, capture_args, record_queue, self.ttl, self.max_connections))
+            process.start()
+            self.processes.append(process)
+            self.conns.append(parent_conn)
+
+        if not kernel_fanout:
+            self.stop_event = context.Event()
+            self.dispatcher = context.Process(target=dispatch_worker, daemon=True,
+                                              args=(self.capture_args, record_queues, self.stop_event,
+                                                    self.batch_size, self.flush_interval))
+            self.dispatcher.start()
+
+    def _broadcast(self, command, key=None):
+        with self.lock:
+            self.sequence += 1
+            sequence = self.sequence
+            for conn in self.conns:
+                conn.send((sequence, command, key))
+            replies = []
+            timed_out = 0
+            for conn in self.conns:
+                reply = self._receive(conn, sequence)
+                if reply is NO_REPLY:
+                    timed_out += 1
+                else:
+                    replies.append(reply)
+            if timed_out:
+                # The others' replies are read, and a late one is dropped by the next round
+                raise TimeoutError(f"{timed_out} capture worker(s) did not answer '{command}'")
+            return replies
+
+    def _receive(self, conn, sequence):
+        """A worker's reply to request sequence, skipping late replies to earlier requests. NO_REPLY on timeout."""
+        deadline = time.monotonic() + self.timeout
+        while conn.poll(max(deadline - time.monotonic(), 0)):
+            reply_sequence, reply = conn.recv()
+            if reply_sequence == sequence:
+                return reply
+            logger.debug("Dropped a late capture worker reply to request %d", reply_sequence)
+        return NO_REPLY
+
+    @staticmethod
+    def _merge(parts):
+        merged = None
+        for stats in parts:
+            if stats is None:
+                continue
+            if merged is None:
+                merged = stats
+            else:
+                merged.merge(stats)
+        return merged
+
+    def pop(self, key):
+        return self._merge(self._broadcast('pop', key))
+
+    def get(self, key):
+        return self._merge(self._broadcast('get', key))
+
+    def summary(self, key):
+        stats = self.get(key)
+        return stats.summary() if stats is not None else None
+
+    def stats(self):
+        """Records processed, connections tracked and evictions, summed over the workers."""
+        totals = {}
+        for worker_stats in self._broadcast('stats'):
+            for name, value in worker_stats.items():
+                totals[name] = totals.get(name, 0) + value
+        return totals
+
+    def __len__(self):
+        return self.stats()['connections']
+
+    def stop(self):
+        if self.stop_event is not None:
+            self.stop_event.set()
+        if self.dispatcher is not None:
+            self.dispatcher.join(self.timeout)
+            if self.dispatcher.is_alive():
+                self.dispatcher.terminate()
+            self.dispatcher = None
+        if self.processes:
+            try:
+                self._broadcast('stop')
+            except (TimeoutError, OSError):
+                pass
+            for process in self.processes:
+                process.join(self.timeout)
+                if process.is_alive():
+                    process.terminate()
+        self.processes = []
+        self.conns = []
+        self.record_queues = []
@@ -0,0 +1,157 @@
+# sharding.py
+
+import asyncio
+import bisect
+import hashlib
+import json
+import logging
+import threading
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+STRATEGIES = ('hash', 'region')
+
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+def shard_key(fd_id, region, strategy):
+    """What FDs are partitioned on: the FD itself, or its region (a region is never split)."""
+    return region if strategy == 'region' else fd_id
+
+
+class HashRing:
+    """
+    Consistent hash ring of shards, each placed at vnodes points. A key belongs to the first
+    shard point at or after its hash, so a shard joining or leaving only moves the keys of
+    its own points (about 1/N of the fleet) and leaves the rest where they are.
+    """
+
+    def __init__(self, nodes=(), vnodes=64):
+        self.vnodes = vnodes
+        self.points = []  # Sorted (hash, node)
+        for node in nodes:
+            self.add_node(node)
+
+    def add_node(self, node):
+        for i in range(self.vnodes):
+            bisect.insort(self.points, (ring_hash(f"{node}#{i}"), node))
+
+    def remove_node(self, node):
+        self.points = [point for point in self.points if point[1] != node]
+
+    @property
+    def nodes(self):
+        return sorted({node for _, node in self.points})
+
+    def node_for(self, key):
+        """Shard owning the key, or None if the ring is empty."""
+        if not self.points:
+            return None
+        index = bisect.bisect_left(self.points, (ring_hash(str(key)), ''))
+        return self.points[index % len(self.points)][1]
+
+
+def owned_fd_ids(field_devices, shard_id, shards, strategy='hash', vnodes=64):
+    """FDs of the store that belong to shard_id when the fleet is split over shards."""
+    ring = HashRing(shards, vnodes)
+    owners = {}  # Regions repeat, so look each one up once
+    owned = []
+    regions = field_devices.regions
+    for fd_id, row in list(field_devices.index.items()):
+        region = regions[row]
+        key = shard_key(fd_id, region, strategy)
+        owner = owners.get(key)
+        if owner is None:
+            owner = owners[key] = ring.node_for(key)
+        if owner == shard_id:
+            owned.append(fd_id)
+    return owned
+
+
+class ShardMember:
+    """
+    A headend's membership in a sharded deployment.
+
+    Registers with the coordinator (see coordinator.py) and, on every assignment it pushes,
+    works out which FDs of the store this shard owns and calls on_assignment(fd_ids). Owns
+    nothing until the first assignment, so shards never probe the same FDs twice. While the
+    coordinator is unreachable the last assignment stays in place and it reconnects.
+    """
+
+    def __init__(self, shard_id, coordinator_url, backend_url, field_devices, on_assignment, reconnect_interval=5):
+        self.shard_id = shard_id
+        self.coordinator_url = coordinator_url
+        self.backend_url = backend_url  # Where the coordinator forwards backend focus requests for this shard
+        self.field_devices = field_devices
+        self.on_assignment = on_assignment
+        self.reconnect_interval = reconnect_interval
+        self.version = None  # Version of the applied assignment
+        self.shards = []
+        self.owned = []
+        self.assignment = None
+        self.lock = threading.Lock()  # Assignments and FD changes arrive on different threads
+        self.stop_event = threading.Event()
+        self.loop = None
+        self.task = None
+        self.thread = None
+        field_devices.add_device_listener(self.on_devices_changed)
+
+    def apply_assignment(self, assignment):
+        with self.lock:
+            self.assignment = assignment
+            self.shards = assignment['shards']
+            self.owned = owned_fd_ids(self.field_devices, self.shard_id, self.shards, assignment['strategy'], assignment['vnodes'])
+            self.version = assignment['version']
+            logger.info("Shard %s owns %d of %d FDs (assignment %d, %d shards)", self.shard_id, len(self.owned),
+                        len(self.field_devices), self.version, len(self.shards))
+            self.on_assignment(self.owned)
+
+    def on_devices_changed(self, added, updated, removed):
+        # FDs were added, moved region or removed: work out this shard's part of the fleet again
+        if self.assignment is not None:
+            self.apply_assignment(self.assignment)
+
+    async def run_async(self):
+        register = json.dumps({'type': 'register', 'shard_id': self.shard_id, 'backend_url': self.backend_url})
+        while not self.stop_event.is_set():
+            try:
+                async with websockets.connect(self.coordinator_url) as websocket:
+                    await websocket.send(register)
+                    logger.info("Shard %s registered with the coordinator at %s", self.shard_id, self.coordinator_url)
+                    async for message in websocket:
+                        message = json.loads(message)
+                        if message.get('type') == 'assignment':
+                            self.apply_assignment(message)
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException) as e:
+                logger.warning("Lost the coordinator at %s: %s. Keeping assignment %s", self.coordinator_url, e, self.version)
+            await asyncio.get_running_loop().run_in_executor(None, self.stop_event.wait, self.reconnect_interval)
+
+    def run(self):
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    def start(self):
+        # Loop and task exist before the thread does, so stop() can cancel the task right away
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(self.run_async())
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            try:
+                self.loop.call_soon_threadsafe(self.task.cancel)
+            except RuntimeError:
+                pass  # The loop already finished and closed
+            self.thread.join()
+            self.thread = None
@@ -0,0 +1,91 @@
+# streaming_stats.py
+
+import math
+
+
+class RunningStats:
+    """Online mean and variance (Welford), mergeable with Chan's parallel formula."""
+
+    __slots__ = ('count', 'mean', 'm2', 'min', 'max')
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other):
+        if not other.count:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def stddev(self):
+        return math.sqrt(self.variance)
+
+
+class LogHistogram:
+    """
+    HDR-style histogram with logarithmic buckets, so every percentile is within `precision`
+    (relative) of the true value whatever the range. Buckets are sparse (a dict), so an idle
+    connection costs a few entries instead of a fixed array.
+    """
+
+    __slots__ = ('log_base', 'buckets', 'count', 'zeros')
+
+    def __init__(self, precision=0.02):
+        self.log_base = math.log1p(2 * precision)  # Bucket midpoints are within precision of the edges
+        self.buckets = {}
+        self.count = 0
+        self.zeros = 0  # Values <= 0 (e.g. packets with identical timestamps)
+
+    def add(self, value):
+        self.count += 1
+        if value <= 0:
+            self.zeros += 1
+            return
+        index = math.floor(math.log(value) / self.log_base)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.zeros += other.zeros
+        buckets = self.buckets
+        for index, count in other.buckets.items():
+            buckets[index] = buckets.get(index, 0) + count
+
+    def percentile(self, q):
+        """Approximate percentile (q in 0-100), or None if the histogram is empty."""
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * q / 100))
+        seen = self.zeros
+        if seen >= rank:
+            return 0.0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                # Geometric midpoint of the bucket
+                return math.exp((index + 0.5) * self.log_base)
+        return None
@@ -0,0 +1,118 @@
+# structured_logging.py
+
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
+from datetime import datetime
+
+from rate_limit import TokenBucket
+
+# Attributes every LogRecord has; anything else was passed with extra={...}
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: ts, level, logger, message and the record's extra fields."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Per message type sampling and rate limiting. The type is the record's `event` extra field,
+    or else the logger and the unformatted message template, so lazy %-style arguments
+    (e.g. one line per FD) share one limit.
+    Sampling only drops records below WARNING. A record let through after some were rate
+    limited carries `suppressed` (the count dropped since the last one).
+    """
+
+    def __init__(self, default_limit=(20, 100), limits=None, sample_rates=None):
+        super().__init__()
+        self.default_limit = default_limit
+        self.limits = dict(limits or {})
+        self.sample_rates = dict(sample_rates or {})
+        self.buckets = {}
+        self.suppressed = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        key = getattr(record, 'event', None) or (record.name, record.msg)
+
+        sample_rate = self.sample_rates.get(key)
+        if sample_rate is not None and record.levelno < logging.WARNING and random.random() >= sample_rate:
+            return False
+
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                limit = self.limits.get(key, self.default_limit)
+                if limit is None:
+                    return True
+                bucket = self.buckets[key] = TokenBucket(*limit)
+            if not bucket.try_acquire():
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                return False
+            suppressed = self.suppressed.pop(key, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records (and counts them) instead of blocking when the queue is full."""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+def setup_logging(level=logging.INFO, json_output=True, stream=None, default_limit=(20, 100), limits=None,
+                  sample_rates=None, queue_size=10000):
+    """
+    Route all logging through a bounded queue to a background writer thread, so callers
+    never block on stdout. Returns the QueueListener; call stop() on it at shutdown to
+    flush what is queued.
+    """
+    log_queue = queue.Queue(queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(default_limit, limits, sample_rates))
+
+    output = logging.StreamHandler(stream if stream is not None else sys.stdout)
+    if json_output:
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = logging.handlers.QueueListener(log_queue, output)
+    listener.start()
+    return listener
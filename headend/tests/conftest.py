@@ -0,0 +1,7 @@
+# conftest.py
+
+import os
+import sys
+
+# The headend modules are imported as top-level modules, like main.py and the benchmarks do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
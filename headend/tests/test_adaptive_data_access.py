@@ -0,0 +1,151 @@
+# test_adaptive_data_access.py
+
+import asyncio
+import time
+
+import pytest
+
+from adaptive_data_access import AdaptiveDataAccess
+from device_store import DeviceStore
+from focus_jobs import FocusJob
+
+
+def make_ada(num_fds=3, regions=None, **kwargs):
+    rows = [(str(fd_id), '127.0.0.1', (regions or {}).get(str(fd_id), 'A1'), 3000 + fd_id, None) for fd_id in range(num_fds)]
+    store = DeviceStore.from_rows(rows)
+    for row in range(num_fds):
+        store.set_status(row, 'active_', 'Good')
+    return AdaptiveDataAccess(store, store.locks, **kwargs)
+
+
+def heap_entry(ada, fd_id):
+    scheduler = ada.scheduler
+    for due, priority, sequence, entry_fd_id in scheduler.heap:
+        if entry_fd_id == fd_id and scheduler.entries.get(fd_id) == sequence:
+            return due, priority
+    return None
+
+
+@pytest.mark.parametrize('scoring', ['python', 'numpy'])
+def test_fds_being_fetched_are_not_fetched_again(scoring):
+    if scoring == 'numpy':
+        pytest.importorskip('numpy')
+    ada = make_ada(scoring=scoring)
+    fetches = []
+    release = asyncio.Event()
+
+    async def fetch(fd_id, fd_info):
+        fetches.append(fd_id)
+        await release.wait()
+        return True
+
+    ada.fetch_data_from_fd = fetch
+
+    async def main():
+        pipeline = asyncio.ensure_future(ada.run_pipeline())
+        while len(fetches) < 3:
+            await asyncio.sleep(0.01)
+
+        # Neither a rebuild nor a status change puts an FD being fetched back in the heap
+        ada.schedule_all()
+        ada.set_owned(None)
+        ada.field_devices.update_metrics('1', 'active_metrics', {'status': 'Acceptable'})
+        assert len(ada.scheduler) == 0
+        await asyncio.sleep(0.1)
+        assert sorted(fetches) == ['0', '1', '2']
+
+        release.set()
+        while ada.in_flight:
+            await asyncio.sleep(0.01)
+        # Back in the heap, due again ada_wait_time after the fetch
+        for fd_id in '012':
+            due, _ = heap_entry(ada, fd_id)
+            assert due > time.time()
+        ada.stop_event.set()
+        ada.scheduler.wake()
+        await pipeline
+
+    asyncio.run(main())
+    assert sorted(fetches) == ['0', '1', '2']
+
+
+def test_preempted_fetch_is_rescheduled():
+    ada = make_ada(num_fds=1)
+
+    async def fetch(fd_id, fd_info):
+        await asyncio.sleep(10)
+
+    ada.fetch_data_from_fd = fetch
+
+    async def main():
+        ada.scheduler.pop_due(time.time())
+        ada.in_flight.add('0')
+        task = asyncio.ensure_future(ada.process_background_fd('0'))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(main())
+    assert not ada.in_flight
+    assert heap_entry(ada, '0') is not None
+
+
+def test_region_deferral_survives_rebuilds_and_status_changes():
+    ada = make_ada()
+    not_before = time.time() + 60
+    ada.reschedule('1', not_before=not_before)
+
+    ada.schedule_all()
+    assert heap_entry(ada, '1')[0] == not_before
+    ada.field_devices.update_metrics('1', 'active_metrics', {'status': 'Poor'})
+    assert heap_entry(ada, '1')[0] == not_before
+    assert heap_entry(ada, '0')[0] == float('-inf')
+
+
+def test_region_limit_holds_across_rebuild():
+    ada = make_ada(region_rate_limits={'A1': (0.01, 1)})
+    started = []
+
+    async def fetch(fd_id, fd_info):
+        started.append(fd_id)
+        return True
+
+    ada.fetch_data_from_fd = fetch
+
+    async def main():
+        pipeline = asyncio.ensure_future(ada.run_pipeline())
+        await asyncio.sleep(0.1)
+        ada.schedule_all()  # Must not make the deferred FDs due again
+        await asyncio.sleep(0.1)
+        ada.stop_event.set()
+        ada.scheduler.wake()
+        await pipeline
+
+    asyncio.run(main())
+    assert len(started) == 1
+
+
+def test_focus_sample_error_keeps_the_fd_in_the_job():
+    ada = make_ada(num_fds=1)
+    messages = []
+    calls = []
+
+    async def fetch(fd_id):
+        calls.append(fd_id)
+        if len(calls) == 1:
+            raise RuntimeError('boom')
+        return 'delivered'
+
+    ada.process_fd_async = fetch
+    job = FocusJob(['0'], sample_interval=0.01, reply=messages.append)
+    ada.focus_queue.submit(job)
+
+    async def main():
+        sample = ada.focus_queue.pop_due()
+        await ada.process_focus_sample(*sample)
+        await asyncio.sleep(0.02)
+        await ada.process_focus_sample(*ada.focus_queue.pop_due())
+
+    asyncio.run(main())
+    assert [message['result'] for message in messages] == ['error', 'delivered']
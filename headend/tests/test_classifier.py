@@ -0,0 +1,121 @@
+# test_classifier.py
+
+import math
+import threading
+
+from classifier import (ACCEPTABLE, GOOD, POOR, UNAVAILABLE, ConnectionClassifier, Thresholds,
+                        classify_metrics, combine_status_codes)
+from device_store import STATUS_CODES, DeviceStore
+
+
+def make_store(num_fds=2, region='A1'):
+    return DeviceStore.from_rows([(str(fd_id), '127.0.0.1', region, 3000, None) for fd_id in range(num_fds)])
+
+
+def classify(classifier, fd_id, latency, packet_loss=0.0, throughput=1000.0, kind='active'):
+    status = classifier.classify(fd_id, kind, latency, packet_loss, throughput)
+    classifier.field_devices.update_metrics(fd_id, kind + '_metrics', {'status': status})
+    return status
+
+
+def test_classify_metrics_has_no_gaps():
+    assert classify_metrics(150, 2, 1000) == ACCEPTABLE  # Fell through to Unavailable before
+    assert classify_metrics(100, 0, 1000) == GOOD
+    assert classify_metrics(600, 0, 1000) == POOR
+    assert classify_metrics(None, 0, 1000) == UNAVAILABLE
+    assert classify_metrics(100, 100, 1000) == UNAVAILABLE
+
+
+def test_ewma_smooths_single_spikes():
+    classifier = ConnectionClassifier(make_store(), alpha=0.3)
+    for _ in range(5):
+        classify(classifier, '0', 100)
+    # One 450 ms sample moves the average to 205 ms, inside the hysteresis band of 'Good'
+    assert classify(classifier, '0', 450) == 'Good'
+    assert math.isclose(classifier.ewma[('active', 'latency')][0], 100 + 0.3 * 350)
+
+
+def test_hysteresis_band():
+    classifier = ConnectionClassifier(make_store(), alpha=1.0, hysteresis=0.1)
+    assert classify(classifier, '0', 100) == 'Good'
+    assert classify(classifier, '0', 210) == 'Good'  # Worse than 200 ms, but not by 10%
+    assert classify(classifier, '0', 230) == 'Acceptable'
+    assert classify(classifier, '0', 190) == 'Acceptable'  # Better than 200 ms, but not by 10%
+    assert classify(classifier, '0', 170) == 'Good'
+
+
+def test_failed_probe_is_unavailable_at_once():
+    classifier = ConnectionClassifier(make_store(), alpha=0.3)
+    classify(classifier, '0', 100)
+    assert classify(classifier, '0', None, 100.0, 0.0) == 'Unavailable'
+
+
+def test_failed_fetch_does_not_reset_the_hysteresis():
+    store = make_store()
+    classifier = ConnectionClassifier(store, alpha=1.0, hysteresis=0.1)
+    classify(classifier, '0', 100)
+    # ADA marks the FD Unavailable after a failed fetch
+    store.update_metrics('0', 'active_metrics', {'status': 'Unavailable'})
+    # Within the band of 'Good', so still 'Good' rather than a fresh 'Acceptable'
+    assert classify(classifier, '0', 210) == 'Good'
+
+
+def test_region_thresholds():
+    store = DeviceStore.from_rows([('0', '127.0.0.1', 'A1', 3000, None), ('1', '127.0.0.1', 'B2', 3000, None)])
+    strict = Thresholds(50, 1, 500, 100, 5, 100)
+    classifier = ConnectionClassifier(store, alpha=1.0, region_thresholds={'B2': strict})
+    assert classify(classifier, '0', 80) == 'Good'
+    assert classify(classifier, '1', 80) == 'Acceptable'
+
+
+def test_reclassify_applies_new_thresholds():
+    store = make_store()
+    classifier = ConnectionClassifier(store, alpha=1.0, hysteresis=0.0)
+    classify(classifier, '0', 150)
+    classify(classifier, '1', 50)
+    changed = classifier.set_thresholds(Thresholds(100, 1, 500, 500, 5, 100))
+    assert changed == 1
+    assert store['0']['active_metrics']['status'] == 'Acceptable'
+    assert store['1']['active_metrics']['status'] == 'Good'
+
+
+def test_reclassify_skips_dead_rows_of_removed_fds():
+    store = make_store()
+    classifier = ConnectionClassifier(store, alpha=1.0, hysteresis=0.0)
+    classify(classifier, '0', 50)
+    store.remove_devices(['0'])
+    store.add_devices([('0', '127.0.0.1', 'A1', 3000, None)])  # Back, on a new row
+    classify(classifier, '0', 400)
+    assert store['0']['active_metrics']['status'] == 'Acceptable'
+
+    assert classifier.set_thresholds(Thresholds(100, 1, 500, 500, 5, 100)) == 0
+    # The dead row (50 ms) would have written 'Good' over the live row's 'Acceptable'
+    assert store['0']['active_metrics']['status'] == 'Acceptable'
+
+
+def test_grow_keeps_concurrent_samples():
+    store = make_store(1)
+    classifier = ConnectionClassifier(store, alpha=1.0)
+    stop = threading.Event()
+
+    def sample():
+        while not stop.is_set():
+            classifier.classify('0', 'active', 42.0, 0.0, 1000.0)
+
+    thread = threading.Thread(target=sample)
+    thread.start()
+    for fd_id in range(1, 500):
+        store.add_devices([(str(fd_id), '127.0.0.1', 'A1', 3000, None)])
+    stop.set()
+    thread.join()
+    assert classifier.size == store.rows == 500
+    assert classifier.ewma[('active', 'latency')][0] == 42.0
+    assert classifier.classify('499', 'active', 50.0, 0.0, 1000.0) == 'Good'
+
+
+def test_combine_status_codes_ignores_stale_passive():
+    good, poor = STATUS_CODES['Good'], STATUS_CODES['Poor']
+    assert combine_status_codes(good, poor, 1000.0, 1100.0, passive_max_age=600) == poor
+    assert combine_status_codes(good, poor, 1000.0, 2000.0, passive_max_age=600) == good
+    assert combine_status_codes(good, poor, float('nan'), 2000.0) == good
+    assert combine_status_codes(STATUS_CODES[None], poor, 1000.0, 1100.0) == poor
@@ -0,0 +1,89 @@
+# test_config.py
+
+import json
+import re
+
+import pytest
+
+from config import load_config
+
+
+def write_config(tmp_path, values, name='headend.json'):
+    path = tmp_path / name
+    path.write_text(json.dumps(values))
+    return str(path)
+
+
+def test_layers_in_order_of_precedence(tmp_path):
+    path = write_config(tmp_path, {'active': {'engine': 'asyncio', 'threads': 8, 'ping_count': 3}})
+    environ = {'HEADEND_CONFIG': path, 'HEADEND_ACTIVE_THREADS': '12', 'HEADEND_ACTIVE_PING_COUNT': '4'}
+    config = load_config(['--active-ping-count', '7'], environ)
+    assert config.active.engine == 'asyncio'  # File
+    assert config.active.threads == 12  # Environment over file
+    assert config.active.ping_count == 7  # Command line over environment
+    assert config.active.max_concurrency == 500  # Default
+
+
+def test_toml_config(tmp_path):
+    path = tmp_path / 'headend.toml'
+    path.write_text('[ada]\nregion_rate_limits = { A1 = [20, 40] }\n[server]\nmetrics_port = 9200\n')
+    config = load_config(['--config', str(path)], {})
+    assert config.ada.region_rate_limits == {'A1': [20.0, 40.0]}
+    assert config.server.metrics_port == 9200
+
+
+def test_environment_values_are_parsed():
+    config = load_config([], {
+        'HEADEND_LOGGING_JSON_OUTPUT': 'off',
+        'HEADEND_SERVER_METRICS_PORT': 'none',
+        'HEADEND_ADA_DEFAULT_REGION_RATE': '[5, 10]',
+        'HEADEND_ADA_WAIT_TIME': '2.5',
+    })
+    assert config.logging.json_output is False
+    assert config.server.metrics_port is None
+    assert config.ada.default_region_rate == [5.0, 10.0]
+    assert config.ada.wait_time == 2.5
+
+
+def test_file_values_are_coerced_like_environment_values(tmp_path):
+    path = write_config(tmp_path, {
+        'passive': {'capture_workers': '4', 'connection_ttl': 60},
+        'logging': {'json_output': 'false'},
+        'classifier': {'thresholds': ['100', 1, 500, 200, 5, 100]},
+        'server': {'metrics_port': None},
+    })
+    config = load_config(['--config', path], {})
+    assert config.passive.capture_workers == 4
+    assert config.passive.connection_ttl == 60.0 and isinstance(config.passive.connection_ttl, float)
+    assert config.logging.json_output is False
+    assert config.classifier.thresholds == [100.0, 1.0, 500.0, 200.0, 5.0, 100.0]
+    assert config.server.metrics_port is None
+
+
+@pytest.mark.parametrize('values', [
+    {'passive': {'capture_workers': 'four'}},
+    {'passive': {'capture_workers': 2.5}},
+    {'passive': {'capture_workers': True}},
+    {'passive': {'capture_workers': None}},
+    {'passive': {'interface': 3}},
+    {'logging': {'json_output': 1}},
+    {'ada': {'region_rate_limits': [20, 40]}},
+    {'ada': {'region_rate_limits': {'A1': ['fast']}}},
+    {'passive': 4},
+    {'passive': {'no_such_setting': 1}},
+])
+def test_invalid_file_values_are_rejected(tmp_path, values):
+    path = write_config(tmp_path, values)
+    with pytest.raises(ValueError, match=re.escape(path)):
+        load_config(['--config', path], {})
+
+
+def test_invalid_values_are_rejected():
+    with pytest.raises(ValueError, match='HEADEND_ACTIVE_THREADS'):
+        load_config([], {'HEADEND_ACTIVE_THREADS': 'many'})
+    with pytest.raises(ValueError, match='--ada-default-region-rate'):
+        load_config(['--ada-default-region-rate', '{"a": 1}'], {})
+    with pytest.raises(ValueError, match='active.engine'):
+        load_config(['--active-engine', 'fibers'], {})
+    with pytest.raises(ValueError, match='passive.capture_workers'):
+        load_config([], {'HEADEND_PASSIVE_CAPTURE_WORKERS': '0'})
@@ -0,0 +1,87 @@
+# test_device_registry.py
+
+import sqlite3
+
+import pytest
+
+from device_registry import DeviceRegistry
+from device_store import DeviceStore
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'field_devices.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE field_devices (FD_ID INTEGER PRIMARY KEY, IP TEXT, Region TEXT, Port INTEGER, '
+                 'Last_Data_Received TEXT)')
+    conn.executemany('INSERT INTO field_devices (FD_ID, IP, Region, Port) VALUES (?, ?, ?, ?)',
+                     [(fd_id, '10.0.0.1', 'A1', 3000 + fd_id) for fd_id in range(3)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def execute(db_path, sql, *params):
+    conn = sqlite3.connect(db_path)
+    with conn:
+        conn.execute(sql, params)
+    conn.close()
+
+
+def make_store(fd_ids):
+    return DeviceStore.from_rows([(fd_id, '10.0.0.1', 'A1', 3000 + fd_id, None) for fd_id in fd_ids])
+
+
+def test_sync_all_catches_up_with_the_table(db_path):
+    store = make_store([1, 2, 7])
+    registry = DeviceRegistry(store, db_path)
+    added, updated, removed = registry.sync_all()
+    assert (added, updated, removed) == (['0'], [], ['7'])
+    assert sorted(store.keys()) == ['0', '1', '2']
+    registry.stop()
+
+
+def test_poll_applies_logged_changes(db_path):
+    store = make_store(range(3))
+    changes = []
+    store.add_device_listener(lambda *change: changes.append(change))
+    registry = DeviceRegistry(store, db_path)
+    assert registry.sync_all() == ([], [], [])
+    assert registry.poll() == ([], [], [])
+
+    execute(db_path, "INSERT INTO field_devices (FD_ID, IP, Region, Port) VALUES (5, '10.0.0.5', 'B2', 3005)")
+    execute(db_path, "UPDATE field_devices SET Region = 'C3' WHERE FD_ID = 1")
+    execute(db_path, "UPDATE field_devices SET Region = 'C4' WHERE FD_ID = 1")
+    execute(db_path, 'DELETE FROM field_devices WHERE FD_ID = 2')
+    execute(db_path, "UPDATE field_devices SET Last_Data_Received = '2024-01-01T00:00:00' WHERE FD_ID = 0")
+
+    assert registry.poll() == (['5'], ['1'], ['2'])
+    assert changes == [(['5'], ['1'], []), ([], [], ['2'])]
+    assert store.snapshot('1').region == 'C4'
+    assert store.snapshot('5').port == 3005
+    assert '2' not in store
+    assert registry.poll() == ([], [], [])
+    registry.stop()
+
+
+def test_fd_renamed_in_the_table(db_path):
+    store = make_store(range(3))
+    registry = DeviceRegistry(store, db_path)
+    registry.sync_all()
+    execute(db_path, 'UPDATE field_devices SET FD_ID = 9 WHERE FD_ID = 0')
+    assert registry.poll() == (['9'], [], ['0'])
+    registry.stop()
+
+
+def test_shared_store_skips_new_fds_but_updates_the_others(db_path):
+    store = DeviceStore.from_rows([(fd_id, '10.0.0.1', 'A1', 3000 + fd_id, None) for fd_id in range(3)], shared=True)
+    try:
+        registry = DeviceRegistry(store, db_path)
+        registry.sync_all()
+        execute(db_path, "INSERT INTO field_devices (FD_ID, IP, Region, Port) VALUES (5, '10.0.0.5', 'B2', 3005)")
+        execute(db_path, 'UPDATE field_devices SET Port = 4001 WHERE FD_ID = 1')
+        assert registry.poll() == ([], ['1'], [])
+        assert '5' not in store and store.snapshot('1').port == 4001
+        registry.stop()
+    finally:
+        store.close()
@@ -0,0 +1,122 @@
+# test_device_store.py
+
+import threading
+
+from device_store import DeviceStore
+
+
+def make_store(num_fds=4, **kwargs):
+    return DeviceStore.from_rows([(str(fd_id), '127.0.0.1', 'A1', 3000 + fd_id, None) for fd_id in range(num_fds)], **kwargs)
+
+
+def test_record_view_reads_and_writes_columns():
+    store = make_store()
+    fd_info = store['1']
+    fd_info['active_metrics']['latency'] = 120.0
+    fd_info['active_metrics'] = {'status': 'Good', 'packet_loss': 1.0}
+    fd_info['port'] = 4000
+    assert fd_info['port'] == 4000
+    assert store.snapshot('1').active_metrics == {
+        'latency': 120.0, 'packet_loss': 1.0, 'throughput': None, 'status': 'Good', 'last_active': None,
+    }
+    assert store.take_dirty() == [1]
+
+
+def test_view_writes_bump_the_version_and_notify():
+    store = make_store()
+    changes = []
+    store.add_status_listener(lambda fd_id, column, status: changes.append((fd_id, column, status)))
+    store['2']['passive_metrics']['status'] = 'Poor'
+    store.set_status(3, 'active_', 'Good')
+    store.set_status(3, 'active_', 'Good')
+    assert store.snapshot('2').version == 2
+    assert store.snapshot('3').version == 4
+    assert changes == [('2', 'passive_status', 'Poor'), ('3', 'active_status', 'Good')]
+
+
+def test_snapshots_are_never_torn():
+    store = make_store(2)
+    stop = threading.Event()
+    torn = []
+
+    def write_through_views():
+        value = 0.0
+        while not stop.is_set():
+            value += 1
+            store['0']['active_metrics'] = {'latency': value, 'packet_loss': value, 'throughput': value}
+
+    def write_through_update_metrics():
+        value = 0.0
+        while not stop.is_set():
+            value -= 1
+            store.update_metrics('0', 'active_metrics', {'latency': value, 'packet_loss': value, 'throughput': value})
+
+    threads = [threading.Thread(target=write_through_views), threading.Thread(target=write_through_update_metrics)]
+    for thread in threads:
+        thread.start()
+    for _ in range(20000):
+        metrics = store.snapshot('0').active_metrics
+        if not metrics['latency'] == metrics['packet_loss'] == metrics['throughput']:
+            torn.append(metrics)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    assert not torn
+
+
+def test_view_writes_are_not_lost_while_devices_are_added():
+    store = make_store(1)
+    stop = threading.Event()
+    written = [0]
+
+    def write():
+        while not stop.is_set():
+            written[0] += 1
+            store['0']['active_metrics']['latency'] = float(written[0])
+
+    thread = threading.Thread(target=write)
+    thread.start()
+    for fd_id in range(1, 300):
+        store.add_devices([(str(fd_id), '127.0.0.1', 'A1', 3000, None)])
+    stop.set()
+    thread.join()
+    # A write to the column array being replaced would have gone missing
+    assert store['0']['active_metrics']['latency'] == float(written[0])
+
+
+def test_view_of_a_dead_row_does_not_write_to_the_new_row():
+    store = make_store(2)
+    old_view = store['1']['active_metrics']
+    store.remove_devices(['1'])
+    store.add_devices([('1', '10.0.0.1', 'B2', 3001, None)])
+    old_view['status'] = 'Poor'
+    assert store['1']['active_metrics']['status'] is None
+    assert old_view['status'] is None
+
+
+def test_add_devices_dedupes_a_batch():
+    store = make_store(1)
+    added, updated = store.add_devices([
+        ('5', '10.0.0.1', 'A1', 3005, None), ('0', '10.0.0.9', 'A1', 3000, None), (5, '10.0.0.2', 'B2', 3006, None),
+    ])
+    assert added == ['5'] and updated == ['0']
+    assert store.rows == 2 and len(store) == 2
+    snapshot = store.snapshot('5')
+    assert (snapshot.ip_address, snapshot.region, snapshot.port) == ('10.0.0.2', 'B2', 3006)
+
+
+def test_update_device_bumps_the_version():
+    store = make_store(1)
+    assert not store.update_device('0', '127.0.0.1', 'A1', 3000)
+    assert store.snapshot('0').version == 0
+    assert store.update_device('0', '10.0.0.1', 'A1', 3001)
+    snapshot = store.snapshot('0')
+    assert (snapshot.ip_address, snapshot.port, snapshot.version) == ('10.0.0.1', 3001, 2)
+
+
+def test_removed_fd_is_skipped_by_updates():
+    store = make_store(2)
+    store.remove_devices(['1'])
+    store.update_metrics('1', 'active_metrics', {'status': 'Good'})
+    assert store.update_many('active_metrics', [('0', {'status': 'Good'}), ('1', {'status': 'Good'})]) == 1
+    assert '1' not in store and store.rows == 2 and not store.is_live(1)
@@ -0,0 +1,74 @@
+# test_fetch_scheduler.py
+
+import threading
+import time
+
+from fetch_scheduler import FetchScheduler
+
+
+def test_pops_by_due_time_then_priority():
+    scheduler = FetchScheduler()
+    scheduler.schedule('late', 20.0, 1)
+    scheduler.schedule('poor', 10.0, 3)
+    scheduler.schedule('good', 10.0, 1)
+    assert scheduler.ordered() == ['good', 'poor', 'late']
+    assert scheduler.pop_due(15.0) == 'good'
+    assert scheduler.pop_due(15.0) == 'poor'
+    assert scheduler.pop_due(15.0) is None
+    assert scheduler.next_due() == 20.0
+    assert len(scheduler) == 1
+
+
+def test_reschedule_and_remove_leave_stale_entries_behind():
+    scheduler = FetchScheduler()
+    scheduler.schedule('0', 10.0, 1)
+    scheduler.schedule('1', 11.0, 1)
+    scheduler.schedule('0', 30.0, 1)  # Moved back
+    scheduler.remove('1')
+    assert len(scheduler) == 1 and '1' not in scheduler
+    assert scheduler.pop_due(20.0) is None
+    assert scheduler.next_due() == 30.0
+    assert scheduler.pop_due(30.0) == '0'
+    assert scheduler.next_due() is None
+
+
+def test_heap_is_compacted():
+    scheduler = FetchScheduler()
+    for due in range(1000):
+        scheduler.schedule('0', float(due), 1)
+    assert len(scheduler.heap) <= 2 * len(scheduler) + 65
+
+
+def test_rebuild_replaces_the_schedule():
+    scheduler = FetchScheduler()
+    scheduler.schedule('gone', 0.0, 1)
+    scheduler.rebuild(lambda: [(5.0, 2, 'a'), (1.0, 3, 'b')])
+    assert scheduler.ordered() == ['b', 'a']
+    assert 'gone' not in scheduler
+    scheduler.schedule('a', 0.0, 2)
+    assert scheduler.pop_due(0.0) == 'a'
+
+
+def test_wait_returns_on_changes_made_before_it():
+    scheduler = FetchScheduler()
+    changes = scheduler.changes
+    scheduler.wake()  # Came in between reading changes and waiting
+    start = time.monotonic()
+    scheduler.wait(5, changes)
+    assert time.monotonic() - start < 1
+
+
+def test_schedule_wakes_a_waiter():
+    scheduler = FetchScheduler()
+    woken = threading.Event()
+
+    def waiter():
+        scheduler.wait(5)
+        woken.set()
+
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    time.sleep(0.05)
+    scheduler.schedule('0', 0.0, 1)
+    assert woken.wait(1)
+    thread.join()
@@ -0,0 +1,73 @@
+# test_focus_jobs.py
+
+import pytest
+
+from focus_jobs import FocusJob, FocusQueue
+
+
+def test_from_request():
+    job = FocusJob.from_request({'fd_ids': '3, 1,3', 'priority': '20', 'sample_rate': 4, 'deadline': 0.5, 'job_id': 7})
+    assert job.fd_ids == ['3', '1']  # Deduped, in order
+    assert (job.priority, job.sample_interval, job.deadline, job.job_id) == (20, 0.25, 0.5, '7')
+    with pytest.raises(ValueError):
+        FocusJob.from_request({'fd_ids': [1], 'sample_rate': 0})
+    with pytest.raises(KeyError):
+        FocusJob.from_request({'priority': 1})
+
+
+def test_most_urgent_due_sample_first():
+    queue = FocusQueue()
+    low = FocusJob(['1'], priority=5, job_id='low')
+    high = FocusJob(['2'], priority=20, job_id='high')
+    tight = FocusJob(['3'], priority=20, deadline=0.1, job_id='tight')
+    for job in (low, high, tight):
+        queue.submit(job, now=100.0)
+    queue.submit(FocusJob(['4'], priority=50, job_id='later'), now=200.0)
+
+    popped = [queue.pop_due(now=150.0) for _ in range(3)]
+    assert [(job.job_id, fd_id) for job, fd_id, _ in popped] == [('tight', '3'), ('high', '2'), ('low', '1')]
+    assert queue.pop_due(now=150.0) is None
+    assert queue.next_due() == 200.0
+
+
+def test_peek_does_not_reorder():
+    queue = FocusQueue()
+    first = FocusJob(['1', '2'], priority=10, job_id='first')
+    second = FocusJob(['3'], priority=10, job_id='second')
+    queue.submit(first, now=100.0)
+    queue.submit(second, now=100.0)
+    for _ in range(2):
+        assert queue.peek_priority(now=100.0) == 10
+    assert [queue.pop_due(now=100.0)[1] for _ in range(3)] == ['1', '2', '3']
+    assert queue.peek_priority(now=100.0) is None
+
+
+def test_samples_of_ended_jobs_are_dropped():
+    queue = FocusQueue()
+    stale = FocusJob(['1'], priority=50, job_id='job')
+    queue.submit(stale, now=100.0)
+    assert queue.peek_priority(now=100.0) == 50
+    replacement = FocusJob(['2'], priority=5, job_id='job')
+    assert queue.submit(replacement, now=100.0) is stale
+    assert queue.peek_priority(now=100.0) == 5
+    queue.cancel('job')
+    assert queue.peek_priority(now=100.0) is None
+    assert queue.next_due() is None
+
+
+def test_sample_rate_and_expiry():
+    queue = FocusQueue()
+    job = FocusJob(['1'], sample_interval=2.0, duration=5.0)
+    queue.submit(job, now=job.created)
+    _, fd_id, due = queue.pop_due(now=job.created)
+    queue.sample_done(job, fd_id, due, now=due + 0.5)
+    assert queue.next_due() == due + 2.0
+    # Samples missed while busy are skipped rather than bunched up
+    _, fd_id, due = queue.pop_due(now=due + 2.0)
+    queue.sample_done(job, fd_id, due, now=due + 2.5)
+    assert queue.next_due() == due + 2.5
+    # No sample due after the job expires
+    _, fd_id, due = queue.pop_due(now=due + 2.5)
+    queue.sample_done(job, fd_id, due, now=job.created + 5.0)
+    assert queue.next_due() is None
+    assert queue.expire(now=job.created + 5.0) == [job]
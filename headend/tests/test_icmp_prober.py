@@ -0,0 +1,165 @@
+# test_icmp_prober.py
+
+import heapq
+import logging
+import random
+import socket
+import time
+
+import pytest
+
+from icmp_prober import ICMP_ECHO_REPLY, ICMP_HEADER, BatchedIcmpProber, icmp_checksum
+
+
+class FakeIcmpSocket:
+    """
+    Stands in for the ICMP socket, so the prober runs without network access or privileges.
+    Behaves like a datagram ICMP socket: every echo request is answered after latency_ms[ip]
+    (default 1 ms) unless dropped by loss[ip] (0.0-1.0), or the host is in unreachable.
+    Sending to a host in unroutable raises OSError, like sendto() does for those.
+    """
+
+    type = socket.SOCK_DGRAM
+
+    def __init__(self, latency_ms=None, loss=None, unreachable=(), unroutable=(), seed=0):
+        self.latency_ms = latency_ms or {}
+        self.loss = loss or {}
+        self.unreachable = set(unreachable)
+        self.unroutable = set(unroutable)
+        self.random = random.Random(seed)
+        self.timeout = None
+        self.replies = []  # heap of (ready time, ip, reply packet)
+        self.sent = []
+        self.dropped = {}  # ip -> echo requests lost
+        self.closed = False
+
+    def sendto(self, packet, address):
+        ip = address[0]
+        if ip in self.unroutable:
+            raise OSError(101, 'Network is unreachable')
+        self.sent.append((ip, packet))
+        if ip in self.unreachable or self.random.random() < self.loss.get(ip, 0.0):
+            self.dropped[ip] = self.dropped.get(ip, 0) + 1
+            return len(packet)
+        _, code, _, identifier, sequence = ICMP_HEADER.unpack_from(packet)
+        payload = packet[ICMP_HEADER.size:]
+        header = ICMP_HEADER.pack(ICMP_ECHO_REPLY, code, 0, identifier, sequence)
+        reply = ICMP_HEADER.pack(ICMP_ECHO_REPLY, code, icmp_checksum(header + payload), identifier, sequence) + payload
+        ready_at = time.perf_counter() + self.latency_ms.get(ip, 1.0) / 1000
+        heapq.heappush(self.replies, (ready_at, ip, reply))
+        return len(packet)
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def recvfrom(self, bufsize):
+        now = time.perf_counter()
+        limit = now + self.timeout if self.timeout is not None else float('inf')
+        if not self.replies or self.replies[0][0] > limit:
+            time.sleep(max(limit - now, 0) if limit != float('inf') else 0)
+            raise socket.timeout()
+        ready_at, ip, reply = heapq.heappop(self.replies)
+        if ready_at > now:
+            time.sleep(ready_at - now)
+        return reply[:bufsize], (ip, 0)
+
+    def close(self):
+        self.closed = True
+
+
+def make_prober(sock):
+    return BatchedIcmpProber(socket_factory=lambda: sock)
+
+
+def test_latency():
+    sock = FakeIcmpSocket(latency_ms={'10.0.0.1': 20.0, '10.0.0.2': 5.0})
+    results = make_prober(sock).probe(['10.0.0.1', '10.0.0.2'], count=3, timeout=1, interval=0.01)
+
+    slow_latency, slow_loss = results['10.0.0.1']
+    fast_latency, fast_loss = results['10.0.0.2']
+    assert 20.0 <= slow_latency < 100.0
+    assert 5.0 <= fast_latency < slow_latency
+    assert slow_loss == fast_loss == 0.0
+    assert sock.closed
+
+
+def test_partial_loss():
+    sock = FakeIcmpSocket(loss={'10.0.0.1': 0.5}, seed=1)
+    latency, packet_loss = make_prober(sock).probe(['10.0.0.1'], count=20, timeout=0.2, interval=0.001)['10.0.0.1']
+
+    dropped = sock.dropped['10.0.0.1']
+    assert 0 < dropped < 20
+    assert packet_loss == pytest.approx(dropped / 20 * 100)
+    assert latency is not None
+
+
+def test_unreachable_hosts():
+    sock = FakeIcmpSocket(unreachable={'10.0.0.2'}, unroutable={'10.0.0.3'})
+    results = make_prober(sock).probe(['10.0.0.1', '10.0.0.2', '10.0.0.3'], count=2, timeout=0.1, interval=0.001)
+
+    assert results['10.0.0.1'][1] == 0.0
+    assert results['10.0.0.2'] == (None, 100.0)
+    assert results['10.0.0.3'] == (None, 100.0)
+
+
+def test_duplicate_hosts_are_probed_once():
+    sock = FakeIcmpSocket()
+    results = make_prober(sock).probe(['10.0.0.1', '10.0.0.1'], count=2, timeout=0.1, interval=0.001)
+
+    assert list(results) == ['10.0.0.1']
+    assert len(sock.sent) == 2
+
+
+def test_sequence_numbers_do_not_collide_past_65536_requests():
+    # 32768 hosts and 3 rounds: a global 16-bit counter gives round 0 and round 2 of every
+    # host the same sequence number while round 0 is still waiting for its reply
+    hosts = [f'10.{i >> 16}.{(i >> 8) & 0xff}.{i & 0xff}' for i in range(32768)]
+    sock = FakeIcmpSocket()
+    results = make_prober(sock).probe(hosts, count=3, timeout=30, interval=0)
+
+    assert len(sock.sent) == 3 * len(hosts)
+    assert all(packet_loss == 0.0 for _, packet_loss in results.values())
+
+
+def test_count_limited_to_sequence_space():
+    with pytest.raises(ValueError):
+        make_prober(FakeIcmpSocket()).probe(['10.0.0.1'], count=0x10001)
+
+
+def test_socket_errors_report_hosts_unreachable_and_log_once(caplog):
+    def no_socket():
+        raise PermissionError(1, 'Operation not permitted')
+
+    prober = BatchedIcmpProber(socket_factory=no_socket)
+    with caplog.at_level(logging.ERROR, logger='icmp_prober'):
+        for _ in range(3):
+            assert prober.probe(['10.0.0.1', '10.0.0.2']) == {'10.0.0.1': (None, 100.0), '10.0.0.2': (None, 100.0)}
+    assert len(caplog.records) == 1
+
+
+def test_hostnames_are_resolved_and_mapped_back(monkeypatch):
+    names = {'fd-1.example': '10.0.0.1', 'fd-1-alias.example': '10.0.0.1', '10.0.0.2': '10.0.0.2'}
+
+    def gethostbyname(host):
+        if host not in names:
+            raise socket.gaierror(-2, 'Name or service not known')
+        return names[host]
+
+    monkeypatch.setattr(socket, 'gethostbyname', gethostbyname)
+    sock = FakeIcmpSocket()
+    results = make_prober(sock).probe(['fd-1.example', 'fd-1-alias.example', '10.0.0.2', 'gone.example'],
+                                      count=2, timeout=0.1, interval=0.001)
+
+    assert list(results) == ['fd-1.example', 'fd-1-alias.example', '10.0.0.2', 'gone.example']
+    assert results['fd-1.example'][1] == results['fd-1-alias.example'][1] == 0.0
+    assert results['10.0.0.2'][1] == 0.0
+    assert results['gone.example'] == (None, 100.0)
+    assert sorted({ip for ip, _ in sock.sent}) == ['10.0.0.1', '10.0.0.2']
+
+
+def test_short_raw_packets_are_ignored():
+    assert BatchedIcmpProber._parse_reply(b'', True, 1) is None
+    assert BatchedIcmpProber._parse_reply(b'\x45' + b'\x00' * 10, True, 1) is None
+    reply = ICMP_HEADER.pack(ICMP_ECHO_REPLY, 0, 0, 7, 3)
+    assert BatchedIcmpProber._parse_reply(b'\x45' + b'\x00' * 19 + reply, True, 7) == 3
+    assert BatchedIcmpProber._parse_reply(reply, False, 1) == 3
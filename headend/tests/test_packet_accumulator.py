@@ -0,0 +1,49 @@
+# test_packet_accumulator.py
+
+from packet_accumulator import PacketAccumulator
+
+SECOND = 1_000_000_000
+
+
+def test_connections_accumulate_until_popped():
+    accumulator = PacketAccumulator()
+    accumulator.add(('10.0.0.1', 1), 0, 100)
+    accumulator.add(('10.0.0.1', 1), SECOND, 300)
+    accumulator.add(('10.0.0.2', 2), SECOND, 50)
+    assert accumulator.summary(('10.0.0.1', 1))['total_data_size'] == 400
+    stats = accumulator.pop(('10.0.0.1', 1))
+    assert stats.packet_count == 2
+    assert accumulator.pop(('10.0.0.1', 1)) is None
+    assert accumulator.summary(('10.0.0.1', 1)) is None
+    assert len(accumulator) == 1 and accumulator.packets == 3
+
+
+def test_idle_connections_expire_on_capture_time():
+    accumulator = PacketAccumulator(ttl=10)
+    accumulator.add('idle', 0, 100)
+    accumulator.add('busy', 0, 100)
+    accumulator.add('busy', 9 * SECOND, 100)
+    assert 'idle' in accumulator
+    accumulator.add('busy', 11 * SECOND, 100)
+    assert 'idle' not in accumulator and 'busy' in accumulator
+    assert accumulator.evicted_expired == 1
+
+
+def test_recently_updated_connection_is_not_evicted_first():
+    accumulator = PacketAccumulator(ttl=10)
+    accumulator.add('a', 0, 100)
+    accumulator.add('b', SECOND, 100)
+    accumulator.add('a', 5 * SECOND, 100)  # Moves 'a' behind 'b'
+    accumulator.add('c', 12 * SECOND, 100)
+    assert list(accumulator.connections) == ['a', 'c']
+
+
+def test_oldest_connection_is_dropped_when_full():
+    accumulator = PacketAccumulator(max_connections=3)
+    for index, key in enumerate('abc'):
+        accumulator.add(key, index, 100)
+    accumulator.add('a', 3, 100)
+    accumulator.add('d', 4, 100)
+    assert list(accumulator.connections) == ['c', 'a', 'd']
+    assert accumulator.evicted_full == 1
+    assert len(accumulator) == 3
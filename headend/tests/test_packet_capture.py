@@ -0,0 +1,51 @@
+# test_packet_capture.py
+
+import struct
+
+import pytest
+
+from packet_capture import LINKTYPE_ETHERNET, PcapFileCapture
+
+
+def tcp_frame(src_port, seq, payload=b''):
+    tcp = struct.pack('!HHIIBBHHH', src_port, 8765, seq, 0, 0x50, 0x18, 65535, 0, 0)
+    ip = struct.pack('!BBHHHBBH4s4s', 0x45, 0, 20 + len(tcp) + len(payload), 0, 0, 64, 6, 0,
+                     bytes([10, 0, 0, 1]), bytes([10, 0, 0, 2]))
+    return b'\x00' * 12 + b'\x08\x00' + ip + tcp + payload
+
+
+def write_pcap(path, frames, truncate=0):
+    data = struct.pack('<IHHiIII', 0xa1b2c3d4, 2, 4, 0, 0, 65535, LINKTYPE_ETHERNET)
+    for ts_sec, frame, snap_length in frames:
+        captured = frame[:snap_length]
+        data += struct.pack('<IIII', ts_sec, 0, len(captured), len(frame)) + captured
+    path.write_bytes(data[:len(data) - truncate])
+    return str(path)
+
+
+def test_replays_tcp_records(tmp_path):
+    path = write_pcap(tmp_path / 'capture.pcap', [(1, tcp_frame(1000, 5, b'abc'), 1500), (2, tcp_frame(1001, 9), 1500)])
+    records = list(PcapFileCapture(path).records())
+    assert [(r.src_port, r.seq, r.payload_len, r.ts_ns) for r in records] == [(1000, 5, 3, 1_000_000_000), (1001, 9, 0, 2_000_000_000)]
+    assert [r.seq for r in PcapFileCapture(path, port=1001).records()] == [9]  # Source or destination port
+    assert len(list(PcapFileCapture(path, port=8765).records())) == 2
+    assert list(PcapFileCapture(path, port=80).records()) == []
+
+
+def test_frame_cut_short_does_not_read_the_next_record(tmp_path):
+    # Snap length ends inside the TCP header: parsing past it would read the next record
+    path = write_pcap(tmp_path / 'capture.pcap', [(1, tcp_frame(1000, 5), 38), (2, tcp_frame(1001, 9), 10), (3, tcp_frame(1002, 7), 1500)])
+    records = list(PcapFileCapture(path).records())
+    assert [(r.src_port, r.seq) for r in records] == [(1002, 7)]
+
+
+def test_truncated_file_stops_at_the_short_record(tmp_path):
+    path = write_pcap(tmp_path / 'capture.pcap', [(1, tcp_frame(1000, 5), 1500), (2, tcp_frame(1001, 9), 1500)], truncate=10)
+    assert [r.src_port for r in PcapFileCapture(path).records()] == [1000]
+
+
+def test_not_a_pcap_file(tmp_path):
+    path = tmp_path / 'capture.pcap'
+    path.write_bytes(b'\xd4\xc3\xb2\xa1')
+    with pytest.raises(ValueError):
+        list(PcapFileCapture(str(path)).records())
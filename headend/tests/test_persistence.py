@@ -0,0 +1,77 @@
+# test_persistence.py
+
+import sqlite3
+
+import pytest
+
+from device_store import DeviceStore
+from metrics_history import MetricsHistory
+from persistence import StateWriter, restore_state
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = str(tmp_path / 'field_devices.db')
+    conn = sqlite3.connect(path)
+    conn.execute('CREATE TABLE field_devices (FD_ID INTEGER PRIMARY KEY, IP TEXT, Region TEXT, Port INTEGER, '
+                 'Last_Data_Received TEXT)')
+    conn.executemany('INSERT INTO field_devices (FD_ID, IP, Region, Port) VALUES (?, ?, ?, ?)',
+                     [(fd_id, '127.0.0.1', 'A1', 3000) for fd_id in range(3)])
+    conn.commit()
+    conn.close()
+    return path
+
+
+def make_store():
+    return DeviceStore.from_rows([(str(fd_id), '127.0.0.1', 'A1', 3000, None) for fd_id in range(3)])
+
+
+def test_state_round_trip(db_path):
+    store = make_store()
+    store.update_record('1', last_data_received=1700000000.0,
+                        active_metrics={'latency': 12.5, 'packet_loss': 0.0, 'status': 'Good'})
+    writer = StateWriter(store, db_path)
+    assert writer.flush() == 1
+    assert writer.flush() == 0
+    writer.stop()
+
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT Last_Data_Received FROM field_devices WHERE FD_ID = 1').fetchone()[0] is not None
+    conn.close()
+
+    restored_store = make_store()
+    assert restore_state(restored_store, db_path) == 1
+    assert restored_store.snapshot('1').active_metrics['latency'] == 12.5
+    assert restored_store['1']['active_metrics']['status'] == 'Good'
+    assert restored_store.snapshot('1').last_data_received == 1700000000.0
+
+
+def test_failed_state_flush_is_retried(tmp_path, db_path):
+    store = make_store()
+    store.update_metrics('0', 'active_metrics', {'status': 'Poor'})
+    writer = StateWriter(store, str(tmp_path))  # A directory, not a database
+    with pytest.raises(sqlite3.Error):
+        writer.flush()
+    writer.db_path = db_path
+    assert writer.flush() == 1
+    writer.stop()
+
+
+def test_history_samples_are_kept_until_committed(tmp_path, db_path):
+    history = MetricsHistory(capacity=10, db_path=str(tmp_path))
+    history.record('0', 'active', timestamp=1.0, latency=10.0, packet_loss=0.0, throughput=100.0)
+    history.record('1', 'passive', timestamp=2.0, latency=20.0, throughput=50.0)
+    history.forget(['1'])
+    with pytest.raises(sqlite3.Error):
+        history.flush()
+    assert ('1', 'passive') in history.rings  # Not dropped before its samples are written
+
+    history.db_path = db_path
+    assert history.flush() == 2
+    assert history.flush() == 0
+    assert ('1', 'passive') not in history.rings
+    conn = sqlite3.connect(db_path)
+    assert conn.execute('SELECT FD_ID, Kind, Latency, Packet_Loss FROM metrics_history ORDER BY Timestamp').fetchall() == [
+        ('0', 'active', 10.0, 0.0), ('1', 'passive', 20.0, None),
+    ]
+    conn.close()
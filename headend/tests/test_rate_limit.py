@@ -0,0 +1,53 @@
+# test_rate_limit.py
+
+import types
+
+import pytest
+
+import rate_limit
+from rate_limit import RegionRateLimiter, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = types.SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(rate_limit, 'time', types.SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_bucket_allows_a_burst_then_the_rate(clock):
+    bucket = TokenBucket(2, burst=3)
+    assert [bucket.try_acquire() for _ in range(4)] == [True, True, True, False]
+    assert bucket.time_until_available() == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.try_acquire()
+    assert not bucket.try_acquire()
+
+
+def test_bucket_refills_up_to_the_burst(clock):
+    bucket = TokenBucket(10, burst=2)
+    assert bucket.try_acquire(2)
+    clock.now += 60
+    assert bucket.try_acquire(2)
+    assert not bucket.try_acquire()
+
+
+def test_default_burst_and_zero_rate(clock):
+    assert TokenBucket(0.5).burst == 1
+    bucket = TokenBucket(0, burst=1)
+    assert bucket.try_acquire()
+    assert bucket.time_until_available() == float('inf')
+
+
+def test_region_limiter(clock):
+    limiter = RegionRateLimiter({'A1': (1, 1)})
+    assert limiter.try_acquire('A1') == 0.0
+    assert limiter.try_acquire('A1') == pytest.approx(1.0)
+    # Unlisted regions are not limited without a default
+    assert all(limiter.try_acquire('B2') == 0.0 for _ in range(100))
+    assert limiter.bucket('B2') is None
+
+    limiter = RegionRateLimiter(default=(1, 2))
+    assert [limiter.try_acquire('B2') for _ in range(2)] == [0.0, 0.0]
+    assert limiter.try_acquire('B2') > 0
+    assert limiter.try_acquire('C3') == 0.0  # Each region has its own bucket
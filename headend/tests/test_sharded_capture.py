@@ -0,0 +1,95 @@
+# test_sharded_capture.py
+
+import multiprocessing
+import queue
+import threading
+import time
+
+import pytest
+
+from sharded_capture import ShardedCapture, capture_worker
+
+
+class Workers:
+    """
+    capture_worker loops run in threads, fed through their record queues. Replies of the
+    workers in slow are held back by delay seconds, like a worker busy capturing.
+    """
+
+    def __init__(self, count, timeout=0.2, delay=0.5):
+        self.capture = ShardedCapture(count, 'pcap', timeout=timeout)
+        self.record_queues = [queue.Queue() for _ in range(count)]
+        self.delay = delay
+        self.slow = set()
+        self.threads = []
+        for index, record_queue in enumerate(self.record_queues):
+            parent_conn, proxy_conn = multiprocessing.Pipe()
+            worker_conn, child_conn = multiprocessing.Pipe()
+            self.capture.conns.append(parent_conn)
+            self.start(capture_worker, child_conn, None, record_queue, 300, 1000)
+            self.start(self.forward, proxy_conn, worker_conn, None)
+            self.start(self.forward, worker_conn, proxy_conn, index)
+
+    def start(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def forward(self, source, destination, index):
+        while True:
+            try:
+                message = source.recv()
+            except (EOFError, OSError):
+                return
+            if index in self.slow:
+                time.sleep(self.delay)
+            destination.send(message)
+
+    def add(self, index, key, packets):
+        self.record_queues[index].put([(key, i * 1_000_000, 100, None, 0) for i in range(packets)])
+
+    def wait_for_records(self, records):
+        deadline = time.monotonic() + 5
+        while self.capture.stats()['records'] < records:
+            assert time.monotonic() < deadline
+            time.sleep(0.01)
+
+    def close(self):
+        self.capture._broadcast('stop')
+        for record_queue in self.record_queues:
+            record_queue.put(None)
+
+
+@pytest.fixture
+def workers():
+    workers = Workers(2)
+    yield workers
+    workers.slow.clear()
+    workers.close()
+
+
+def test_pop_merges_the_shards(workers):
+    workers.add(0, ('10.0.0.1', 1), 2)
+    workers.add(1, ('10.0.0.1', 1), 3)
+    workers.wait_for_records(5)
+
+    assert workers.capture.pop(('10.0.0.1', 1)).packet_count == 5
+    assert workers.capture.pop(('10.0.0.1', 1)) is None
+
+
+def test_late_reply_is_not_taken_for_the_next_request(workers):
+    workers.add(0, ('10.0.0.1', 1), 2)
+    workers.add(1, ('10.0.0.1', 1), 3)
+    workers.add(0, ('10.0.0.2', 2), 4)
+    workers.add(1, ('10.0.0.2', 2), 5)
+    workers.wait_for_records(14)
+
+    workers.slow.add(1)
+    with pytest.raises(TimeoutError):
+        workers.capture.pop(('10.0.0.1', 1))
+    workers.slow.clear()
+    time.sleep(workers.delay)  # The late reply to the pop is now waiting in the pipe
+
+    # Not 4 + 3 packets from the stale reply meant for 10.0.0.1
+    assert workers.capture.pop(('10.0.0.2', 2)).packet_count == 9
+    assert workers.capture.stats()['records'] == 14
@@ -0,0 +1,132 @@
+# test_sharding.py
+
+import asyncio
+import socket
+import threading
+import time
+
+import pytest
+
+from coordinator import ShardCoordinator
+from device_store import DeviceStore
+from sharding import HashRing, ShardMember, owned_fd_ids
+
+
+def make_store(num_fds=300):
+    return DeviceStore.from_rows([(str(fd_id), '127.0.0.1', f'R{fd_id % 7}', 3000, None) for fd_id in range(num_fds)])
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.02)
+
+
+def test_ring_spreads_keys_and_moves_few_on_leave():
+    ring = HashRing(['a', 'b', 'c', 'd'])
+    keys = [str(key) for key in range(4000)]
+    before = {key: ring.node_for(key) for key in keys}
+    counts = {node: list(before.values()).count(node) for node in ring.nodes}
+    assert all(500 < count < 1500 for count in counts.values()), counts
+
+    ring.remove_node('d')
+    after = {key: ring.node_for(key) for key in keys}
+    moved = [key for key in keys if before[key] != after[key]]
+    # Only the keys of the shard that left move
+    assert all(before[key] == 'd' for key in moved)
+    assert len(moved) == counts['d']
+    assert ring.nodes == ['a', 'b', 'c']
+    assert HashRing().node_for('1') is None
+
+
+def test_owned_fd_ids_partition_the_fleet():
+    store = make_store()
+    shards = ['s1', 's2', 's3']
+    owned = [set(owned_fd_ids(store, shard, shards)) for shard in shards]
+    assert set.union(*owned) == set(store.keys())
+    assert sum(map(len, owned)) == len(store)
+
+    # Region strategy keeps each region on one shard
+    regions = [{store.regions[store.row_of(fd_id)] for fd_id in owned_fd_ids(store, shard, shards, 'region')}
+               for shard in shards]
+    assert sum(map(len, regions)) == 7
+
+
+class Coordinator:
+    """ShardCoordinator serving on free ports in a thread of its own."""
+
+    def __init__(self):
+        self.coordinator = ShardCoordinator('127.0.0.1', free_port(), free_port(), rebalance_delay=0.05)
+        self.loop = asyncio.new_event_loop()
+        self.task = self.loop.create_task(self.coordinator.serve())
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        try:
+            self.loop.run_until_complete(self.task)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.loop.close()
+
+    @property
+    def url(self):
+        return f'ws://127.0.0.1:{self.coordinator.shard_port}'
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.cancel)
+        self.thread.join()
+
+    def cancel(self):
+        if self.coordinator.rebalance_task is not None:
+            self.coordinator.rebalance_task.cancel()
+        self.task.cancel()
+
+
+@pytest.fixture
+def coordinator():
+    coordinator = Coordinator()
+    yield coordinator
+    coordinator.stop()
+
+
+def test_members_split_the_fleet_and_rebalance_when_one_leaves(coordinator):
+    store = make_store()
+    owned = {}
+    members = {}
+    for shard_id in ('s1', 's2', 's3'):
+        members[shard_id] = ShardMember(shard_id, coordinator.url, f'ws://127.0.0.1:9/{shard_id}', store,
+                                        lambda fd_ids, shard_id=shard_id: owned.__setitem__(shard_id, set(fd_ids)),
+                                        reconnect_interval=0.1).start()
+    def split_between(shard_ids):
+        # Every FD owned by exactly one of the shards, and each shard applied the assignment
+        parts = [owned.get(shard_id, set()) for shard_id in shard_ids]
+        return (all(members[shard_id].shards == shard_ids for shard_id in shard_ids)
+                and set.union(*parts) == set(store.keys()) and sum(map(len, parts)) == len(store))
+
+    try:
+        wait_for(lambda: split_between(['s1', 's2', 's3']))
+        assert all(owned.values())
+
+        members.pop('s3').stop()
+        wait_for(lambda: split_between(['s1', 's2']))
+        assert coordinator.coordinator.version >= 2
+    finally:
+        for member in members.values():
+            member.stop()
+
+
+def test_member_can_be_stopped_right_after_start():
+    store = make_store(10)
+    member = ShardMember('s1', f'ws://127.0.0.1:{free_port()}', 'ws://127.0.0.1:9', store, lambda fd_ids: None)
+    member.start().stop()
+    assert member.thread is None and member.loop.is_closed()
+    member.stop()  # Twice is fine
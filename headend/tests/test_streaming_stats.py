@@ -0,0 +1,113 @@
+# test_streaming_stats.py
+
+import random
+import statistics
+
+import pytest
+
+from packet_accumulator import SEQ_MODULO, ConnectionStats
+from streaming_stats import LogHistogram, RunningStats
+
+
+def test_running_stats_match_statistics():
+    rng = random.Random(1)
+    values = [rng.uniform(0, 1000) for _ in range(1000)]
+    stats = RunningStats()
+    for value in values:
+        stats.add(value)
+    assert stats.mean == pytest.approx(statistics.mean(values))
+    assert stats.stddev == pytest.approx(statistics.stdev(values))
+    assert (stats.min, stats.max) == (min(values), max(values))
+
+
+def test_running_stats_merge():
+    rng = random.Random(2)
+    values = [rng.gauss(50, 10) for _ in range(500)]
+    left, right = RunningStats(), RunningStats()
+    for value in values[:123]:
+        left.add(value)
+    for value in values[123:]:
+        right.add(value)
+    left.merge(right)
+    left.merge(RunningStats())
+    assert left.count == 500
+    assert left.mean == pytest.approx(statistics.mean(values))
+    assert left.variance == pytest.approx(statistics.variance(values))
+
+
+def test_histogram_percentiles_within_precision():
+    rng = random.Random(3)
+    values = sorted(rng.lognormvariate(5, 2) for _ in range(10000))
+    histogram = LogHistogram(precision=0.02)
+    for value in values:
+        histogram.add(value)
+    for q in (1, 50, 95, 99, 100):
+        exact = values[max(1, -(-len(values) * q // 100)) - 1]
+        assert histogram.percentile(q) == pytest.approx(exact, rel=0.021)
+
+
+def test_histogram_zeros_and_empty():
+    histogram = LogHistogram()
+    assert histogram.percentile(50) is None
+    for value in (0, 0, 0, 10):
+        histogram.add(value)
+    assert histogram.percentile(50) == 0.0
+    assert histogram.percentile(100) == pytest.approx(10, rel=0.02)
+
+
+def test_histogram_merge():
+    left, right = LogHistogram(), LogHistogram()
+    for value in range(1, 51):
+        left.add(value)
+    for value in range(51, 101):
+        right.add(value)
+    left.merge(right)
+    assert left.count == 100
+    assert left.percentile(90) == pytest.approx(90, rel=0.02)
+
+
+def test_jitter_of_a_constant_rate_is_zero():
+    stats = ConnectionStats()
+    for i in range(100):
+        stats.add(i * 20_000_000, 200)
+    summary = stats.summary()
+    assert summary['jitter_ms'] == 0.0
+    assert summary['inter_arrival_mean_ms'] == pytest.approx(20)
+    assert summary['inter_arrival_p50_ms'] == pytest.approx(20, rel=0.02)
+    assert summary['duration_s'] == pytest.approx(1.98)
+
+
+def test_jitter_follows_rfc_3550():
+    stats = ConnectionStats()
+    timestamps_ms = [0, 20, 50, 70, 100]  # Gaps 20, 30, 20, 30
+    for ts in timestamps_ms:
+        stats.add(ts * 1_000_000, 100)
+    jitter = 0.0
+    for _ in range(3):
+        jitter += (10 - jitter) / 16
+    assert stats.summary()['jitter_ms'] == pytest.approx(jitter)
+
+
+def test_retransmissions_across_sequence_wraparound():
+    stats = ConnectionStats()
+    seq = SEQ_MODULO - 150
+    for i in range(4):
+        stats.add(i, 200, seq=(seq + i * 100) % SEQ_MODULO, payload_len=100)
+    stats.add(5, 200, seq=(seq + 100) % SEQ_MODULO, payload_len=100)  # Sent again
+    stats.add(6, 60, seq=(seq + 400) % SEQ_MODULO, payload_len=0)  # Pure ACK
+    summary = stats.summary()
+    assert summary['retransmissions'] == 1
+    assert summary['retransmission_rate'] == pytest.approx(1 / 6)
+
+
+def test_connection_stats_merge():
+    left, right = ConnectionStats(), ConnectionStats()
+    for i in range(5):
+        left.add(1000 + i, 100)
+        right.add(i, 300)
+    left.merge(right)
+    summary = left.summary()
+    assert summary['packet_count'] == 10
+    assert summary['total_data_size'] == 2000
+    assert summary['size_mean'] == 200
+    assert (left.first_ns, left.last_ns) == (0, 1004)
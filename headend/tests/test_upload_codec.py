@@ -0,0 +1,62 @@
+# test_upload_codec.py
+
+import asyncio
+import json
+import types
+from datetime import datetime
+
+import pytest
+
+from device_store import DeviceStore
+from passive_monitoring import PassiveMonitoring
+from upload_codec import UPLOAD_HEADER, decode_upload, encode_upload
+
+
+def test_decode_json_and_binary():
+    assert decode_upload(json.dumps({'device_id': 7, 'send_timestamp': 1700000000.5})) == ('7', 1700000000.5)
+    assert decode_upload(json.dumps({'device_id': 7, 'send_timestamp': '1700000000'})) == ('7', 1700000000.0)
+    assert decode_upload(encode_upload(7, 1700000000.5, b'data')) == ('7', 1700000000.5)
+
+
+@pytest.mark.parametrize('message', [
+    '{"device_id": 7}',
+    '{"device_id": 7, "send_timestamp": null}',
+    '{"device_id": 7, "send_timestamp": [1]}',
+    '{"device_id": 7, "send_timestamp": "soon"}',
+    '{"device_id": 7, "send_timestamp": 1e400}',
+    '{"device_id": 7, "send_timestamp": true}',
+    '{"device_id": 7, "send_timestamp"',
+    '[1, 2]',
+    b'\xff\xfe',
+    encode_upload(7, 1.0)[:UPLOAD_HEADER.size - 1],
+    encode_upload(7, float('nan')),
+])
+def test_malformed_uploads_raise_value_error(message):
+    with pytest.raises(ValueError):
+        decode_upload(message)
+
+
+class FakeWebSocket:
+    remote_address = ('10.0.0.1', 40000)
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    async def __aiter__(self):
+        for message in self.messages:
+            yield message
+
+
+def test_bad_message_does_not_end_the_connection():
+    store = DeviceStore.from_rows([('7', '10.0.0.1', 'A1', 3000, None)])
+    clock = types.SimpleNamespace(offset=0.0, now=datetime.now)
+    monitor = PassiveMonitoring(store, store.locks, clock=clock)
+    websocket = FakeWebSocket([
+        '{"device_id": 7}',
+        'not json',
+        encode_upload(7, 1.0)[:5],
+        json.dumps({'device_id': 7, 'send_timestamp': 1700000000.0}),
+    ])
+
+    asyncio.run(monitor.process_bulk_upload(websocket))
+    assert [(fd_id, values['status']) for fd_id, values in monitor.pending_updates] == [('7', 'Good')]
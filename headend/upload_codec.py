@@ -0,0 +1,52 @@
+# upload_codec.py
+
+import json
+import math
+import struct
+
+try:
+    import orjson  # Much faster, optional
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
+
+# Binary bulk-upload header: magic, version, device_id, send_timestamp (epoch seconds).
+# The upload data follows the header and is not parsed by the headend.
+UPLOAD_MAGIC = b'P5BU'
+UPLOAD_VERSION = 1
+UPLOAD_HEADER = struct.Struct('!4sBId')
+
+
+def encode_upload(device_id, send_timestamp, payload=b''):
+    """Binary framed bulk upload (what a field device sends instead of the JSON message)."""
+    return UPLOAD_HEADER.pack(UPLOAD_MAGIC, UPLOAD_VERSION, int(device_id), send_timestamp) + payload
+
+
+def decode_upload(message):
+    """
+    Returns (device_id, send_timestamp) of a bulk upload: a binary framed message (magic
+    header) or the original JSON {"device_id": ..., "send_timestamp": ...} text.
+    device_id is returned as a string, the DeviceStore key. Raises ValueError for a malformed
+    message (JSON decode errors are ValueErrors too).
+    """
+    if isinstance(message, (bytes, bytearray, memoryview)) and message[:4] == UPLOAD_MAGIC:
+        if len(message) < UPLOAD_HEADER.size:
+            raise ValueError(f"Truncated upload header ({len(message)} bytes)")
+        _, version, device_id, send_timestamp = UPLOAD_HEADER.unpack_from(message)
+        if version != UPLOAD_VERSION:
+            raise ValueError(f"Unsupported upload version {version}")
+        return str(device_id), _check_timestamp(send_timestamp)
+
+    data = _loads(message)
+    if not isinstance(data, dict):
+        raise ValueError("Upload is not a JSON object")
+    send_timestamp = data.get("send_timestamp")
+    if isinstance(send_timestamp, bool) or not isinstance(send_timestamp, (int, float, str)):
+        raise ValueError(f"Invalid send_timestamp {send_timestamp!r}")
+    return str(data.get("device_id", "Unknown")), _check_timestamp(float(send_timestamp))
+
+
+def _check_timestamp(send_timestamp):
+    if not math.isfinite(send_timestamp) or send_timestamp < 0:
+        raise ValueError(f"Invalid send_timestamp {send_timestamp!r}")
+    return send_timestamp
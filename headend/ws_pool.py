@@ -0,0 +1,215 @@
+# ws_pool.py
+
+import asyncio
+import threading
+import time
+import weakref
+from contextlib import asynccontextmanager
+
+import websockets
+
+
+class ConnectionBackoff(Exception):
+    """Raised when a FD is still in its reconnect backoff window."""
+
+
+class _BackoffState:
+    __slots__ = ('failures', 'retry_at')
+
+    def __init__(self):
+        self.failures = 0
+        self.retry_at = 0.0
+
+
+class WebSocketPool:
+    """
+    Per-FD pool of persistent WebSocket connections.
+
+    Connections are bound to the event loop that opened them, so there is one pool per
+    event loop (see get_pool()). Idle connections are health checked before reuse (state,
+    plus a ping when they were idle longer than keepalive_interval) and evicted after
+    idle_timeout. Failed connects put the FD in an exponential reconnect backoff.
+    """
+
+    def __init__(self, max_idle_per_fd=1, idle_timeout=60, keepalive_interval=20, connect_timeout=5,
+                 backoff_base=1, backoff_max=60):
+        self.max_idle_per_fd = max_idle_per_fd
+        self.idle_timeout = idle_timeout
+        self.keepalive_interval = keepalive_interval
+        self.connect_timeout = connect_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.idle = {}  # (ip, port) -> list of (websocket, last_used)
+        self.idle_connections = 0  # Kept by the loop, so metrics() never walks self.idle from another thread
+        self.backoff = {}  # (ip, port) -> _BackoffState
+        self.last_sweep = 0.0
+        self.stats = {
+            'requests': 0,
+            'reused': 0,
+            'connected': 0,
+            'connect_failures': 0,
+            'backoff_rejections': 0,
+            'discarded': 0,
+            'evicted': 0,
+        }
+
+    @asynccontextmanager
+    async def connection(self, ip_address, port):
+        """Borrow a connection to the FD. It goes back to the pool unless the block raised."""
+        key = (ip_address, port)
+        websocket = await self.acquire(key)
+        try:
+            yield websocket
+        except BaseException:
+            self.stats['discarded'] += 1
+            self._close(websocket)
+            raise
+        else:
+            self.release(key, websocket)
+
+    async def acquire(self, key):
+        self.stats['requests'] += 1
+        now = time.monotonic()
+        if now - self.last_sweep >= 1:
+            self.evict_idle(now)
+
+        # Reuse the most recently used healthy connection
+        idle = self.idle.get(key)
+        while idle:
+            websocket, last_used = idle.pop()
+            self.idle_connections -= 1
+            if await self._is_healthy(websocket, now - last_used):
+                self.stats['reused'] += 1
+                return websocket
+            self.stats['discarded'] += 1
+            self._close(websocket)
+
+        state = self.backoff.get(key)
+        if state and now < state.retry_at:
+            self.stats['backoff_rejections'] += 1
+            raise ConnectionBackoff(f"{key[0]}:{key[1]} in reconnect backoff for {state.retry_at - now:.1f} s")
+
+        uri = f"ws://{key[0]}:{key[1]}"
+        try:
+            websocket = await asyncio.wait_for(websockets.connect(uri, open_timeout=self.connect_timeout), self.connect_timeout)
+        except Exception:
+            self.stats['connect_failures'] += 1
+            state = self.backoff.setdefault(key, _BackoffState())
+            state.failures += 1
+            state.retry_at = time.monotonic() + min(self.backoff_base * 2 ** (state.failures - 1), self.backoff_max)
+            raise
+
+        self.backoff.pop(key, None)
+        self.stats['connected'] += 1
+        return websocket
+
+    def release(self, key, websocket):
+        idle = self.idle.setdefault(key, [])
+        if len(idle) >= self.max_idle_per_fd or not self._is_open(websocket):
+            self._close(websocket)
+            return
+        idle.append((websocket, time.monotonic()))
+        self.idle_connections += 1
+
+    def evict_idle(self, now=None):
+        """Close connections that have been idle longer than idle_timeout."""
+        now = time.monotonic() if now is None else now
+        self.last_sweep = now
+        for key in list(self.idle):
+            keep = []
+            for websocket, last_used in self.idle[key]:
+                if now - last_used > self.idle_timeout or not self._is_open(websocket):
+                    self.stats['evicted'] += 1
+                    self.idle_connections -= 1
+                    self._close(websocket)
+                else:
+                    keep.append((websocket, last_used))
+            if keep:
+                self.idle[key] = keep
+            else:
+                del self.idle[key]
+
+    async def _is_healthy(self, websocket, idle_for):
+        if not self._is_open(websocket):
+            return False
+        if idle_for < self.keepalive_interval:
+            return True
+        try:
+            pong_waiter = await websocket.ping()
+            await asyncio.wait_for(pong_waiter, self.connect_timeout)
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _is_open(websocket):
+        state = getattr(websocket, 'state', None)
+        return getattr(state, 'name', None) == 'OPEN'
+
+    @staticmethod
+    def _close(websocket):
+        # Closing waits for the closing handshake, so it must not block the caller
+        asyncio.ensure_future(websocket.close())
+
+    async def close(self):
+        """Close every idle connection in the pool."""
+        connections = [websocket for idle in self.idle.values() for websocket, _ in idle]
+        self.idle.clear()
+        self.idle_connections = 0
+        await asyncio.gather(*(websocket.close() for websocket in connections), return_exceptions=True)
+
+    @property
+    def reuse_rate(self):
+        requests = self.stats['requests']
+        return self.stats['reused'] / requests if requests else 0.0
+
+    def metrics(self):
+        # Called from the metrics scrape thread: stats has a fixed set of keys, so copying it is safe
+        metrics = dict(self.stats)
+        metrics['idle_connections'] = self.idle_connections
+        metrics['reuse_rate'] = self.reuse_rate
+        return metrics
+
+
+_pools = weakref.WeakKeyDictionary()  # event loop -> WebSocketPool
+_pools_lock = threading.Lock()  # New pools are added from any loop while the metrics scrape walks them
+_pool_settings = {}
+_thread_state = threading.local()
+
+
+def configure_pool(**settings):
+    """Set the WebSocketPool arguments used for pools created from now on."""
+    _pool_settings.update(settings)
+
+
+def get_pool():
+    """Return the connection pool of the running event loop, creating it if needed."""
+    loop = asyncio.get_running_loop()
+    pool = _pools.get(loop)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools[loop] = WebSocketPool(**_pool_settings)
+    return pool
+
+
+def all_pool_metrics():
+    """Metrics of every live pool, summed."""
+    totals = {}
+    with _pools_lock:
+        pools = list(_pools.values())
+    for pool in pools:
+        for name, value in pool.metrics().items():
+            totals[name] = totals.get(name, 0) + value
+    totals['reuse_rate'] = totals['reused'] / totals['requests'] if totals.get('requests') else 0.0
+    return totals
+
+
+def run_on_thread_loop(coro):
+    """
+    Run a coroutine on the calling thread's persistent event loop.
+    Replaces asyncio.run() for callers that want pooled connections to survive between calls.
+    """
+    loop = getattr(_thread_state, 'loop', None)
+    if loop is None or loop.is_closed():
+        loop = _thread_state.loop = asyncio.new_event_loop()
+    return loop.run_until_complete(coro)
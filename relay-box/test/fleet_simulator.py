@@ -0,0 +1,283 @@
+#!/bin/env python
+# fleet_simulator.py
+#
+# Emulates a fleet of field devices in one asyncio process, to load-test the headend without hardware.
+# Every FD gets a WebSocket endpoint on host:base_port + FD_ID (the port layout of setup_field_devices.py)
+# that answers FETCH_DATA with a data blob and echoes anything else (the throughput test), and
+# periodically bulk uploads to the PassiveMonitoring server with its device_id and send_timestamp.
+#
+# Each FD has a network profile (latency, packet loss, bandwidth), from the relay box's
+# sniffer/config.json and fd_profiles.json by default, which the FD applies to its own traffic:
+# - latency: replies are held back by the round-trip time, upload send_timestamps are backdated by the one-way delay
+# - loss: each lost message costs a TCP retransmission timeout (WebSockets run over TCP, so nothing is really lost)
+# - bandwidth: replies and uploads are sent as fragments paced at the FD's rate
+# ICMP pings to the simulator are answered by the host itself, so the active ping sees loopback latency.
+#
+# Usage: python fleet_simulator.py --count 5000 [--host 127.0.0.1] [--base-port 3000]
+#            [--passive-url ws://127.0.0.1:8765] [--upload-format binary] [--write-db field_devices.db]
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import random
+import resource
+import sqlite3
+import sys
+import time
+
+import websockets
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'headend'))
+
+from upload_codec import encode_upload
+
+SNIFFER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sniffer')
+MIN_RTO = 0.2  # Linux minimum TCP retransmission timeout, seconds
+PACE_INTERVAL = 0.01  # Send a fragment about every 10 ms when pacing to a bandwidth
+
+
+class DeviceProfile:
+    """Network conditions of one emulated FD."""
+
+    def __init__(self, name, latency_ms, packet_loss, bandwidth_mbps):
+        self.name = name
+        self.latency_ms = latency_ms  # Round-trip time
+        self.packet_loss = packet_loss  # Percent of messages that need a retransmission
+        self.bandwidth_mbps = bandwidth_mbps  # None = unlimited
+
+    def retransmission_delay(self, rng):
+        """Extra seconds a message takes because of lost packets (each loss costs one, doubling, RTO)."""
+        delay = 0.0
+        rto = max(MIN_RTO, 2 * self.latency_ms / 1000)
+        while self.packet_loss and rng.random() * 100 < self.packet_loss:
+            delay += rto
+            rto *= 2
+        return delay
+
+    def fragments(self, data):
+        """Split data into fragments sent every PACE_INTERVAL at the FD's bandwidth (one piece if unlimited)."""
+        if not self.bandwidth_mbps:
+            return [data], 0.0
+        size = max(1400, int(self.bandwidth_mbps * 1_000_000 / 8 * PACE_INTERVAL))
+        return [data[i:i + size] for i in range(0, len(data), size)] or [data], size * 8 / (self.bandwidth_mbps * 1_000_000)
+
+
+def load_profiles(config_path, fd_profiles_path):
+    """Profile ranges from the sniffer config, {name: (latency range, loss, throughput range)}, and {FD_ID: name}."""
+    with open(config_path) as file:
+        config = json.load(file)
+    ranges = {
+        name: (delay, config.get('packet_loss', {}).get(name, 0), config.get('throughput', {}).get(name))
+        for name, delay in config['network_profiles'].items()
+    }
+    assigned = {}
+    if fd_profiles_path and os.path.exists(fd_profiles_path):
+        with open(fd_profiles_path) as file:
+            assigned = {entry['id']: entry['profile'] for entry in json.load(file)}
+    return ranges, assigned
+
+
+def make_profile(name, ranges, rng):
+    # A fixed latency and bandwidth per FD, drawn from the profile's ranges like sniff.py does
+    delay, loss, throughput = ranges[name]
+    latency_ms = rng.randint(delay['min'], delay['max'])
+    bandwidth_mbps = rng.randint(throughput['min'], throughput['max']) if throughput else None
+    return DeviceProfile(name, latency_ms, loss, bandwidth_mbps)
+
+
+class FleetSimulator:
+    """Hosts the emulated FDs: one WebSocket server per FD plus its bulk upload loop."""
+
+    def __init__(self, devices, host='127.0.0.1', base_port=3000, passive_url=None, upload_interval=10.0,
+                 upload_size=4096, upload_format='json', data_size=1024, seed=0):
+        self.devices = devices  # {FD_ID: DeviceProfile}
+        self.host = host
+        self.base_port = base_port
+        self.passive_url = passive_url
+        self.upload_interval = upload_interval
+        self.upload_size = upload_size
+        self.upload_format = upload_format
+        self.data = b'x' * data_size  # FETCH_DATA reply
+        self.rng = random.Random(seed)
+        self.servers = []
+        self.counters = dict.fromkeys(('connections', 'fetches', 'echoes', 'uploads', 'upload_failures'), 0)
+
+    async def send_paced(self, websocket, profile, data):
+        """Send data as one message, fragmented and paced at the FD's bandwidth."""
+        fragments, pause = profile.fragments(data)
+        if len(fragments) == 1:
+            await websocket.send(fragments[0])
+            return
+
+        async def paced():
+            for index, fragment in enumerate(fragments):
+                if index:
+                    await asyncio.sleep(pause)
+                yield fragment
+
+        await websocket.send(paced())
+
+    async def serve_fd(self, fd_id, websocket, path=None):
+        # path is only passed by older websockets versions
+        profile = self.devices[fd_id]
+        self.counters['connections'] += 1
+        try:
+            async for message in websocket:
+                await asyncio.sleep(profile.latency_ms / 1000 + profile.retransmission_delay(self.rng))
+                if message == 'FETCH_DATA':
+                    self.counters['fetches'] += 1
+                    await self.send_paced(websocket, profile, self.data)
+                else:
+                    self.counters['echoes'] += 1
+                    await self.send_paced(websocket, profile, message)
+        except websockets.exceptions.ConnectionClosed:
+            pass
+        finally:
+            self.counters['connections'] -= 1
+
+    def upload_message(self, fd_id, profile):
+        # The FD 'sent' the upload one-way delay ago, as it would look on a real link
+        send_timestamp = time.time() - profile.latency_ms / 2000
+        if self.upload_format == 'binary':
+            return encode_upload(fd_id, send_timestamp, b'u' * self.upload_size)
+        return json.dumps({'device_id': fd_id, 'send_timestamp': send_timestamp, 'data': 'u' * self.upload_size})
+
+    async def upload_loop(self, fd_id):
+        """Bulk upload every upload_interval seconds over one long-lived connection, reconnecting on errors."""
+        profile = self.devices[fd_id]
+        await asyncio.sleep(self.rng.uniform(0, self.upload_interval))  # Spread the fleet over the interval
+        while True:
+            try:
+                async with websockets.connect(self.passive_url) as websocket:
+                    while True:
+                        await asyncio.sleep(profile.retransmission_delay(self.rng))
+                        await self.send_paced(websocket, profile, self.upload_message(fd_id, profile))
+                        self.counters['uploads'] += 1
+                        await asyncio.sleep(self.upload_interval * self.rng.uniform(0.9, 1.1))
+            except (OSError, asyncio.TimeoutError, websockets.exceptions.WebSocketException):
+                self.counters['upload_failures'] += 1
+                await asyncio.sleep(self.upload_interval)
+
+    async def report(self, interval):
+        previous = dict(self.counters)
+        while True:
+            await asyncio.sleep(interval)
+            current = dict(self.counters)
+            rates = ', '.join(f"{name} {(current[name] - previous[name]) / interval:.1f}/s"
+                              for name in ('fetches', 'echoes', 'uploads', 'upload_failures'))
+            print(f"[{time.strftime('%H:%M:%S')}] {len(self.devices)} FDs, {current['connections']} open connections | {rates}")
+            previous = current
+
+    async def run(self, report_interval=10):
+        for fd_id in self.devices:
+            server = await websockets.serve(functools.partial(self.serve_fd, fd_id), self.host, self.base_port + fd_id)
+            self.servers.append(server)
+        print(f"Serving {len(self.devices)} FDs on {self.host}:{self.base_port + min(self.devices)}-{self.base_port + max(self.devices)}")
+
+        tasks = [asyncio.ensure_future(self.report(report_interval))]
+        if self.passive_url:
+            tasks += [asyncio.ensure_future(self.upload_loop(fd_id)) for fd_id in self.devices]
+            print(f"Bulk uploading to {self.passive_url} every {self.upload_interval}s ({self.upload_format})")
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            for server in self.servers:
+                server.close()
+
+
+def write_db(path, devices, host, base_port, regions):
+    """(Re)create the field_devices table so the headend loads the simulated fleet."""
+    conn = sqlite3.connect(path)
+    cursor = conn.cursor()
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS field_devices (
+        FD_ID INTEGER PRIMARY KEY,
+        IP TEXT NOT NULL,
+        Region TEXT NOT NULL,
+        Port INTEGER NOT NULL,
+        Last_Data_Received TEXT
+    );
+    ''')
+    cursor.execute('DELETE FROM field_devices')
+    cursor.executemany('INSERT INTO field_devices (FD_ID, IP, Region, Port) VALUES (?, ?, ?, ?)',
+                       [(fd_id, host, regions[fd_id % len(regions)], base_port + fd_id) for fd_id in devices])
+    conn.commit()
+    conn.close()
+    print(f"Wrote {len(devices)} field devices to {path}")
+
+
+def raise_open_file_limit(needed):
+    # Every FD needs a listening socket plus its connections
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft != resource.RLIM_INFINITY and soft < needed:
+        new_soft = needed if hard == resource.RLIM_INFINITY else min(needed, hard)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (new_soft, hard))
+        if new_soft < needed:
+            print(f"Warning: open file limit is {new_soft}, {needed} may be needed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Emulate a fleet of field devices for load-testing the headend')
+    parser.add_argument('--count', type=int, default=1000, help='number of FDs')
+    parser.add_argument('--first-id', type=int, default=0)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--base-port', type=int, default=3000, help='FD n listens on base_port + n')
+    parser.add_argument('--passive-url', default=None, help='PassiveMonitoring server, e.g. ws://127.0.0.1:8765 (no uploads if unset)')
+    parser.add_argument('--upload-interval', type=float, default=10.0)
+    parser.add_argument('--upload-size', type=int, default=4096, help='bytes of upload data per bulk upload')
+    parser.add_argument('--upload-format', choices=('json', 'binary'), default='json')
+    parser.add_argument('--data-size', type=int, default=1024, help='bytes of the FETCH_DATA reply')
+    parser.add_argument('--config', default=os.path.join(SNIFFER_DIR, 'config.json'), help='network profile ranges')
+    parser.add_argument('--fd-profiles', default=os.path.join(SNIFFER_DIR, 'fd_profiles.json'), help='profile of each FD ID')
+    parser.add_argument('--profile-mix', default='GOOD=0.6,NORMAL=0.3,SLOW=0.1',
+                        help='profile weights for FDs not in --fd-profiles')
+    parser.add_argument('--latency-ms', type=int, help='override: round-trip latency of every FD')
+    parser.add_argument('--loss', type=float, help='override: packet loss percent of every FD')
+    parser.add_argument('--bandwidth-mbps', type=float, help='override: bandwidth of every FD (0 = unlimited)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--write-db', metavar='PATH', help='write the fleet to a field_devices database and exit')
+    parser.add_argument('--regions', default='A1', help='comma-separated regions assigned round-robin (--write-db)')
+    parser.add_argument('--report-interval', type=float, default=10.0)
+    args = parser.parse_args()
+
+    fd_ids = range(args.first_id, args.first_id + args.count)
+    if args.write_db:
+        write_db(args.write_db, fd_ids, args.host, args.base_port, args.regions.split(','))
+        return
+
+    rng = random.Random(args.seed)
+    ranges, assigned = load_profiles(args.config, args.fd_profiles)
+    mix = [part.split('=') for part in args.profile_mix.split(',')]
+    names, weights = [name for name, _ in mix], [float(weight) for _, weight in mix]
+    devices = {}
+    for fd_id in fd_ids:
+        name = assigned.get(fd_id) or rng.choices(names, weights)[0]
+        profile = make_profile(name, ranges, rng)
+        if args.latency_ms is not None:
+            profile.latency_ms = args.latency_ms
+        if args.loss is not None:
+            profile.packet_loss = args.loss
+        if args.bandwidth_mbps is not None:
+            profile.bandwidth_mbps = args.bandwidth_mbps or None
+        devices[fd_id] = profile
+
+    counts = {}
+    for profile in devices.values():
+        counts[profile.name] = counts.get(profile.name, 0) + 1
+    print(f"Profiles: {counts}")
+
+    raise_open_file_limit(3 * args.count + 256)
+    simulator = FleetSimulator(devices, args.host, args.base_port, args.passive_url, args.upload_interval,
+                               args.upload_size, args.upload_format, args.data_size, args.seed)
+    try:
+        asyncio.run(simulator.run(args.report_interval))
+    except KeyboardInterrupt:
+        print("Stopping the fleet simulator")
+
+
+if __name__ == "__main__":
+    main()